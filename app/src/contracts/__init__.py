@@ -157,6 +157,11 @@ def create_app(config_obj, configfiles=None, init_for_operation=True):
         app.add_url_rule('/favicon.ico', endpoint='favicon',
                         redirect_to=url_for('static', filename='favicon.ico'))
 
+    # upload queued google drive documents, including any left when the app last stopped
+    if init_for_operation:
+        from .driveupload import start_uploadworker
+        start_uploadworker(app)
+
     # ----------------------------------------------------------------------
     @app.before_request
     def before_request():
@@ -0,0 +1,346 @@
+###########################################################################################
+#   asyncrunsignup - asyncio access methods for runsignup.com
+#
+#   Date        Author      Reason
+#   ----        ------      ------
+#   10/18/26    Lou King    Create
+#   10/18/26    Lou King    don't retry non-GET requests which may have been sent
+#
+#   Copyright 2026 Lou King
+###########################################################################################
+'''
+asyncrunsignup - asyncio access methods for runsignup.com
+===========================================================
+
+:class:`AsyncRunSignUp` has the same methods as :class:`contracts.runsignup.RunSignUp`, as coroutines
+sharing one connection pool. It's meant for jobs which fan out over many races, events and pages.
+
+:class:`SyncRunSignUp` runs an AsyncRunSignUp on a background event loop, so it can be used from
+Flask views and cli commands
+'''
+
+# standard
+import asyncio
+from json import dumps
+from threading import Thread
+from time import monotonic
+
+# pypi
+import aiohttp
+
+# home grown
+from . import runsignup
+from .runsignup import RequestScheduler, BITESIZE, couponrequest
+from running.runsignup import accessError, parameterError
+
+########################################################################
+class AsyncRunSignUp():
+########################################################################
+    '''
+    asyncio access methods for RunSignUp.com
+
+    use as ``async with AsyncRunSignUp(...) as rsu:``, or call open() and close()
+
+    :param key: key from runsignup (direct key, no OAuth)
+    :param secret: secret from runsignup (direct secret, no OAuth)
+    :param api_reg_token: API caller registration token, sent as rsu_api_reg GET parameter
+    :param api_reg_secret: API caller registration secret, sent as X-RSU-API-REG-SECRET header
+    :param concurrency: max number of requests in flight, which is also the connection pool size
+    :param scheduler: :class:`contracts.runsignup.RequestScheduler` for rate limit and retry policy, shared
+        with other clients using the same credentials. Default is a scheduler for this client only
+    '''
+
+    #----------------------------------------------------------------------
+    def __init__(self, key=None, secret=None, api_reg_token=None, api_reg_secret=None, concurrency=10,
+                 scheduler=None, debug=False):
+    #----------------------------------------------------------------------
+        if (key and not secret) or (secret and not key):
+            raise parameterError('key and secret must be supplied together')
+        if (api_reg_token and not api_reg_secret) or (api_reg_secret and not api_reg_token):
+            raise parameterError('api_reg_token and api_reg_secret must be supplied together')
+
+        self.key = key
+        self.secret = secret
+        self.api_reg_token = api_reg_token
+        self.api_reg_secret = api_reg_secret
+        self.concurrency = concurrency
+        self.scheduler = scheduler or RequestScheduler()
+        self.debug = debug
+        self.client_credentials = {}
+        self.session = None
+
+    #----------------------------------------------------------------------
+    async def __aenter__(self):
+    #----------------------------------------------------------------------
+        await self.open()
+        return self
+
+    #----------------------------------------------------------------------
+    async def __aexit__(self, exc_type, exc_value, traceback):
+    #----------------------------------------------------------------------
+        await self.close()
+
+    #----------------------------------------------------------------------
+    async def open(self):
+    #----------------------------------------------------------------------
+        headers = {}
+        if self.api_reg_secret:
+            headers['X-RSU-API-REG-SECRET'] = self.api_reg_secret
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency),
+                                             headers=headers)
+
+        if self.key:
+            self.client_credentials = {'api_key': self.key, 'api_secret': self.secret}
+        if self.api_reg_token:
+            self.client_credentials['rsu_api_reg'] = self.api_reg_token
+
+    #----------------------------------------------------------------------
+    async def close(self):
+    #----------------------------------------------------------------------
+        self.client_credentials = {}
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    #----------------------------------------------------------------------
+    async def _request(self, method, url, **kwargs):
+    #----------------------------------------------------------------------
+        '''
+        send request within the scheduler's rate limit, retrying per the scheduler's policy
+
+        :return: (status, url, json data or None)
+        '''
+        scheduler = self.scheduler
+        endpoint = scheduler.endpoint(url)
+        attempt = 0
+        while True:
+            wait = scheduler.bucket.tryacquire()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = scheduler.bucket.tryacquire()
+
+            start = monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    status = resp.status
+                    data = await resp.json(content_type=None) if status == 200 else None
+                    headers = resp.headers
+                    respurl = str(resp.url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                scheduler.record(endpoint, monotonic() - start, error=True)
+                # non-GET requests may not be idempotent, so are only retried if not sent, see RequestScheduler
+                if (attempt >= scheduler.maxretries
+                        or (method.upper() != 'GET' and not isinstance(e, aiohttp.ClientConnectorError))):
+                    raise
+                delay = scheduler.backoff(attempt)
+            else:
+                scheduler.record(endpoint, monotonic() - start, error=status != 200)
+                delay = scheduler.retrydelay(method, status, headers, attempt)
+                if delay is None:
+                    return status, respurl, data
+
+            attempt += 1
+            scheduler.recordretry(endpoint)
+            await asyncio.sleep(delay)
+
+    #----------------------------------------------------------------------
+    async def _rsuget(self, methodurl, **payload):
+    #----------------------------------------------------------------------
+        '''
+        get method for runsignup access (json format response)
+
+        :param methodurl: runsignup method url to call
+        :param **payload: parameters for the method
+        '''
+        params = self.client_credentials.copy()
+        params.update(payload)
+        params.update({'format': 'json'})
+        # aiohttp only accepts str, int, float params
+        params = {k: v if isinstance(v, (str, int, float)) and not isinstance(v, bool) else str(v)
+                  for k, v in params.items()}
+
+        status, url, data = await self._request('GET', methodurl, params=params)
+        return self._checkresponse(status, url, data)
+
+    #----------------------------------------------------------------------
+    async def _rsupost(self, methodurl, **data):
+    #----------------------------------------------------------------------
+        '''
+        post method for runsignup access
+
+        :param methodurl: runsignup method url to call
+        :param **data: parameters for the method
+        '''
+        thispayload = self.client_credentials.copy()
+        thispayload.update(data)
+        thispayload.update({
+            'format':'json',
+            'request_format':'json',
+        })
+
+        status, url, data = await self._request('POST', methodurl, data=thispayload)
+        return self._checkresponse(status, url, data)
+
+    #----------------------------------------------------------------------
+    def _checkresponse(self, status, url, data):
+    #----------------------------------------------------------------------
+        if status != 200:
+            raise accessError('HTTP response code={}, url={}'.format(status, url))
+        if 'error' in data:
+            raise accessError('RSU response code={}-{}, url={}'.format(data['error']['error_code'], data['error']['error_msg'], url))
+        return data
+
+    #----------------------------------------------------------------------
+    async def _getpages(self, methodurl, pageitems, **params):
+    #----------------------------------------------------------------------
+        '''
+        return the items from all pages of a paged RunSignUp method, in page order
+
+        the first page is fetched alone. While pages are full, the next self.concurrency pages are
+        fetched together. The total isn't known, so pages past the end may be requested; these come back empty
+
+        :param methodurl: runsignup method url to call
+        :param pageitems: function(data) which returns the list of items in a page's response data
+        :param params: parameters for the method, other than page and results_per_page
+        '''
+        async def getpage(page):
+            return pageitems(await self._rsuget(methodurl, page=page, results_per_page=BITESIZE, **params))
+
+        items = await getpage(1)
+        if len(items) < BITESIZE:
+            return items
+
+        nextpage = 2
+        while True:
+            pages = await asyncio.gather(*[getpage(page) for page in range(nextpage, nextpage + self.concurrency)])
+            nextpage += self.concurrency
+            for theseitems in pages:
+                items += theseitems
+                # stop when we've reached the end of the data
+                if len(theseitems) < BITESIZE:
+                    return items
+
+    #----------------------------------------------------------------------
+    async def getcoupons(self, race_id, coupon_code=None):
+    #----------------------------------------------------------------------
+        """
+        return coupons accessible to this application
+
+        :param race_id: id of race
+        :param coupon_code: coupon code for specific coupon, None for all coupons
+        """
+        params = {}
+        if coupon_code:
+            params['coupon_code'] = coupon_code
+        return await self._getpages(runsignup.coupons_url.format(race_id=race_id),
+                                    lambda data: data['coupons'],
+                                    **params)
+
+    #----------------------------------------------------------------------
+    async def setcoupon(self, race_id, coupon_code, start, expiration, numregistrations, clientname, coupon_id=None):
+    #----------------------------------------------------------------------
+        """
+        add or edit coupon, see :meth:`contracts.runsignup.RunSignUp.setcoupon`
+        """
+        request = couponrequest(coupon_code, start, expiration, numregistrations, clientname, coupon_id=coupon_id)
+        data = await self._rsupost(runsignup.coupons_url.format(race_id=race_id),
+                                   race_id=race_id, request_format='json', request=dumps(request))
+        return data['coupons']
+
+    #----------------------------------------------------------------------
+    async def getraceevents(self, race_id):
+    #----------------------------------------------------------------------
+        """
+        return events for race information accessible to this application
+
+        :param race_id: id of race
+        """
+        data = await self._rsuget(runsignup.race_url.format(race_id=race_id))
+        return data['race']['events']
+
+    #----------------------------------------------------------------------
+    async def getraceparticipants(self, race_id, event_id, **kwargs):
+    #----------------------------------------------------------------------
+        """
+        return race participants accessible to this application
+
+        :param race_id: id of race
+        :param event_id: id of event (instance of event for race in a given year)
+        """
+        return await self._getpages(runsignup.raceparticipants_url.format(race_id=race_id),
+                                    lambda data: data[0].get('participants', []),
+                                    event_id=event_id, **kwargs)
+
+    #----------------------------------------------------------------------
+    async def getremovedparticipants(self, race_id, event_id, **kwargs):
+    #----------------------------------------------------------------------
+        """
+        return removed race participants accessible to this application
+
+        :param race_id: id of race
+        :param event_id: id of event (instance of event for race in a given year)
+        """
+        return await self._getpages(runsignup.removedparticipants_url.format(race_id=race_id),
+                                    lambda data: data[0].get('event', {}).get('participants', []),
+                                    event_id=event_id, **kwargs)
+
+########################################################################
+class SyncRunSignUp():
+########################################################################
+    '''
+    synchronous access to :class:`AsyncRunSignUp`, for Flask views and cli commands
+
+    the AsyncRunSignUp and its connection pool live on an event loop in a background thread, so they
+    can be reused across calls, and from several threads. Use as a context manager, or call open() and close()
+
+    :param kwargs: AsyncRunSignUp() arguments
+    '''
+    METHODS = ['getcoupons', 'setcoupon', 'getraceevents', 'getraceparticipants', 'getremovedparticipants']
+
+    #----------------------------------------------------------------------
+    def __init__(self, **kwargs):
+    #----------------------------------------------------------------------
+        self.client = AsyncRunSignUp(**kwargs)
+        self.loop = None
+        self.thread = None
+
+    #----------------------------------------------------------------------
+    def __enter__(self):
+    #----------------------------------------------------------------------
+        self.open()
+        return self
+
+    #----------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+    #----------------------------------------------------------------------
+        self.close()
+
+    #----------------------------------------------------------------------
+    def open(self):
+    #----------------------------------------------------------------------
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, name='asyncrunsignup', daemon=True)
+        self.thread.start()
+        self.run(self.client.open())
+
+    #----------------------------------------------------------------------
+    def close(self):
+    #----------------------------------------------------------------------
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    #----------------------------------------------------------------------
+    def run(self, coro):
+    #----------------------------------------------------------------------
+        '''run coroutine on the client's event loop, and return its result'''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    #----------------------------------------------------------------------
+    def __getattr__(self, name):
+    #----------------------------------------------------------------------
+        if name not in self.METHODS:
+            raise AttributeError(name)
+        method = getattr(self.client, name)
+        return lambda *args, **kwargs: self.run(method(*args, **kwargs))
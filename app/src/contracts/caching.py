@@ -4,16 +4,27 @@ caching - summary caching for database tables
 '''
 
 # standard
-from time import time
+from time import time, perf_counter
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import chain
+from collections import Counter
+from queue import Queue, Empty
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
 
 # pypi
 from flask import current_app
+from fasteners import InterProcessLock
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from loutilities.timeu import asctime, dt2epoch
-from loutilities.transform import Transform
 from pytz import timezone
 
 # homegrown
-from .dbmodel import db, SponsorRace, SponsorRaceRegCache
+from .dbmodel import db, SponsorRace, SponsorRaceRegCache, SponsorRaceRegCount, SponsorRaceCoupon
+from .dbmodel import SponsorRaceRegEvent, SponsorRaceRegPii
+from .dbmodel import SponsorRaceEventSync
 from .helpers import make_runsignup_client
 from .version import __docversion__
 
@@ -22,6 +33,443 @@ mdy = asctime('%m/%d/%Y')
 regtime = asctime('%m/%d/%Y %H:%M')
 getdate = lambda d: ymd.dt2asc(mdy.asc2dt(d.split(' ')[0]))
 
+# number of registrations handled by each bulk database statement
+REGCACHE_BATCHSIZE = 500
+
+# number of RunSignUp datetime strings remembered by parse_rsudatetime(); registration times are to 
+# the minute, so many participants share them
+RSUDATETIME_CACHESIZE = 16384
+
+# registration cache isn't refreshed from the Race Registrations view if updated within this many seconds
+# override with RACEREGCACHE_MAXAGE in config
+RACEREGCACHE_MAXAGE = 5*60
+
+# participant queries for an event's delta sync, each sent with the event's high-water mark. RunSignUp's 
+# modified_after_timestamp includes new registrations, so one query is enough. Override with 
+# REGCACHE_DELTA_PARAMS in config, e.g., add 'registered_after_timestamp' to also query by registration time
+REGCACHE_DELTA_PARAMS = ['modified_after_timestamp']
+
+# background refreshes are deduplicated across gunicorn worker processes by a lockfile keyed on race's service 
+# provider id. File locks belong to the process, so each process has one InterProcessLock per lockfile, which 
+# is only acquired, released or checked with _refreshlocks_lock held
+REGCACHE_LOCKFILE = '/tmp/contracts_raceregcache_{}.lock'
+_refreshlocks = {}
+_refreshlocks_lock = Lock()
+
+def _batches(items, size):
+    """yield successive size-length slices of items"""
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+def _regroup(pages, size):
+    """yield lists of up to size items, collected from an iterable of pages (lists)
+    
+    only one group is held at a time, and the next page is being fetched while the caller handles a group
+    """
+    group = []
+    for page in pages:
+        group += page
+        while len(group) >= size:
+            yield group[:size]
+            group = group[size:]
+    if group:
+        yield group
+
+def _upsert_rows(model, rows, existing, key='registration_id'):
+    """insert or update model's rows, keyed by unique column key
+    
+    MySQL uses a single INSERT ... ON DUPLICATE KEY UPDATE for the batch. Other databases (e.g., sqlite
+    used for testing) bulk insert / bulk update based on existing
+    
+    :param model: SponsorRaceRegCache, SponsorRaceRegPii or SponsorRaceRegEvent
+    :param rows: list of column dicts, all with the same keys, including key
+    :param existing: {key value: id, ...} for rows which are already in the table
+    :param key: name of unique column
+    """
+    table = model.__table__
+    if db.session.get_bind(model).dialect.name == 'mysql':
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in rows[0] if c != key})
+        db.session.execute(stmt)
+        return
+    
+    inserts = [row for row in rows if row[key] not in existing]
+    updates = [dict(row, id=existing[row[key]]) for row in rows if row[key] in existing]
+    if inserts:
+        db.session.bulk_insert_mappings(model, inserts)
+    if updates:
+        db.session.bulk_update_mappings(model, updates)
+
+def _cachedregistrations(regids):
+    """return {registration_id: (id, event_id, registration_date, is_active), ...} for regids in the cache"""
+    c = SponsorRaceRegCache
+    rows = (db.session.query(c.registration_id, c.id, c.event_id, c.registration_date, c.is_active)
+            .filter(c.registration_id.in_(regids)).all())
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def _cachedpii(regids):
+    """return {registration_id: id, ...} for regids in SponsorRaceRegPii"""
+    c = SponsorRaceRegPii
+    return dict(db.session.query(c.registration_id, c.id).filter(c.registration_id.in_(regids)).all())
+
+def upsert_regevent(event):
+    """add event to SponsorRaceRegEvent, or update its name
+    
+    :param event: RunSignUp event
+    """
+    c = SponsorRaceRegEvent
+    existing = dict(db.session.query(c.event_id, c.id).filter(c.event_id == event['event_id']).all())
+    _upsert_rows(SponsorRaceRegEvent, [dict(event_id=event['event_id'], name=event['name'])], existing, key='event_id')
+
+def _apply_regcounts(race_id, deltas):
+    """add deltas to SponsorRaceRegCount rows for race
+    
+    :param race_id: SponsorRace.id
+    :param deltas: Counter({(event_id, registration_day): delta, ...}), registration_day is date
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta != 0}
+    if not deltas:
+        return
+    
+    table = SponsorRaceRegCount.__table__
+    if db.session.get_bind(SponsorRaceRegCount).dialect.name == 'mysql':
+        stmt = mysql_insert(table).values([
+            dict(race_id=race_id, event_id=event_id, registration_day=day, regcount=delta)
+            for (event_id, day), delta in deltas.items()])
+        stmt = stmt.on_duplicate_key_update(regcount=table.c.regcount + stmt.inserted.regcount)
+        db.session.execute(stmt)
+        return
+
+    c = SponsorRaceRegCount
+    existing = {(event_id, day): (id, regcount) for id, event_id, day, regcount in
+                db.session.query(c.id, c.event_id, c.registration_day, c.regcount)
+                .filter(c.race_id == race_id, c.event_id.in_({event_id for event_id, day in deltas})).all()}
+    inserts = [dict(race_id=race_id, event_id=key[0], registration_day=key[1], regcount=delta)
+               for key, delta in deltas.items() if key not in existing]
+    updates = [dict(id=existing[key][0], regcount=existing[key][1] + delta)
+               for key, delta in deltas.items() if key in existing]
+    if inserts:
+        db.session.bulk_insert_mappings(SponsorRaceRegCount, inserts)
+    if updates:
+        db.session.bulk_update_mappings(SponsorRaceRegCount, updates)
+
+def _uniqueregistrations(pages):
+    """filter pages of participants so each registration_id is only seen once"""
+    seen = set()
+    for page in pages:
+        page = [p for p in page if p['registration_id'] not in seen]
+        seen.update(p['registration_id'] for p in page)
+        yield page
+
+def upsert_regcache(participants, event, xform, race_id):
+    """add participants to cache, or update their entries, in batches of REGCACHE_BATCHSIZE
+    
+    registration columns go to SponsorRaceRegCache, and participant details to SponsorRaceRegPii.
+    Caller maintains the event's SponsorRaceRegEvent row, see upsert_regevent()
+    
+    race's SponsorRaceRegCount rows are adjusted for registrations which are new, reactivated, or moved 
+    to a different event or registration day
+    
+    :param participants: list of RunSignUp participants
+    :param event: RunSignUp event the participants registered for
+    :param xform: RegCacheTransform, see regcache_xform()
+    :param race_id: SponsorRace.id
+    """
+    for batch in _batches(participants, REGCACHE_BATCHSIZE):
+        # same registration may be in the list more than once, last one wins
+        rows = {}
+        piirows = {}
+        for participant in batch:
+            row, piirow = xform.rows(participant, event['event_id'])
+            rows[row['registration_id']] = row
+            piirows[row['registration_id']] = piirow
+        
+        cached = _cachedregistrations(list(rows))
+        deltas = Counter()
+        for id, event_id, registration_date, is_active in cached.values():
+            if is_active and registration_date:
+                deltas[event_id, registration_date.date()] -= 1
+        for row in rows.values():
+            if row['registration_date']:
+                deltas[row['event_id'], row['registration_date'].date()] += 1
+        
+        _upsert_rows(SponsorRaceRegCache, list(rows.values()), {regid: cached[regid][0] for regid in cached})
+        _upsert_rows(SponsorRaceRegPii, list(piirows.values()), _cachedpii(list(piirows)))
+        _apply_regcounts(race_id, deltas)
+
+def deactivate_regcache(participants, race_id):
+    """make removed participants inactive, in batches of REGCACHE_BATCHSIZE
+    
+    registrations which aren't in the cache are ignored. This can happen if registration and transfer
+    happened since last cache update
+    
+    :param participants: list of RunSignUp removed participants
+    :param race_id: SponsorRace.id
+    """
+    regids = [p['registration_id'] for p in participants]
+    for batch in _batches(regids, REGCACHE_BATCHSIZE):
+        deltas = Counter()
+        for id, event_id, registration_date, is_active in _cachedregistrations(batch).values():
+            if is_active and registration_date:
+                deltas[event_id, registration_date.date()] -= 1
+        (SponsorRaceRegCache.query
+         .filter(SponsorRaceRegCache.registration_id.in_(batch))
+         .update({SponsorRaceRegCache.is_active: False}, synchronize_session=False))
+        _apply_regcounts(race_id, deltas)
+
+@lru_cache(maxsize=RSUDATETIME_CACHESIZE)
+def parse_rsudatetime(rsudatetime):
+    """return datetime for RunSignUp 'm/d/yyyy hh:mm' string
+    
+    the fixed format is split directly, which is much faster than strptime; other formats fall back 
+    to strptime
+    """
+    try:
+        thedate, thetime = rsudatetime.split(' ')
+        month, day, year = thedate.split('/')
+        hour, minute = thetime.split(':')
+        return datetime(int(year), int(month), int(day), int(hour), int(minute))
+    except ValueError:
+        return regtime.asc2dt(rsudatetime)
+
+class RegCacheTransform():
+    '''
+    transform from RunSignUp participant to SponsorRaceRegCache and SponsorRaceRegPii rows
+    
+    the columns are fixed, so rows are built directly rather than through a 
+    loutilities.transform.Transform mapping
+    '''
+    def rows(self, participant, event_id):
+        """return (SponsorRaceRegCache column dict, SponsorRaceRegPii column dict) for participant
+        
+        :param participant: RunSignUp participant
+        :param event_id: RunSignUp event id the participant registered for
+        """
+        regid = participant['registration_id']
+        regdate = participant['registration_date']
+        user = participant['user']
+        dob = user['dob']
+        row = {
+            'registration_id': regid,
+            'event_id': event_id,
+            'registration_date': parse_rsudatetime(regdate) if regdate else None,
+            'last_modified_ts': participant['last_modified'],
+            'is_active': True,
+        }
+        piirow = {
+            'registration_id': regid,
+            'first_name': user['first_name'],
+            'last_name': user['last_name'],
+            'email': user['email'],
+            'gender': user['gender'],
+            'dob': date.fromisoformat(dob) if dob else None,
+        }
+        return row, piirow
+
+_regcache_xform = RegCacheTransform()
+
+def regcache_xform():
+    """return RegCacheTransform from RunSignUp participant to registration cache rows"""
+    return _regcache_xform
+
+def regcache_counts(event_ids):
+    """return active registration counts per event and registration day, aggregated by the database
+    
+    :param event_ids: list of RunSignUp event ids
+    :return: [(event_id, 'yyyy-mm-dd', count), ...] ordered by event_id, registration day
+    """
+    regday = func.date(SponsorRaceRegCache.registration_date)
+    rows = (db.session.query(SponsorRaceRegCache.event_id, regday, func.count())
+            .filter(SponsorRaceRegCache.event_id.in_(event_ids), SponsorRaceRegCache.is_active == True)
+            .group_by(SponsorRaceRegCache.event_id, regday)
+            .order_by(SponsorRaceRegCache.event_id, regday)
+            .all())
+    # mysql DATE() gives date, sqlite gives text
+    return [(event_id, day if isinstance(day, str) else ymd.dt2asc(day), count) for event_id, day, count in rows
+            if day is not None]
+
+def race_regcounts(race_id, event_ids):
+    """return active registration counts per event and registration day from SponsorRaceRegCount
+    
+    :param race_id: SponsorRace.id
+    :param event_ids: list of RunSignUp event ids
+    :return: [(event_id, 'yyyy-mm-dd', count), ...] ordered by event_id, registration day
+    """
+    c = SponsorRaceRegCount
+    rows = (db.session.query(c.event_id, c.registration_day, c.regcount)
+            .filter(c.race_id == race_id, c.event_id.in_(event_ids), c.regcount != 0)
+            .order_by(c.event_id, c.registration_day)
+            .all())
+    return [(event_id, ymd.dt2asc(day), count) for event_id, day, count in rows]
+
+def rebuild_regcounts(race_id, event_ids):
+    """replace race's SponsorRaceRegCount rows with counts aggregated from the registration cache
+    
+    NOTE: caller must commit to database after call
+    
+    :param race_id: SponsorRace.id
+    :param event_ids: list of RunSignUp event ids for the race
+    :return: [(event_id, 'yyyy-mm-dd', oldcount, newcount), ...] for counts which were inconsistent
+    """
+    old = {(event_id, day): count for event_id, day, count in race_regcounts(race_id, event_ids)}
+    new = {(event_id, day): count for event_id, day, count in regcache_counts(event_ids)}
+    
+    SponsorRaceRegCount.query.filter_by(race_id=race_id).delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(SponsorRaceRegCount, [
+        dict(race_id=race_id, event_id=event_id, registration_day=ymd.asc2dt(day).date(), regcount=count)
+        for (event_id, day), count in new.items()])
+    
+    return [(event_id, day, old.get((event_id, day), 0), new.get((event_id, day), 0)) 
+            for event_id, day in sorted(old.keys() | new.keys()) 
+            if old.get((event_id, day), 0) != new.get((event_id, day), 0)]
+
+def event_regcloses(event, racetz):
+    """return latest registration close time for event, as epoch time (UTC)
+    
+    :param event: RunSignUp event
+    :param racetz: pytz timezone for race
+    """
+    latestenddate = 0
+    for regperiod in event['registration_periods']:
+        # the epoch times are UTC
+        regclosedt = racetz.localize(parse_rsudatetime(regperiod['registration_closes']))
+        thisregcloses = dt2epoch(regclosedt)
+        if thisregcloses > latestenddate:
+            latestenddate = thisregcloses
+    return latestenddate
+
+def eventsyncs(race):
+    """return {event_id: synced_ts, ...} for race's events which have been synced successfully"""
+    return dict(db.session.query(SponsorRaceEventSync.event_id, SponsorRaceEventSync.synced_ts)
+                .filter_by(race_id=race.id).filter(SponsorRaceEventSync.synced_ts != None).all())
+
+def raceregcache_version(race):
+    """return (version, lastupdatets) for race's registration cache data
+    
+    race's cacheupdatets only changes when all its events are refreshed without error, but each event is
+    committed as it completes (see refresh_raceregcaches), so version includes the events' high-water marks
+    
+    :param race: SponsorRace
+    :return: version string which changes whenever any of race's cached data is committed, and timestamp 
+        of the latest update or None
+    """
+    maxsynced, sumsynced = (db.session.query(func.max(SponsorRaceEventSync.synced_ts), func.sum(SponsorRaceEventSync.synced_ts))
+                            .filter_by(race_id=race.id).one())
+    lastupdatets = max(race.cacheupdatets or 0, maxsynced or 0) or None
+    return f'{race.cacheupdatets}.{maxsynced}.{sumsynced}', lastupdatets
+
+def event_since(race, syncs, event_id):
+    """return high-water mark for event's delta sync
+    
+    events which haven't been synced individually use the race's cacheupdatets
+    
+    :param race: SponsorRace
+    :param syncs: from eventsyncs(race)
+    :param event_id: RunSignUp event id
+    """
+    return syncs.get(event_id, race.cacheupdatets)
+
+def record_eventsync(race_id, event, startts, duration, numupdated=None, numremoved=None, error=None):
+    """record result of event's sync
+    
+    a successful sync advances the event's high-water mark to startts. A failed sync leaves it where it was,
+    so the next sync resumes from there
+    
+    NOTE: caller must commit to database after call
+    
+    :param race_id: SponsorRace.id
+    :param event: RunSignUp event
+    :param startts: timestamp when the sync started
+    :param duration: seconds the sync took
+    :param numupdated: number of participants updated
+    :param numremoved: number of participants removed
+    :param error: error message if sync failed, else None
+    """
+    sync = SponsorRaceEventSync.query.filter_by(race_id=race_id, event_id=event['event_id']).one_or_none()
+    if not sync:
+        sync = SponsorRaceEventSync(race_id=race_id, event_id=event['event_id'], totalduration=0, numsyncs=0,
+                                    numfailures=0)
+        db.session.add(sync)
+    sync.event_name = f'{event["name"]} {event["start_time"]}'
+    sync.lastattempt_ts = startts
+    sync.lastduration = duration
+    sync.totalduration += duration
+    sync.numsyncs += 1
+    if error is None:
+        sync.synced_ts = startts
+        sync.numupdated = numupdated
+        sync.numremoved = numremoved
+        sync.numfailures = 0
+        sync.lasterror = None
+    else:
+        sync.numfailures += 1
+        sync.lasterror = error
+
+def eventsync_report(race_ids=None):
+    """return sync state and cost for events, costliest first
+    
+    :param race_ids: list of SponsorRace.id to report, None for all races
+    :return: [dict(race=, event_id=, event=, numsyncs=, totalduration=, meanduration=, lastduration=, 
+        numupdated=, numremoved=, numfailures=, lasterror=, synced_ts=, lastattempt_ts=), ...]
+    """
+    query = SponsorRaceEventSync.query
+    if race_ids is not None:
+        query = query.filter(SponsorRaceEventSync.race_id.in_(race_ids))
+    report = []
+    for sync in query.order_by(SponsorRaceEventSync.totalduration.desc()).all():
+        report.append(dict(race=sync.race.race, event_id=sync.event_id, event=sync.event_name, 
+                           numsyncs=sync.numsyncs, totalduration=sync.totalduration, 
+                           meanduration=sync.totalduration / sync.numsyncs if sync.numsyncs else 0,
+                           lastduration=sync.lastduration, numupdated=sync.numupdated, numremoved=sync.numremoved,
+                           numfailures=sync.numfailures, lasterror=sync.lasterror, 
+                           synced_ts=sync.synced_ts, lastattempt_ts=sync.lastattempt_ts))
+    return report
+
+def update_eventregcache(rsu, race_id, event, since, xform, sponsorrace_id):
+    """update race registration cache for one event
+    
+    NOTE: caller should wrap this with try/except, and must commit to database after call
+    
+    :param rsu: open RunSignUp client
+    :param race_id: service provider id for race
+    :param event: RunSignUp event
+    :param since: only get participants changed since this timestamp (event's high-water mark), None for all participants
+    :param xform: RegCacheTransform from regcache_xform()
+    :param sponsorrace_id: SponsorRace.id, for SponsorRaceRegCount rows
+    :return: (number of participants updated, number of participants removed)
+    """
+    # get participants updated since last registration update, see REGCACHE_DELTA_PARAMS
+    # NOTE: this includes the participants from the last second again, 
+    # as it's possible there was a registration during the last second and we don't want to drop those
+    if since is not None:
+        params = current_app.config.get('REGCACHE_DELTA_PARAMS', REGCACHE_DELTA_PARAMS)
+        pages = _uniqueregistrations(chain(
+            *[rsu.iterraceparticipants(race_id, event['event_id'], **{param: since}) for param in params]
+        ))
+    else:
+        pages = rsu.iterraceparticipants(race_id, event['event_id'])
+        
+    # add participants to cache, or update their entries
+    # the database is updated for each group while RunSignUp is fetching the next pages
+    upsert_regevent(event)
+    numupdated = 0
+    for participants in _regroup(pages, REGCACHE_BATCHSIZE):
+        upsert_regcache(participants, event, xform, sponsorrace_id)
+        numupdated += len(participants)
+    
+    if since is not None:
+        rempages = rsu.iterremovedparticipants(race_id, event['event_id'], modified_after_timestamp=since)
+    else:
+        rempages = rsu.iterremovedparticipants(race_id, event['event_id'])
+
+    # make removed participants inactive
+    numremoved = 0
+    for remparticipants in _regroup(rempages, REGCACHE_BATCHSIZE):
+        deactivate_regcache(remparticipants, sponsorrace_id)
+        numremoved += len(remparticipants)
+    
+    return numupdated, numremoved
+
 def update_raceregcache(race_id, onlyrecentevents=True):
     """update race registration cache
     
@@ -32,17 +480,7 @@ def update_raceregcache(race_id, onlyrecentevents=True):
     :return: events (https://runsignup.com/API/race/:race_id/GET "events" list converted to dict)
     """
     # set up transformation from RunSignUp format to database cache format
-    rsudt = asctime('%m/%d/%Y %H:%M')
-    xformmap = dict(
-        registration_date   = lambda r: rsudt.asc2dt(r['registration_date']),
-        last_modified_ts    = 'last_modified',
-        first_name          = lambda r: r['user']['first_name'],
-        last_name           = lambda r: r['user']['last_name'],
-        email               = lambda r: r['user']['email'],
-        gender              = lambda r: r['user']['gender'],
-        dob                 = lambda r: ymd.asc2dt(r['user']['dob']) if r['user']['dob'] else None,
-    )   
-    xform = Transform(xformmap, sourceattr=False)
+    xform = regcache_xform()
     
     # get info about race
     race = SponsorRace.query.filter_by(couponproviderid=race_id, display=True).one_or_none()
@@ -63,66 +501,314 @@ def update_raceregcache(race_id, onlyrecentevents=True):
     with make_runsignup_client() as rsu:
         # get race, event data from service provider
         events = rsu.getraceevents(race_id)
+        syncs = eventsyncs(race)
         
         # loop through all events for this race
         for event in events:
-            # skip events which completed before the last time we updated the cache
-            latestenddate = 0
-            for regperiod in event['registration_periods']:
-                # the epoch times are UTC
-                regclosedt = racetz.localize(regtime.asc2dt(regperiod['registration_closes']))
-                thisregcloses = dt2epoch(regclosedt)
-                if thisregcloses > latestenddate:
-                    latestenddate = thisregcloses
-                    
-            if onlyrecentevents and race.cacheupdatets > latestenddate: continue
+            # skip events which completed before the last time we updated the event's cache
+            since = event_since(race, syncs, event['event_id']) if onlyrecentevents else None
+            if since is not None and since > event_regcloses(event, racetz): continue
         
             # ok, we're processing an event
             current_app.logger.info(f'update_raceregcache(): processing {race.race} {event["name"]} {event["start_time"]}')
-        
-            # get participants updated since last registration update
-            # NOTE: this includes the participants from the last second again, 
-            # as it's possible there was a registration during the last second and we don't want to drop those
-            if onlyrecentevents:
-                participants = rsu.getraceparticipants(race.couponproviderid, event['event_id'], modified_after_timestamp=race.cacheupdatets)
-                participant_regids = {p['registration_id'] for p in participants}
-                regparticipants = rsu.getraceparticipants(race.couponproviderid, event['event_id'], registered_after_timestamp=race.cacheupdatets)
-                participants += [p for p in regparticipants if p['registration_id'] not in participant_regids]
-            else:
-                participants = rsu.getraceparticipants(race.couponproviderid, event['event_id'])
-                
-            # add participant to cache, or update their entry
-            for participant in participants:
-                regid = participant['registration_id']
-                thisparticipant = SponsorRaceRegCache.query.filter_by(registration_id=regid).one_or_none()
-                if not thisparticipant:
-                    thisparticipant = SponsorRaceRegCache(registration_id=regid)
-                    db.session.add(thisparticipant)
-                xform.transform(participant, thisparticipant)
-                thisparticipant.event_id = event['event_id']
-                thisparticipant.event_name = event['name']
-                thisparticipant.is_active = True
-            
-            if onlyrecentevents:
-                remparticipants = rsu.getremovedparticipants(race.couponproviderid, event['event_id'], modified_after_timestamp=race.cacheupdatets)
-            else:
-                remparticipants = rsu.getremovedparticipants(race.couponproviderid, event['event_id'])
-
-            # make removed participants inactive
-            for participant in remparticipants:
-                regid = participant['registration_id']
-                thisparticipant = SponsorRaceRegCache.query.filter_by(registration_id=regid).one_or_none()
-                
-                if thisparticipant:
-                    thisparticipant.is_active = False
-                
-                # this can happen if registration and transfer happened since last cache update
-                else:
-                    pass
-                    # current_app.logger.warning(f'update_raceregcache(): registration id {regid} not found when removing registration from {race.race} {thisevent} {racedate}')
+            eventsyncts = int(time())
+            start = perf_counter()
+            numupdated, numremoved = update_eventregcache(rsu, race.couponproviderid, event, since, xform, race.id)
+            record_eventsync(race.id, event, eventsyncts, perf_counter() - start, numupdated, numremoved)
             
+    # full refresh replaces the daily counts, which keeps them consistent with the cache
+    if not onlyrecentevents:
+        rebuild_regcounts(race.id, [e['event_id'] for e in events])
+
     # update timestamp for next cache update
     race.cacheupdatets = cacheupdatets
 
     # save the caller from contacting runsignup again
     return events
+
+def _regcacheworker(app, jobs, results):
+    """worker for refresh_raceregcaches, handles event jobs from the queue until it's empty
+    
+    each worker has its own app context (so its own database session) and RunSignUp client
+    
+    :param app: Flask app
+    :param jobs: queue of job dicts
+    :param results: list to append job results to
+    """
+    with app.app_context():
+        xform = regcache_xform()
+        with make_runsignup_client() as rsu:
+            while True:
+                try:
+                    job = jobs.get_nowait()
+                except Empty:
+                    break
+                
+                result = dict(race=job['race'], race_id=job['race_id'], event=job['event']['name'], 
+                              start_time=job['event']['start_time'], error=None)
+                start = perf_counter()
+                eventsyncts = int(time())
+                try:
+                    result['updated'], result['removed'] = update_eventregcache(
+                        rsu, job['couponproviderid'], job['event'], job['since'], xform, job['race_id'])
+                    result['duration'] = perf_counter() - start
+                    record_eventsync(job['race_id'], job['event'], eventsyncts, result['duration'],
+                                     result['updated'], result['removed'])
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.exception(f'_regcacheworker(): error processing {job["race"]} {job["event"]["name"]}')
+                    result['error'] = str(e)
+                    result['duration'] = perf_counter() - start
+                    # the event's partial updates are discarded, and it resumes from its high-water mark next time
+                    record_eventsync(job['race_id'], job['event'], eventsyncts, result['duration'], error=str(e))
+                    db.session.commit()
+                results.append(result)
+        db.session.remove()
+
+def refresh_raceregcaches(races, workers=4, onlyrecentevents=True):
+    """update race registration cache for several races, events are handled in parallel by a worker pool
+    
+    each event is committed with its high-water mark and sync stats when it completes. An event which fails
+    is rolled back, its failure is recorded, and it is retried from its own high-water mark next time without 
+    affecting the others. A race's cacheupdatets is only updated if all its events completed without error
+    
+    :param races: list of SponsorRace to refresh, couponprovider must be RunSignUp
+    :param workers: number of workers
+    :param onlyrecentevents: False to refresh all events, and all participants within each event
+    :return: (list of race result dicts, list of event result dicts)
+    """
+    app = current_app._get_current_object()
+    jobs = Queue()
+    raceresults = []
+    
+    # collect events from service provider
+    with make_runsignup_client() as rsu:
+        for race in races:
+            start = perf_counter()
+            cacheupdatets = int(time())
+            racetz = timezone(race.timezone)
+            events = rsu.getraceevents(race.couponproviderid)
+            syncs = eventsyncs(race)
+            numjobs = 0
+            for event in events:
+                # skip events which completed before the last time we updated the event's cache
+                since = event_since(race, syncs, event['event_id']) if onlyrecentevents else None
+                if since is not None and since > event_regcloses(event, racetz): continue
+                jobs.put(dict(race=race.race, race_id=race.id, couponproviderid=race.couponproviderid, 
+                              event=event, since=since))
+                numjobs += 1
+            raceresults.append(dict(race=race.race, race_id=race.id, cacheupdatets=cacheupdatets, 
+                                    event_ids=[e['event_id'] for e in events], numevents=len(events), numjobs=numjobs, geteventsduration=perf_counter()-start))
+
+    # end this session's transaction, otherwise (e.g., with REPEATABLE READ) it wouldn't see the workers' commits
+    db.session.commit()
+
+    # process events in parallel
+    eventresults = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='regcache') as executor:
+        futures = [executor.submit(_regcacheworker, app, jobs, eventresults) for i in range(workers)]
+        for future in futures:
+            future.result()
+    
+    # update timestamp for next cache update, for races which completed
+    for raceresult in raceresults:
+        thisevents = [r for r in eventresults if r['race_id'] == raceresult['race_id']]
+        raceresult['eventsduration'] = sum(r['duration'] for r in thisevents)
+        raceresult['errors'] = len([r for r in thisevents if r['error']])
+        if not raceresult['errors']:
+            race = db.session.get(SponsorRace, raceresult['race_id'], populate_existing=True)
+            race.cacheupdatets = raceresult['cacheupdatets']
+            # full refresh replaces the daily counts, which keeps them consistent with the cache
+            if not onlyrecentevents:
+                rebuild_regcounts(race.id, raceresult['event_ids'])
+    db.session.commit()
+    
+    return raceresults, eventresults
+
+def _refreshlock(race_id):
+    """return this process's InterProcessLock for race's background refresh, call with _refreshlocks_lock held"""
+    path = REGCACHE_LOCKFILE.format(race_id)
+    if path not in _refreshlocks:
+        _refreshlocks[path] = InterProcessLock(path)
+    return _refreshlocks[path]
+
+def raceregcache_refreshing(race_id):
+    """return True if background refresh of race registration cache is running, in this or another process
+    
+    :param race_id: service provider id for race
+    """
+    with _refreshlocks_lock:
+        lock = _refreshlock(race_id)
+        if lock.acquired:
+            return True
+        # this process doesn't hold the lock, and can't take it meanwhile, so checking whether another process
+        # holds it doesn't release anything
+        if not lock.acquire(blocking=False):
+            return True
+        lock.release()
+        return False
+
+def refresh_raceregcache_background(race_id, onlyrecentevents=True, maxage=0):
+    """start background refresh of race registration cache, unless the cache is fresh or is already being refreshed
+    
+    :param race_id: service provider id for race
+    :param onlyrecentevents: False to refresh all events, and all participants within each event
+    :param maxage: don't refresh if cache was updated within this many seconds
+    :return: True if refresh was started
+    """
+    race = SponsorRace.query.filter_by(couponproviderid=race_id, display=True).one()
+    if time() - race.cacheupdatets < maxage:
+        return False
+    
+    with _refreshlocks_lock:
+        lock = _refreshlock(race_id)
+        if lock.acquired or not lock.acquire(blocking=False):
+            return False
+
+    app = current_app._get_current_object()
+    def refresh():
+        try:
+            with app.app_context():
+                try:
+                    update_raceregcache(race_id, onlyrecentevents=onlyrecentevents)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception(f'refresh_raceregcache_background(): error refreshing {race_id}')
+                finally:
+                    db.session.remove()
+        finally:
+            with _refreshlocks_lock:
+                lock.release()
+    
+    Thread(target=refresh, name=f'regcache-{race_id}', daemon=True).start()
+    return True
+
+# coupon fields kept in SponsorRaceCoupon, besides race_id and coupon_code
+COUPON_FIELDS = ['coupon_id', 'start_date', 'end_date', 'max_num_race_registrants', 'num_uses', 'coupon_notes']
+
+def upsert_couponindex(race_id, coupons):
+    """add coupons to race's coupon index, or update their entries, keyed by coupon_code
+    
+    if more than one coupon has the same code, the last is the current one
+    
+    NOTE: caller must commit to database after call
+    
+    :param race_id: SponsorRace.id
+    :param coupons: list of RunSignUp coupons
+    """
+    now = int(time())
+    rows = list({c['coupon_code']: dict({f: c.get(f) for f in COUPON_FIELDS}, race_id=race_id,
+                                        coupon_code=c['coupon_code'], updated_ts=now)
+                 for c in coupons}.values())
+    
+    table = SponsorRaceCoupon.__table__
+    ismysql = db.session.get_bind(SponsorRaceCoupon).dialect.name == 'mysql'
+    for batch in _batches(rows, REGCACHE_BATCHSIZE):
+        if ismysql:
+            stmt = mysql_insert(table).values(batch)
+            stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in batch[0] 
+                                                 if c not in ['race_id', 'coupon_code']})
+            db.session.execute(stmt)
+            continue
+        
+        c = SponsorRaceCoupon
+        existing = dict(db.session.query(c.coupon_code, c.id)
+                        .filter(c.race_id == race_id, c.coupon_code.in_([row['coupon_code'] for row in batch])).all())
+        inserts = [row for row in batch if row['coupon_code'] not in existing]
+        updates = [dict(row, id=existing[row['coupon_code']]) for row in batch if row['coupon_code'] in existing]
+        if inserts:
+            db.session.bulk_insert_mappings(SponsorRaceCoupon, inserts)
+        if updates:
+            db.session.bulk_update_mappings(SponsorRaceCoupon, updates)
+
+def couponindex(race_id, coupon_codes=None):
+    """return {coupon_code: coupon, ...} from race's coupon index
+    
+    :param race_id: SponsorRace.id
+    :param coupon_codes: list of coupon codes to look up, None for all coupons
+    :return: coupons are dicts with coupon_code and COUPON_FIELDS, as returned by RunSignUp
+    """
+    c = SponsorRaceCoupon
+    query = db.session.query(c.coupon_code, *[getattr(c, f) for f in COUPON_FIELDS]).filter(c.race_id == race_id)
+    if coupon_codes is None:
+        rows = query.all()
+    else:
+        rows = []
+        for batch in _batches(list(coupon_codes), REGCACHE_BATCHSIZE):
+            rows += query.filter(c.coupon_code.in_(batch)).all()
+    return {row.coupon_code: row._asdict() for row in rows}
+
+def reconcile_couponindex(rsu, race):
+    """replace race's coupon index with all of race's coupons at RunSignUp
+    
+    NOTE: caller must commit to database after call
+    
+    :param rsu: open RunSignUp client
+    :param race: SponsorRace
+    :return: dict(added=n, changed=n, removed=n, total=n)
+    """
+    indexed = couponindex(race.id)
+    current = {c['coupon_code']: c for c in rsu.getcoupons(race.couponproviderid)}
+
+    removed = indexed.keys() - current.keys()
+    for batch in _batches(list(removed), REGCACHE_BATCHSIZE):
+        (SponsorRaceCoupon.query.filter(SponsorRaceCoupon.race_id == race.id, SponsorRaceCoupon.coupon_code.in_(batch))
+         .delete(synchronize_session=False))
+    
+    changed = [c for code, c in current.items() 
+               if code in indexed and any(str(indexed[code][f]) != str(c.get(f)) for f in COUPON_FIELDS)]
+    added = [c for code, c in current.items() if code not in indexed]
+    upsert_couponindex(race.id, added + changed)
+    
+    return dict(added=len(added), changed=len(changed), removed=len(removed), total=len(current))
+
+def refresh_couponindex(rsu, race, coupon_codes):
+    """refresh race's coupon index entries for coupon_codes from RunSignUp, e.g., to pick up usage
+    
+    each code is looked up individually, so use reconcile_couponindex() for many codes
+    
+    NOTE: caller must commit to database after call
+    
+    :param rsu: open RunSignUp client
+    :param race: SponsorRace
+    :param coupon_codes: list of coupon codes
+    :return: {coupon_code: coupon, ...} for codes found at RunSignUp
+    """
+    found = {}
+    for code in coupon_codes:
+        # rsu search includes any coupons with the code within the coupon string, so need to match exactly
+        coupons = [c for c in rsu.getcoupons(race.couponproviderid, coupon_code=code) if c['coupon_code'] == code]
+        if coupons:
+            found[code] = coupons[-1]
+    
+    missing = [code for code in coupon_codes if code not in found]
+    if missing:
+        (SponsorRaceCoupon.query.filter(SponsorRaceCoupon.race_id == race.id, SponsorRaceCoupon.coupon_code.in_(missing))
+         .delete(synchronize_session=False))
+    upsert_couponindex(race.id, list(found.values()))
+    return found
+
+def sync_racecoupons(rsu, race, coupons):
+    """make race's RunSignUp coupons match coupons, using race's coupon index rather than scanning RunSignUp
+    
+    the index is built with :func:`reconcile_couponindex` if race has no entries yet, and the
+    coupons which are sent are written to the index. Coupons changed directly at RunSignUp aren't 
+    seen until the next reconcile (``flask contract reconcilecoupons``)
+    
+    NOTE: caller must commit to database after call
+    
+    :param rsu: open RunSignUp client
+    :param race: SponsorRace
+    :param coupons: list of coupons from :func:`contracts.runsignup.couponspec`
+    :return: see :meth:`contracts.runsignup.RunSignUp.synccoupons`
+    """
+    if not db.session.query(SponsorRaceCoupon.id).filter_by(race_id=race.id).first():
+        reconcile_couponindex(rsu, race)
+    
+    current = couponindex(race.id, [c['coupon_code'] for c in coupons])
+    synced, sent = rsu.synccoupons(race.couponproviderid, coupons, current=current)
+    # usage isn't in the response, so keep what's indexed
+    upsert_couponindex(race.id, [dict(current.get(code, {}), **synced[code]) for code in sent])
+    return synced, sent
@@ -0,0 +1,128 @@
+'''
+contractblocks - registry of Contract blocks by contract type and template type
+==================================================================================
+
+blocks are loaded from the database once per (contractType, templateType) and served from memory.
+The registry is cleared when this process changes a Contract, ContractType, TemplateType or
+ContractBlockType row. Changes made by other processes are detected from the contract table's latest
+update_time and row count, checked at most every CONTRACT_BLOCKS_MAXAGE seconds (config)
+'''
+
+# standard
+from time import time
+from threading import Lock
+from collections import namedtuple
+
+# pypi
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
+
+# homegrown
+from .dbmodel import db, Contract, ContractType, TemplateType, ContractBlockType
+
+# seconds between checks for Contract changes made by other processes, override with
+# CONTRACT_BLOCKS_MAXAGE in config
+CONTRACT_BLOCKS_MAXAGE = 10
+
+# Contract block, detached from the session. id and version_id are used by contractmanager.templatekey()
+ContractBlock = namedtuple('ContractBlock', ['id', 'version_id', 'blockPriority', 'blockType', 'block'])
+
+class ContractBlockRegistry():
+    '''
+    Contract blocks by (contractType, templateType), see module docstring
+    '''
+    def __init__(self):
+        self._blocks = {}
+        self._blocktypes = None
+        self._version = None
+        self._checked = 0
+        self._lock = Lock()
+
+    def blocks(self, contractType, templateType):
+        """return list of ContractBlock for contractType, templateType, ordered by blockPriority
+
+        :param contractType: ContractType.contractType
+        :param templateType: TemplateType.templateType
+        """
+        key = (contractType, templateType)
+        with self._lock:
+            self._checkversion()
+            blocks = self._blocks.get(key)
+            if blocks is None:
+                blocks = self._blocks[key] = self._load(contractType, templateType)
+            return blocks
+
+    def blocktypes(self):
+        """return set of ContractBlockType.blockType names"""
+        with self._lock:
+            self._checkversion()
+            if self._blocktypes is None:
+                self._blocktypes = {blockType for blockType, in db.session.query(ContractBlockType.blockType)}
+            return self._blocktypes
+
+    def block(self, contractType, templateType):
+        """return text of the only block for contractType, templateType
+
+        :raises NoResultFound: if there's no block
+        :raises MultipleResultsFound: if there's more than one block
+        """
+        blocks = self.blocks(contractType, templateType)
+        if not blocks:
+            raise NoResultFound(f'no contract block for {contractType}, {templateType}')
+        if len(blocks) > 1:
+            raise MultipleResultsFound(f'multiple contract blocks for {contractType}, {templateType}')
+        return blocks[0].block
+
+    def clear(self):
+        with self._lock:
+            self._blocks = {}
+            self._blocktypes = None
+            self._version = None
+
+    def _checkversion(self):
+        """clear blocks if contract table changed since they were loaded, checking at most every maxage seconds"""
+        now = time()
+        maxage = current_app.config.get('CONTRACT_BLOCKS_MAXAGE', CONTRACT_BLOCKS_MAXAGE)
+        if self._version is not None and now - self._checked < maxage:
+            return
+        version = tuple(db.session.query(func.max(Contract.update_time), func.count(Contract.id)).one())
+        if version != self._version:
+            self._blocks = {}
+            self._blocktypes = None
+            self._version = version
+        self._checked = now
+
+    def _load(self, contractType, templateType):
+        rows = (db.session.query(Contract.id, Contract.version_id, Contract.blockPriority,
+                                 ContractBlockType.blockType, Contract.block)
+                .filter(Contract.contractTypeId == ContractType.id)
+                .filter(ContractType.contractType == contractType)
+                .filter(Contract.templateTypeId == TemplateType.id)
+                .filter(TemplateType.templateType == templateType)
+                .outerjoin(ContractBlockType, Contract.contractBlockTypeId == ContractBlockType.id)
+                .order_by(Contract.blockPriority)
+                .all())
+        return [ContractBlock(*row) for row in rows]
+
+# Contract blocks for this process
+contract_registry = ContractBlockRegistry()
+
+def contract_blocks(contractType, templateType):
+    """return list of ContractBlock for contractType, templateType, ordered by blockPriority"""
+    return contract_registry.blocks(contractType, templateType)
+
+def contract_blocktypes():
+    """return set of ContractBlockType.blockType names"""
+    return contract_registry.blocktypes()
+
+def contract_block(contractType, templateType):
+    """return text of the only Contract block for contractType, templateType"""
+    return contract_registry.block(contractType, templateType)
+
+def _clear_registry(mapper, connection, target):
+    contract_registry.clear()
+
+for model in [Contract, ContractType, TemplateType, ContractBlockType]:
+    for eventname in ['after_insert', 'after_update', 'after_delete']:
+        event.listen(model, eventname, _clear_registry)
@@ -4,6 +4,12 @@
 #       Date            Author          Reason
 #       ----            ------          ------
 #       10/13/18        Lou King        Create
+#       10/18/26        Lou King        Cache compiled contract block templates
+#       10/18/26        Lou King        recursive_render reuses environment and compiled templates, bounded depth
+#       10/18/26        Lou King        get blocks from contractblocks registry
+#       10/18/26        Lou King        invoice trimming depends on invoicestart/invoiceend block types, as before
+#       10/18/26        Lou King        split create() into render() and upload()
+#       10/18/26        Lou King        create() can queue upload, see driveupload
 #
 #   Copyright 2018 Lou King
 #
@@ -22,17 +28,23 @@ from csv import reader
 from shutil import rmtree
 from json import loads
 from os.path import join as pathjoin
+from threading import Lock
+from collections import OrderedDict
+from weakref import WeakSet
 
 # pypy
 from docx import Document
 from flask import current_app, redirect
 from jinja2 import Environment
+from sqlalchemy import event
 from slugify import slugify
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 
 # homegrown
-from contracts.dbmodel import db, Contract, ContractType, ContractBlockType, TemplateType
+from contracts.dbmodel import Contract
+from .contractblocks import contract_blocks, contract_blocktypes
+from .driveupload import upload_document, enqueue_upload
 from loutilities import timeu
 from loutilities.googleauth import GoogleAuthService
 from .html2docx import convert
@@ -49,6 +61,12 @@ template_env = Environment(trim_blocks=True, lstrip_blocks=True)
 DRIVE_SERVICE = 'drive'
 DRIVE_VERSION = 'v3'
 
+# max number of compiled Contract block templates kept by each process
+TEMPLATE_CACHESIZE = 512
+
+# max number of times recursive_render re-renders its output
+RENDER_MAXDEPTH = 10
+
 # exceptions
 class PermissionError(Exception): pass
 
@@ -86,26 +104,152 @@ def _evaluate(tree, subtree):
     return subtree
 
 #----------------------------------------------------------------------
-def recursive_render(tpl, values):
+def _render_env():
 #----------------------------------------------------------------------
     '''
-    recursively render jinja2 template 
+    return (environment, TemplateCache) used by recursive_render for current app
+
+    the environment uses the app's template loader, so it's created once per app
+    '''
+    render = current_app.extensions.get('contracts_render')
+    if not render:
+        env = Environment(trim_blocks=True, lstrip_blocks=True, loader=current_app.jinja_env.loader)
+        render = current_app.extensions['contracts_render'] = (env, TemplateCache(env=env))
+    return render
+
+#----------------------------------------------------------------------
+def _has_template_syntax(env, text):
+#----------------------------------------------------------------------
+    return env.variable_start_string in text or env.block_start_string in text or env.comment_start_string in text
+
+#----------------------------------------------------------------------
+def recursive_render(tpl, values, key=None, maxdepth=RENDER_MAXDEPTH):
+#----------------------------------------------------------------------
+    '''
+    recursively render jinja2 template, i.e., values may contain template text
     from https://stackoverflow.com/questions/8862731/jinja-nested-rendering-on-variable-content
 
+    the template is compiled once and cached. Output is only rendered again while it contains
+    template syntax and is still changing
+
     :param tpl: template text
     :param values: values to be rendered
+    :param key: if tpl is a Contract block, templatekey(contract), else tpl is cached by its text
+    :param maxdepth: max number of times output is rendered again
     '''
-    # create environment
-    env = Environment(trim_blocks=True, lstrip_blocks=True, loader=current_app.jinja_env.loader)
+    env, cache = _render_env()
 
 ### TODO: note can only be used by html, for docx need to consider generator aspect within ContractManagerTemplate
-    prev = tpl
-    while True:
-        curr = env.from_string(prev).render(**values)
-        if curr != prev:
-            prev = curr
-        else:
+    curr = cache.get(key if key is not None else (None, tpl), tpl).render(**values)
+    for depth in range(maxdepth):
+        if not _has_template_syntax(env, curr):
             return curr
+        # intermediate output depends on values, so it's not worth caching
+        rendered = env.from_string(curr).render(**values)
+        if rendered == curr:
+            return curr
+        curr = rendered
+
+    raise parameterError('recursive_render(): output still changing after {} renders'.format(maxdepth + 1))
+
+#####################################################
+class TemplateCache():
+#####################################################
+    '''
+    compiled jinja2 templates for Contract blocks, shared by the process
+
+    templates are keyed by (Contract.id, Contract.version_id), so a block is compiled again after
+    it's edited, in this process or any other. Entries for edited or deleted Contract rows are also 
+    dropped when this process flushes the change. When full, the least recently used template is evicted
+
+    :param maxsize: max number of templates
+    :param env: jinja2 Environment templates are compiled in
+    '''
+
+    #----------------------------------------------------------------------
+    def __init__(self, maxsize=TEMPLATE_CACHESIZE, env=None):
+    #----------------------------------------------------------------------
+        self.maxsize = maxsize
+        self.env = env or template_env
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._templates = OrderedDict()
+        self._lock = Lock()
+        _template_caches.add(self)
+
+    #----------------------------------------------------------------------
+    def get(self, key, source):
+    #----------------------------------------------------------------------
+        '''
+        return compiled template for key, compiling source if it's not cached
+
+        :param key: (Contract.id, Contract.version_id), see templatekey()
+        :param source: template text
+        '''
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        # compile outside the lock, another thread compiling the same block is harmless
+        template = self.env.from_string(source)
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+                self.evictions += 1
+        return template
+
+    #----------------------------------------------------------------------
+    def invalidate(self, contract_id):
+    #----------------------------------------------------------------------
+        '''
+        drop all versions of Contract block from the cache
+
+        :param contract_id: Contract.id
+        '''
+        with self._lock:
+            for key in [key for key in self._templates if key[0] == contract_id]:
+                del self._templates[key]
+
+    #----------------------------------------------------------------------
+    def clear(self):
+    #----------------------------------------------------------------------
+        with self._lock:
+            self._templates.clear()
+
+    #----------------------------------------------------------------------
+    def stats(self):
+    #----------------------------------------------------------------------
+        '''return dict of counters'''
+        return dict(size=len(self._templates), hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+# all TemplateCaches, so edited Contract rows are dropped from each
+_template_caches = WeakSet()
+
+# compiled Contract block templates for this process
+contract_templates = TemplateCache()
+
+#----------------------------------------------------------------------
+def templatekey(contract):
+#----------------------------------------------------------------------
+    '''
+    return contract_templates key for Contract block
+    '''
+    return (contract.id, contract.version_id)
+
+#----------------------------------------------------------------------
+@event.listens_for(Contract, 'after_update')
+@event.listens_for(Contract, 'after_delete')
+def _invalidate_contract_template(mapper, connection, target):
+#----------------------------------------------------------------------
+    for cache in list(_template_caches):
+        cache.invalidate(target.id)
 
 #####################################################
 class ContractManagerTemplate():
@@ -116,13 +260,18 @@ class ContractManagerTemplate():
     * template - jinja2 template of text with replacement fields surrounded by curly braces with fields 
       like {{ a }, {{ b.c }} and control like {% for xxx %} {% endfor %}, {% if xxx %} {% endif %} 
       see http://jinja.pocoo.org/docs/2.10/templates/
+    * key - if template is a Contract block, templatekey(contract), so the compiled template 
+      is taken from contract_templates
     '''
 
     #----------------------------------------------------------------------
-    def __init__(self, template):
+    def __init__(self, template, key=None):
     #----------------------------------------------------------------------
         if debug: current_app.logger.debug('ContractManager.__init__(): template={}'.format(template))
-        self.template = template_env.from_string(template)
+        if key is not None:
+            self.template = contract_templates.get(key, template)
+        else:
+            self.template = template_env.from_string(template)
 
     #----------------------------------------------------------------------
     def render(self, mergefields):
@@ -196,7 +345,7 @@ class ContractManager():
             raise parameterError('ContractManager(): doctype must be "docx" or "html", found {}'.format(self.doctype))
 
     #----------------------------------------------------------------------
-    def create(self, filename, mergefields, addlfields={}, is_quote=True):
+    def create(self, filename, mergefields, addlfields={}, is_quote=True, uploadfor=None):
     #----------------------------------------------------------------------
         '''
         create the document
@@ -209,8 +358,27 @@ class ContractManager():
           a function, the function is called with a single argument: the original mergefields itself
         * addlfields - any fields to be added to mergefields
         * is_quote - True if quote being created, False if invoice being created
+        * uploadfor - optional (target, docfield), e.g., (event, 'contractDocId'). If supplied, the 
+          upload is queued, and target.docfield is set to the G Suite document id when it's done.
+          Caller must commit to database after call, see driveupload.enqueue_upload()
 
-        returns: G Suite document id
+        returns: G Suite document id, or DocUpload.id if uploadfor supplied
+        '''
+        drivename, path = self.render(filename, mergefields, addlfields=addlfields, is_quote=is_quote)
+        if uploadfor:
+            target, docfield = uploadfor
+            return enqueue_upload(drivename, path, target, docfield)
+        return self.upload(drivename, path)
+
+    #----------------------------------------------------------------------
+    def render(self, filename, mergefields, addlfields={}, is_quote=True):
+    #----------------------------------------------------------------------
+        '''
+        render the document to a temporary file
+
+        parameters are the same as create()
+
+        returns: (drive file name, path of temporary docx file), see upload()
         '''
 
         # create document based on doctype
@@ -223,15 +391,8 @@ class ContractManager():
             raise parameterError('create(): bad doctype {}'.format(self.doctype))
 
 
-        # retrieve contract template
-        templates = (db.session.query(Contract)
-                     .filter(Contract.contractTypeId==ContractType.id)
-                     .filter(ContractType.contractType==self.contractType)
-                     .filter(Contract.templateTypeId==TemplateType.id)
-                     .filter(TemplateType.templateType==self.templateType)
-                     .order_by(Contract.blockPriority)
-                     .all()
-                    )
+        # retrieve contract template, copied as it's trimmed below
+        templates = list(contract_blocks(self.contractType, self.templateType))
 
         # prepare built in fields
         dt = timeu.asctime('%B %d, %Y')
@@ -250,11 +411,11 @@ class ContractManager():
         if self.doctype == 'html':
             for blockd in templates:
                 # retrieve block type text
-                blockType = blockd.contractBlockType.blockType
+                blockType = blockd.blockType
 
                 # only possibility is html
                 if blockType == 'html':
-                    html.append( recursive_render( blockd.block, merge.__dict__ ) )
+                    html.append( recursive_render( blockd.block, merge.__dict__, key=templatekey(blockd) ) )
                     # template = ContractManagerTemplate( blockd.block )
                     # html.append( template.render( merge ) )
                 
@@ -265,33 +426,34 @@ class ContractManager():
         # fill contents for docx files
         elif self.doctype == 'docx':
             # invoicestart and invoiceend are special ContractBlockTypes for docx doctype
-            invoicestart = db.session.query(ContractBlockType).filter_by(blockType='invoicestart').one_or_none()
-            invoiceend = db.session.query(ContractBlockType).filter_by(blockType='invoiceend').one_or_none()
+            invoicestart = 'invoicestart'
+            invoiceend = 'invoiceend'
 
             # for contract quote or sponsor agreement, remove 'invoicestart' and 'invoiceend'
             if is_quote:
-                templates = [t for t in templates if t.contractBlockType != invoicestart and t.contractBlockType != invoiceend]
+                templates = [t for t in templates if t.blockType != invoicestart and t.blockType != invoiceend]
             
             # for invoice, remove all templates outside of 'invoicestart' and 'invoiceend'
             else:
-                if invoicestart:
-                    while len(templates) > 0 and templates[0].contractBlockType != invoicestart:
+                blocktypes = contract_blocktypes()
+                if invoicestart in blocktypes:
+                    while len(templates) > 0 and templates[0].blockType != invoicestart:
                         templates.pop(0)
-                    if len(templates) > 0 and templates[0].contractBlockType == invoicestart:
+                    if len(templates) > 0 and templates[0].blockType == invoicestart:
                         templates.pop(0)
-                if invoiceend:
-                    while len(templates) > 0 and templates[-1].contractBlockType != invoiceend:
+                if invoiceend in blocktypes:
+                    while len(templates) > 0 and templates[-1].blockType != invoiceend:
                         templates.pop()
-                    if len(templates) > 0 and templates[-1].contractBlockType == invoiceend:
+                    if len(templates) > 0 and templates[-1].blockType == invoiceend:
                         templates.pop()
                 
             for blockd in templates:
                 # retrieve block type text
-                blockType = blockd.contractBlockType.blockType
+                blockType = blockd.blockType
 
                 # para is a single paragraph, based on a single template
                 if blockType == 'para':
-                    template = ContractManagerTemplate( blockd.block )
+                    template = ContractManagerTemplate( blockd.block, key=templatekey(blockd) )
                     para = docx.add_paragraph( template.render( merge ) )
 
                 # sectionprops has json object containing section property assignments (see https://python-docx.readthedocs.io/en/latest/api/section.html)
@@ -310,7 +472,7 @@ class ContractManager():
 
                 # listitem[2] is a list item which may generate multiple lines, based on a single template
                 elif blockType in ['listitem', 'listitem2']:
-                    template = ContractManagerTemplate( blockd.block )
+                    template = ContractManagerTemplate( blockd.block, key=templatekey(blockd) )
                     for render in template.generate( merge ):
                         listitem = docx.add_paragraph( render )
                         if blockType == 'listitem':
@@ -338,7 +500,7 @@ class ContractManager():
                 # this is configured as template with comma separated columns, optional for loop
                 elif blockType in ['tablerow', 'tablerowbold']:
                     # get templated and create generator
-                    coltemplate = ContractManagerTemplate( blockd.block )
+                    coltemplate = ContractManagerTemplate( blockd.block, key=templatekey(blockd) )
                     colg = coltemplate.generate( merge )
 
                     # collect the generated raw rows (raw means with commas embedded)
@@ -382,29 +544,23 @@ class ContractManager():
             path = pathjoin(dirpath, slugify(drivename)) + '.docx'
             docx.save(path)
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        if debug: current_app.logger.debug('ContractManager.create(): created temporary {}'.format(path))
-
-        # upload to google drive
-        gs = GoogleAuthService(current_app.config['GSUITE_SERVICE_KEY_FILE'], current_app.config['GSUITE_SCOPES'])
-        fid = gs.create_file(current_app.config['CONTRACTS_DB_FOLDER'], drivename, path, doctype='docx')
-        if debug: current_app.logger.debug('uploaded fid={}'.format(fid))
-
-        ## set file to be publicly readable
-        public_permission = {
-            'type': 'anyone',
-            'role': 'reader',
-        }
-        gs.set_permission(fid, public_permission)   
-
-        # remove temporary folder
-        # NOTE: in windows at least, this gets an error because file is still in use
-        try:
-            rmtree(dirpath, ignore_errors=True)
-        except:
-            pass
-
-        # send email
-
-        return fid
+        if debug: current_app.logger.debug('ContractManager.render(): created temporary {}'.format(path))
+
+        return drivename, path
+
+    #----------------------------------------------------------------------
+    def upload(self, drivename, path, timings=None):
+    #----------------------------------------------------------------------
+        '''
+        upload rendered document to google drive, make it publicly readable, and remove the temporary file
+
+        parameters:
+
+        * drivename, path - from render()
+        * timings - optional dict, updated with seconds taken for 'upload' and 'permission'
+
+        returns: G Suite document id
+        '''
+        return upload_document(drivename, path, timings=timings)
 
 
@@ -33,7 +33,9 @@ DateTime = db.DateTime
 Sequence = db.Sequence
 Enum = db.Enum
 Text = db.Text
+LargeBinary = db.LargeBinary
 UniqueConstraint = db.UniqueConstraint
+Index = db.Index
 ForeignKey = db.ForeignKey
 relationship = db.relationship
 backref = db.backref
@@ -79,6 +81,7 @@ BENEFIT_LEN = 256
 PROVIDER_LEN = 32
 PROVIDERID_LEN = 128
 COUPONCODE_LEN = 32
+RSUCOUPONCODE_LEN = 100     # coupons at RunSignUp not created by contracts may have longer codes
 TREND_LEN = 32
 LOGOFILENAME_LEN = 128
 BENEFICIARY_LEN = 128
@@ -627,22 +630,132 @@ class SponsorRaceVbl(Base):
     }
 
 # sponsor rache registration cache
+# kept narrow, with fixed width columns, as it's read for registration counts; event names are in
+# SponsorRaceRegEvent and participant details are in SponsorRaceRegPii, both keyed like this table
 class SponsorRaceRegCache(Base):
     __tablename__ = 'sponsorraceregcache'
     id              = Column( Integer, primary_key=True )
-    registration_id = Column( Integer )
+    registration_id = Column( Integer, index=True, unique=True )
     event_id        = Column( Integer, index=True )
-    event_name      = Column( Text )
     registration_date = Column( DateTime )
     last_modified_ts = Column( Integer ) # timestamp
+    is_active       = Column( Boolean )
+
+    # supports registration counts per event and day, see caching.regcache_counts()
+    __table_args__ = (
+        Index('ix_sponsorraceregcache_event_active_regdate', 'event_id', 'is_active', 'registration_date'),
+    )
+
+# events in the registration cache
+class SponsorRaceRegEvent(Base):
+    __tablename__ = 'sponsorraceregevent'
+    id              = Column( Integer, primary_key=True )
+    event_id        = Column( Integer, unique=True, nullable=False )
+    name            = Column( String(NAME_LEN) )
+
+# participant details for the registration cache, by registration_id
+class SponsorRaceRegPii(Base):
+    __tablename__ = 'sponsorraceregpii'
+    id              = Column( Integer, primary_key=True )
+    registration_id = Column( Integer, unique=True, nullable=False )
     first_name      = Column ( Text )
     last_name       = Column ( Text )
     email           = Column ( Text )
     gender          = Column ( Text )
     dob             = Column ( Date )
-    is_active       = Column( Boolean )
     removed_reason  = Column( Text )
 
+# active registrations per race, event and registration day, maintained by caching.update_raceregcache
+class SponsorRaceRegCount(Base):
+    __tablename__ = 'sponsorraceregcount'
+    id              = Column( Integer, primary_key=True )
+    race_id         = Column( Integer, ForeignKey('sponsorrace.id'), nullable=False )
+    race            = relationship( 'SponsorRace', backref='regcounts', lazy=True )
+    event_id        = Column( Integer, nullable=False )
+    registration_day = Column( Date, nullable=False )
+    regcount        = Column( Integer, nullable=False, default=0 )
+
+    __table_args__ = (
+        UniqueConstraint('race_id', 'event_id', 'registration_day', name='uq_sponsorraceregcount_race_event_day'),
+    )
+
+# registration cache sync state and cost per race and event, maintained by caching.update_raceregcache and
+# caching.refresh_raceregcaches, see caching.eventsync_report
+class SponsorRaceEventSync(Base):
+    __tablename__ = 'sponsorraceeventsync'
+    id              = Column( Integer, primary_key=True )
+    race_id         = Column( Integer, ForeignKey('sponsorrace.id'), nullable=False )
+    race            = relationship( 'SponsorRace', backref='eventsyncs', lazy=True )
+    event_id        = Column( Integer, nullable=False )
+    event_name      = Column( Text )
+    synced_ts       = Column( Integer )  # cursor (high-water mark), timestamp when last successful sync started
+    lastattempt_ts  = Column( Integer )  # timestamp when last sync started, successful or not
+    lastduration    = Column( Float )    # seconds
+    totalduration   = Column( Float, nullable=False, default=0 )
+    numsyncs        = Column( Integer, nullable=False, default=0 )
+    numupdated      = Column( Integer )  # participants updated by last successful sync
+    numremoved      = Column( Integer )  # participants removed by last successful sync
+    numfailures     = Column( Integer, nullable=False, default=0 )  # consecutive failed syncs
+    lasterror       = Column( Text )
+
+    __table_args__ = (
+        UniqueConstraint('race_id', 'event_id', name='uq_sponsorraceeventsync_race_event'),
+    )
+
+# index of RunSignUp coupons per race, maintained by caching.sync_racecoupons and caching.reconcile_couponindex
+class SponsorRaceCoupon(Base):
+    __tablename__ = 'sponsorracecoupon'
+    id              = Column( Integer, primary_key=True )
+    race_id         = Column( Integer, ForeignKey('sponsorrace.id'), nullable=False )
+    race            = relationship( 'SponsorRace', backref='coupons', lazy=True )
+    coupon_code     = Column( String(RSUCOUPONCODE_LEN), nullable=False )
+    coupon_id       = Column( Integer )
+    start_date      = Column( String(DATETIME_LEN) )    # as returned by RunSignUp
+    end_date        = Column( String(DATETIME_LEN) )
+    max_num_race_registrants = Column( Integer )
+    num_uses        = Column( Integer )
+    coupon_notes    = Column( Text )
+    updated_ts      = Column( Integer ) # timestamp
+
+    __table_args__ = (
+        UniqueConstraint('race_id', 'coupon_code', name='uq_sponsorracecoupon_race_code'),
+    )
+
+# shared cache for RunSignUp responses, see responsecache.DbResponseCache
+class RsuResponseCache(Base):
+    __tablename__ = 'rsuresponsecache'
+    id              = Column( Integer, primary_key=True )
+    cachekey        = Column( String(40), unique=True, nullable=False )
+    response        = Column( Text(2**24-1) )   # mediumtext for mysql
+    expires         = Column( Integer, index=True, nullable=False )    # timestamp
+
+# google drive uploads queued by ContractManager.create(), see driveupload
+UPLOAD_PENDING      = 'pending'
+UPLOAD_UPLOADING    = 'uploading'
+UPLOAD_DONE         = 'done'
+UPLOAD_FAILED       = 'failed'
+class DocUpload(Base):
+    __tablename__ = 'docupload'
+    id              = Column( Integer, primary_key=True )
+    drivename       = Column( Text, nullable=False )
+    filename        = Column( String(NAME_LEN), nullable=False )    # file name of rendered document
+    document        = Column( LargeBinary(2**24-1) )    # rendered document, mediumblob for mysql, cleared after upload
+    target          = Column( String(FIELD_LEN), nullable=False )   # __tablename__ of row which gets the document id
+    target_id       = Column( Integer, nullable=False )
+    docfield        = Column( String(FIELD_LEN), nullable=False )   # e.g., contractDocId
+    status          = Column( String(STATE_LEN), nullable=False, default=UPLOAD_PENDING )
+    attempts        = Column( Integer, nullable=False, default=0 )
+    next_try_ts     = Column( Integer, nullable=False, default=0 )  # timestamp
+    claimed_ts      = Column( Integer )     # timestamp when current attempt started
+    docid           = Column( String(FID_LEN) )
+    lasterror       = Column( Text )
+    created_ts      = Column( Integer )     # timestamp
+
+    __table_args__ = (
+        Index('ix_docupload_status_next_try', 'status', 'next_try_ts'),
+        Index('ix_docupload_target', 'target', 'target_id', 'docfield'),
+    )
+
 # sponsor levels / sponsor benefits
 # see http://docs.sqlalchemy.org/en/latest/orm/basic_relationships.html Many To Many
 sponsorlevelbenefit_table = Table('sponsorlevelbenefit', Base.metadata,
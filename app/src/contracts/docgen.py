@@ -0,0 +1,136 @@
+'''
+docgen - generate race services contracts and invoices for many events
+=========================================================================
+
+documents are rendered by a pool of worker processes, as rendering is CPU bound python-docx work.
+As each document is rendered, its upload to google drive is started on a pool of threads, so uploads
+overlap rendering
+'''
+
+# standard
+from time import perf_counter
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# pypi
+from flask import current_app
+
+# homegrown
+from .dbmodel import db, Event
+from .contractmanager import ContractManager
+from .utils import event_docfields, event_docfilename
+
+# default number of worker processes which render documents
+DOCGEN_WORKERS = 4
+
+# default number of threads which upload documents
+DOCGEN_UPLOADERS = 4
+
+# app used by _renderdoc() in worker processes
+_workerapp = None
+
+def _contractmanager():
+    return ContractManager(contractType='race services', templateType='contract',
+                           driveFolderId=current_app.config['CONTRACTS_DB_FOLDER'])
+
+def _initworker(app):
+    """initialize worker process, which was forked from the process running generate_docs()"""
+    global _workerapp
+    _workerapp = app
+    # the parent's database connections were copied by fork, leave them for the parent
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+def _renderdoc(event_id, is_quote):
+    """render event's document to a temporary file
+
+    :return: dict(event_id=, drivename=, path=, render=seconds)
+    """
+    app = _workerapp or current_app._get_current_object()
+    with app.app_context():
+        try:
+            start = perf_counter()
+            event = db.session.get(Event, event_id)
+            drivename, path = _contractmanager().render(event_docfilename(event), event,
+                                                        addlfields=event_docfields(event, is_quote), is_quote=is_quote)
+            return dict(event_id=event_id, drivename=drivename, path=path, render=perf_counter() - start)
+        finally:
+            db.session.remove()
+
+def _uploaddoc(app, rendered):
+    """upload rendered document
+
+    :return: (G Suite document id, dict(upload=seconds, permission=seconds))
+    """
+    with app.app_context():
+        timings = {}
+        fid = _contractmanager().upload(rendered['drivename'], rendered['path'], timings=timings)
+        return fid, timings
+
+def generate_docs(event_ids, is_quote, workers=DOCGEN_WORKERS, uploaders=DOCGEN_UPLOADERS):
+    """generate contract or invoice for each event, and update events with the documents' ids
+
+    NOTE: caller must commit to database after call
+
+    :param event_ids: list of Event.id
+    :param is_quote: True for contracts (agreement/quote), False for invoices
+    :param workers: number of worker processes rendering documents, 0 to render in this process
+    :param uploaders: number of threads uploading documents
+    :return: [dict(event_id=, docid=, render=, upload=, permission=, error=), ...] in event_ids order,
+        times are seconds. docid is None and error is set for documents which failed
+    """
+    app = current_app._get_current_object()
+    results = {event_id: dict(event_id=event_id, docid=None, render=None, upload=None, permission=None, error=None)
+               for event_id in event_ids}
+
+    with ThreadPoolExecutor(max_workers=uploaders, thread_name_prefix='docgen') as io:
+        uploads = {}
+        def upload(rendered):
+            results[rendered['event_id']]['render'] = rendered['render']
+            uploads[io.submit(_uploaddoc, app, rendered)] = rendered['event_id']
+
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork'),
+                                     initializer=_initworker, initargs=(app,)) as pool:
+                renders = {pool.submit(_renderdoc, event_id, is_quote): event_id for event_id in event_ids}
+                for future in as_completed(renders):
+                    try:
+                        upload(future.result())
+                    except Exception as e:
+                        current_app.logger.exception(f'generate_docs(): error rendering event {renders[future]}')
+                        results[renders[future]]['error'] = str(e)
+        else:
+            for event_id in event_ids:
+                try:
+                    upload(_renderdoc(event_id, is_quote))
+                except Exception as e:
+                    current_app.logger.exception(f'generate_docs(): error rendering event {event_id}')
+                    results[event_id]['error'] = str(e)
+
+        for future in as_completed(uploads):
+            event_id = uploads[future]
+            try:
+                fid, timings = future.result()
+            except Exception as e:
+                current_app.logger.exception(f'generate_docs(): error uploading event {event_id}')
+                results[event_id]['error'] = str(e)
+                continue
+            results[event_id].update(docid=fid, **timings)
+
+    # update events the same way as EventsContract does for a single event
+    for result in results.values():
+        if not result['docid']:
+            continue
+        event = db.session.get(Event, result['event_id'])
+        if is_quote:
+            if event.contractDocId:
+                event.isContractUpdated = True
+            event.contractDocId = result['docid']
+        else:
+            if event.invoiceDocId and event.isInvoiceInitiated:
+                event.isInvoiceUpdated = True
+            event.isInvoiceInitiated = False
+            event.invoiceDocId = result['docid']
+
+    return [results[event_id] for event_id in event_ids]
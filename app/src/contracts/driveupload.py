@@ -0,0 +1,293 @@
+'''
+driveupload - upload rendered documents to google drive, now or from a queue
+===============================================================================
+
+:func:`upload_document` uploads a rendered document and makes it publicly readable. Google's
+latency is several seconds, so instead of uploading within a request, :func:`enqueue_upload` adds a
+:class:`DocUpload` job, and a background thread uploads it after the request commits, setting the
+document id into the job's target row, e.g., Event.contractDocId. Failed uploads are retried with
+exponential backoff.
+
+The rendered document is kept in the job, and jobs are claimed with a conditional update, so workers in
+any process or host using the same database can upload it. A worker is started by create_app() (unless
+CONTRACTS_UPLOAD_WORKER is False), so jobs left when the app stopped are picked up when it restarts.
+
+If CONTRACTS_LOCAL_DRIVE is configured, documents are copied to that folder rather than uploaded,
+see :class:`LocalDriveService`
+'''
+
+# standard
+from time import time, perf_counter
+from os import makedirs
+from os.path import join as pathjoin, dirname, basename, splitext
+from tempfile import mkdtemp
+from shutil import rmtree, copyfile
+from threading import Thread, Event as ThreadEvent, Lock
+from uuid import uuid4
+
+# pypi
+from flask import current_app, g
+from sqlalchemy import event, or_, and_, func
+from sqlalchemy.orm import defer
+
+# homegrown
+from .dbmodel import db, DocUpload, Event, Sponsor
+from .dbmodel import UPLOAD_PENDING, UPLOAD_UPLOADING, UPLOAD_DONE, UPLOAD_FAILED
+from loutilities.googleauth import GoogleAuthService
+
+# defaults, override with config of the same name
+UPLOAD_MAXATTEMPTS = 5      # job fails after this many attempts
+UPLOAD_RETRYDELAY = 30      # seconds before first retry, doubled for each later retry
+UPLOAD_POLL = 60            # seconds between worker checks for jobs it wasn't woken for, e.g., retries
+UPLOAD_STALE = 600          # seconds after which a claimed job is assumed abandoned, e.g., process died
+
+# models which may be targets of a DocUpload, by __tablename__
+UPLOAD_TARGETS = {model.__tablename__: model for model in [Event, Sponsor]}
+
+def _config(name, default):
+    return current_app.config.get(name, default)
+
+class LocalDriveService():
+    '''
+    stands in for GoogleAuthService, for development and tests. Documents are copied to
+    root/folder/<fid><ext>, permissions are ignored
+
+    :param root: local folder
+    '''
+    def __init__(self, root):
+        self.root = root
+
+    def create_file(self, folder, name, path, doctype=None):
+        fid = uuid4().hex
+        folderpath = pathjoin(self.root, folder)
+        makedirs(folderpath, exist_ok=True)
+        copyfile(path, pathjoin(folderpath, fid + splitext(path)[1]))
+        return fid
+
+    def set_permission(self, fid, permission):
+        pass
+
+def drive_service():
+    """return service documents are uploaded with"""
+    localroot = current_app.config.get('CONTRACTS_LOCAL_DRIVE')
+    if localroot:
+        return LocalDriveService(localroot)
+    return GoogleAuthService(current_app.config['GSUITE_SERVICE_KEY_FILE'], current_app.config['GSUITE_SCOPES'])
+
+def upload_document(drivename, path, timings=None):
+    """upload rendered document to google drive, make it publicly readable, and remove the temporary file
+
+    :param drivename: name of document on google drive
+    :param path: rendered document, see ContractManager.render()
+    :param timings: optional dict, updated with seconds taken for 'upload' and 'permission'
+    :return: G Suite document id
+    """
+    start = perf_counter()
+    gs = drive_service()
+    fid = gs.create_file(current_app.config['CONTRACTS_DB_FOLDER'], drivename, path, doctype='docx')
+    current_app.logger.debug(f'upload_document(): uploaded fid={fid}')
+    uploaded = perf_counter()
+
+    # set file to be publicly readable
+    gs.set_permission(fid, {'type': 'anyone', 'role': 'reader'})
+    if timings is not None:
+        timings.update(upload=uploaded - start, permission=perf_counter() - uploaded)
+
+    # NOTE: in windows at least, this may fail because file is still in use
+    rmtree(dirname(path), ignore_errors=True)
+    return fid
+
+def enqueue_upload(drivename, path, target, docfield):
+    """queue upload of rendered document, which sets the document id into target.docfield when done
+
+    the document is read into the queue and its temporary file is removed. The upload starts after 
+    the caller commits
+
+    NOTE: caller must commit to database after call
+
+    :param drivename: name of document on google drive
+    :param path: rendered document, see ContractManager.render()
+    :param target: Event or Sponsor which gets the document id
+    :param docfield: name of target's document id attribute, e.g., 'contractDocId'
+    :return: DocUpload.id, the provisional job id
+    """
+    if target.__tablename__ not in UPLOAD_TARGETS:
+        raise ValueError(f'enqueue_upload(): uploads not supported for {target.__tablename__}')
+    with open(path, 'rb') as doc:
+        document = doc.read()
+    db.session.flush()  # target may be new
+    now = int(time())
+    job = DocUpload(drivename=drivename, filename=basename(path), document=document, target=target.__tablename__, 
+                    target_id=target.id, docfield=docfield, status=UPLOAD_PENDING, attempts=0, next_try_ts=now, 
+                    created_ts=now)
+    db.session.add(job)
+    db.session.flush()
+    rmtree(dirname(path), ignore_errors=True)
+
+    if _config('CONTRACTS_UPLOAD_WORKER', True):
+        upload_worker.start(current_app._get_current_object())
+        event.listen(db.session(), 'after_commit', lambda session: upload_worker.wake(), once=True)
+    return job.id
+
+def latest_upload(target, docfield):
+    """return most recently queued DocUpload for target.docfield, or None"""
+    return (DocUpload.query.filter_by(target=target.__tablename__, target_id=target.id, docfield=docfield)
+            .order_by(DocUpload.id.desc()).first())
+
+def latest_uploads(model):
+    """return {(target_id, docfield): DocUpload} for most recently queued jobs for model's rows, loaded once per request
+
+    :param model: Event or Sponsor
+    """
+    key = f'latest_uploads_{model.__tablename__}'
+    if key not in g:
+        latest = (db.session.query(func.max(DocUpload.id))
+                  .filter_by(target=model.__tablename__)
+                  .group_by(DocUpload.target_id, DocUpload.docfield))
+        jobs = DocUpload.query.options(defer(DocUpload.document)).filter(DocUpload.id.in_(latest)).all()
+        setattr(g, key, {(job.target_id, job.docfield): job for job in jobs})
+    return getattr(g, key)
+
+def upload_status(job):
+    """return text describing job for admins, '' if there's no job or it's done"""
+    if not job or job.status == UPLOAD_DONE:
+        return ''
+    if job.status == UPLOAD_FAILED:
+        return f'upload failed, create document again: {job.lasterror}'
+    return 'uploading, reload page to see document'
+
+def _claim(job_id, now):
+    """claim job for this worker, return True if claimed"""
+    stale = now - _config('UPLOAD_STALE', UPLOAD_STALE)
+    claimed = (DocUpload.query
+               .filter(DocUpload.id == job_id)
+               .filter(or_(and_(DocUpload.status == UPLOAD_PENDING, DocUpload.next_try_ts <= now),
+                           and_(DocUpload.status == UPLOAD_UPLOADING, DocUpload.claimed_ts < stale)))
+               .update({DocUpload.status: UPLOAD_UPLOADING, DocUpload.claimed_ts: now}, synchronize_session=False))
+    db.session.commit()
+    return claimed == 1
+
+def _complete(job, fid):
+    job.status = UPLOAD_DONE
+    job.docid = fid
+    job.lasterror = None
+    job.document = None
+    # an older job finishing late must not replace a newer job's document
+    newer = (DocUpload.query.filter_by(target=job.target, target_id=job.target_id, docfield=job.docfield, status=UPLOAD_DONE)
+             .filter(DocUpload.id > job.id).first())
+    target = db.session.get(UPLOAD_TARGETS[job.target], job.target_id)
+    if target and not newer:
+        setattr(target, job.docfield, fid)
+
+def _fail(job, error, now):
+    job.attempts += 1
+    job.lasterror = error
+    # failed job keeps its rendered document, see retry_failed_uploads()
+    if job.attempts >= _config('UPLOAD_MAXATTEMPTS', UPLOAD_MAXATTEMPTS):
+        job.status = UPLOAD_FAILED
+    else:
+        job.status = UPLOAD_PENDING
+        job.next_try_ts = now + _config('UPLOAD_RETRYDELAY', UPLOAD_RETRYDELAY) * 2 ** (job.attempts - 1)
+
+def process_uploads(now=None):
+    """upload queued documents which are due, committing after each
+
+    :param now: timestamp, default time()
+    :return: list of DocUpload.id for jobs attempted
+    """
+    now = int(now if now is not None else time())
+    stale = now - _config('UPLOAD_STALE', UPLOAD_STALE)
+    due = [id for id, in db.session.query(DocUpload.id)
+           .filter(or_(and_(DocUpload.status == UPLOAD_PENDING, DocUpload.next_try_ts <= now),
+                       and_(DocUpload.status == UPLOAD_UPLOADING, DocUpload.claimed_ts < stale)))
+           .order_by(DocUpload.id).all()]
+    db.session.rollback()
+
+    attempted = []
+    for job_id in due:
+        if not _claim(job_id, now):
+            continue
+        attempted.append(job_id)
+        job = db.session.get(DocUpload, job_id)
+        try:
+            # upload_document() removes the temporary folder
+            path = pathjoin(mkdtemp(prefix='contracts_'), job.filename)
+            with open(path, 'wb') as doc:
+                doc.write(job.document)
+            fid = upload_document(job.drivename, path)
+        except Exception as e:
+            current_app.logger.exception(f'process_uploads(): error uploading {job.drivename}')
+            rmtree(dirname(path), ignore_errors=True)
+            _fail(job, f'{type(e).__name__}: {e}', now)
+            db.session.commit()
+            continue
+
+        # the target may have been edited meanwhile (e.g., StaleDataError), so try again with a fresh copy
+        for retry in range(2):
+            try:
+                _complete(db.session.get(DocUpload, job_id), fid)
+                db.session.commit()
+                break
+            except Exception:
+                db.session.rollback()
+                if retry:
+                    raise
+    return attempted
+
+def retry_failed_uploads():
+    """requeue failed uploads
+
+    NOTE: caller must commit to database after call
+
+    :return: number of jobs requeued
+    """
+    requeued = 0
+    for job in DocUpload.query.filter_by(status=UPLOAD_FAILED).all():
+        job.status = UPLOAD_PENDING
+        job.attempts = 0
+        job.next_try_ts = 0
+        requeued += 1
+    return requeued
+
+class UploadWorker():
+    '''
+    background thread which runs process_uploads() when woken, and every UPLOAD_POLL seconds
+    '''
+    def __init__(self):
+        self._thread = None
+        self._wakeup = ThreadEvent()
+        self._lock = Lock()
+
+    def start(self, app):
+        """start worker thread for app, unless it's running"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, args=(app,), name='driveupload', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self, app):
+        while True:
+            # a wake() while processing runs process_uploads() again
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    process_uploads()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('UploadWorker: error processing uploads')
+                finally:
+                    db.session.remove()
+                poll = app.config.get('UPLOAD_POLL', UPLOAD_POLL)
+            self._wakeup.wait(poll)
+
+# upload worker for this process
+upload_worker = UploadWorker()
+
+def start_uploadworker(app):
+    """start upload worker for app, unless disabled by CONTRACTS_UPLOAD_WORKER = False"""
+    if app.config.get('CONTRACTS_UPLOAD_WORKER', True):
+        upload_worker.start(app)
@@ -4,31 +4,115 @@ helpers - commonly needed utilities
 '''
 
 # standard
+from threading import Lock
 
 # pypi
 from flask import g, current_app
 
 # homegrown
 from .dbmodel import LocalInterest
-from .runsignup import RunSignUp
+from .runsignup import RunSignUp, RequestScheduler, CACHE_TTLS, RATE, BURST
+from .responsecache import LRUResponseCache, DbResponseCache, TieredResponseCache
+from .asyncrunsignup import AsyncRunSignUp, SyncRunSignUp
 from loutilities.user.model import Interest
 
 def localinterest():
     interest = Interest.query.filter_by(interest=g.interest).one()
     return LocalInterest.query.filter_by(interest_id=interest.id).one()
 
+# RunSignUp response cache is shared by all clients in the process
+_rsucache = None
+_rsucache_lock = Lock()
+
+def rsucache():
+    '''
+    return the process's RunSignUp response cache, configured from app config
+
+    optionally set in config: RSU_CACHE_SIZE max entries in process (default 256, 0 to disable the cache),
+    RSU_CACHE_SHARED True to also use the database, shared across processes (default False),
+    RSU_CACHE_SHARED_SIZE max entries in the database (default 1024)
+    '''
+    global _rsucache
+    with _rsucache_lock:
+        if _rsucache is None:
+            size = current_app.config.get('RSU_CACHE_SIZE', 256)
+            if not size:
+                return None
+            _rsucache = LRUResponseCache(maxsize=size)
+            if current_app.config.get('RSU_CACHE_SHARED', False):
+                _rsucache = TieredResponseCache(
+                    _rsucache, DbResponseCache(maxsize=current_app.config.get('RSU_CACHE_SHARED_SIZE', 1024)))
+        return _rsucache
+
+# RunSignUp rate limit applies to all clients in the process
+_rsuscheduler = None
+_rsuscheduler_lock = Lock()
+
+def rsuscheduler():
+    '''
+    return the process's RunSignUp request scheduler, configured from app config
+
+    optionally set in config: RSU_RATE requests per second, RSU_BURST requests at once after idle,
+    see runsignup.RATE, runsignup.BURST for defaults
+    '''
+    global _rsuscheduler
+    with _rsuscheduler_lock:
+        if _rsuscheduler is None:
+            _rsuscheduler = RequestScheduler(rate=current_app.config.get('RSU_RATE', RATE),
+                                             burst=current_app.config.get('RSU_BURST', BURST))
+        return _rsuscheduler
+
 def make_runsignup_client(**kwargs):
     '''
     create a contracts.runsignup.RunSignUp client (context manager style) configured from app config
 
     expects the following to be set in config: RSU_KEY, RSU_SECRET, RSU_API_REG_TOKEN, RSU_API_REG_SECRET
+    optionally RSU_CONCURRENCY may be set in config to fetch pages concurrently (default 1)
+    optionally RSU_CACHE_TTLS may be set in config to override runsignup.CACHE_TTLS, see also rsucache()
+    requests are rate limited and retried by the process's scheduler, see rsuscheduler()
 
     :param kwargs: additional RunSignUp() arguments, e.g. debug=True
     '''
+    args = dict(concurrency=current_app.config.get('RSU_CONCURRENCY', 1),
+                cache=rsucache(),
+                scheduler=rsuscheduler(),
+                cachettls=current_app.config.get('RSU_CACHE_TTLS', CACHE_TTLS))
+    args.update(kwargs)
     return RunSignUp(
         key=current_app.config['RSU_KEY'],
         secret=current_app.config['RSU_SECRET'],
         api_reg_token=current_app.config['RSU_API_REG_TOKEN'],
         api_reg_secret=current_app.config['RSU_API_REG_SECRET'],
-        **kwargs
+        **args
     )
+
+def _asyncrunsignup_args(kwargs):
+    args = dict(concurrency=current_app.config.get('RSU_ASYNC_CONCURRENCY', 10),
+                scheduler=rsuscheduler(),
+                key=current_app.config['RSU_KEY'],
+                secret=current_app.config['RSU_SECRET'],
+                api_reg_token=current_app.config['RSU_API_REG_TOKEN'],
+                api_reg_secret=current_app.config['RSU_API_REG_SECRET'],
+                )
+    args.update(kwargs)
+    return args
+
+def make_async_runsignup_client(**kwargs):
+    '''
+    create a contracts.asyncrunsignup.AsyncRunSignUp client (async context manager style) configured from app config
+
+    same config as make_runsignup_client(), optionally RSU_ASYNC_CONCURRENCY may be set in config for the
+    max number of requests in flight (default 10)
+
+    :param kwargs: additional AsyncRunSignUp() arguments
+    '''
+    return AsyncRunSignUp(**_asyncrunsignup_args(kwargs))
+
+def make_sync_runsignup_client(**kwargs):
+    '''
+    create a contracts.asyncrunsignup.SyncRunSignUp client (context manager style) configured from app config,
+    for using AsyncRunSignUp from Flask views
+
+    :param kwargs: additional AsyncRunSignUp() arguments
+    '''
+    return SyncRunSignUp(**_asyncrunsignup_args(kwargs))
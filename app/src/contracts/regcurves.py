@@ -0,0 +1,98 @@
+'''
+regcurves - registration curves for multi-year comparisons
+==============================================================
+
+cumulative registrations by days before race, for several race years, computed in one vectorized
+pass over the registration dates
+'''
+
+# standard
+from datetime import date
+
+# pypi
+import numpy as np
+
+# homegrown
+from .caching import race_regcounts
+from .snapshot import fresh_regsnapshot, dayindex, EVENT_ID, REGDAY, ACTIVE
+
+def _years(days):
+    """return calendar years for array of days since 1970-01-01"""
+    return days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+def registration_curves(regdays, racedays, counts=None, numyears=None, today=None):
+    """return cumulative registrations by days before race, for each race year
+
+    registrations after race day are counted on race day
+
+    :param regdays: array of registration days, as days since 1970-01-01
+    :param racedays: array of race days for the registrations, as days since 1970-01-01
+    :param counts: array of number of registrations for each entry, default 1 each
+    :param numyears: number of most recent race years, None for all
+    :param today: today's date, for currentpace, default date.today()
+    :return: dict(years=[year, ...], daysbefore=array, cumulative=array, pace=array or None, currentpace=float or None)
+        years are most recent first. cumulative has a row for each year, aligned with daysbefore, which
+        runs from the earliest registration down to 0. pace is the most recent year's cumulative
+        registrations divided by the previous year's, and currentpace is pace at today's days before race
+    """
+    regdays = np.asarray(regdays, dtype=np.int64)
+    racedays = np.asarray(racedays, dtype=np.int64)
+    counts = np.ones(len(regdays)) if counts is None else np.asarray(counts, dtype=np.float64)
+    if not len(regdays):
+        return dict(years=[], daysbefore=np.arange(0), cumulative=np.zeros((0, 0)), pace=None, currentpace=None)
+
+    raceyears = _years(racedays)
+    years = np.unique(raceyears)[::-1][:numyears]
+    keep = np.isin(raceyears, years)
+    raceyears, racedays, counts = raceyears[keep], racedays[keep], counts[keep]
+    daysbefore = np.clip(racedays - regdays[keep], 0, None)
+    maxdays = int(daysbefore.max())
+
+    # histogram per year and day, most recent year first, earliest day first
+    yearidx = len(years) - 1 - np.searchsorted(years[::-1], raceyears)
+    flat = yearidx * (maxdays + 1) + (maxdays - daysbefore)
+    hist = np.bincount(flat, weights=counts, minlength=len(years) * (maxdays + 1)).reshape(len(years), maxdays + 1)
+    cumulative = np.cumsum(hist, axis=1)
+
+    pace = currentpace = None
+    if len(years) > 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pace = np.where(cumulative[1] > 0, cumulative[0] / cumulative[1], np.nan)
+        # registrations for the current race are through today, or race day if it's passed
+        today = dayindex(today or date.today())
+        todaybefore = min(max(int(racedays[yearidx == 0].max()) - today, 0), maxdays)
+        currentpace = float(pace[maxdays - todaybefore])
+        if np.isnan(currentpace):
+            currentpace = None
+
+    return dict(years=[int(y) for y in years], daysbefore=np.arange(maxdays, -1, -1), cumulative=cumulative,
+                pace=pace, currentpace=currentpace)
+
+def race_registration_curves(race, racedates, event_ids=None, numyears=None, today=None):
+    """return registration curves for race's events, see registration_curves()
+
+    registrations come from a fresh snapshot, see contracts.snapshot.fresh_regsnapshot(), else from
+    the race's daily registration counts
+
+    :param race: SponsorRace
+    :param racedates: {event_id: (event name, race date), ...}, see contracts.snapshot.event_racedates()
+    :param event_ids: list of event ids to include, None for all in racedates
+    :param numyears: number of most recent race years, None for all
+    :param today: today's date, default date.today()
+    """
+    event_ids = np.array(sorted(racedates if event_ids is None else event_ids), dtype=np.int64)
+    eventracedays = np.array([dayindex(racedates[event_id][1]) for event_id in event_ids], dtype=np.int64)
+
+    snapshot = fresh_regsnapshot(race.id)
+    if snapshot:
+        data = snapshot.data
+        selected = data[:, (data[ACTIVE] != 0) & np.isin(data[EVENT_ID], event_ids)]
+        regevents, regdays, counts = selected[EVENT_ID], selected[REGDAY], None
+    else:
+        regcounts = race_regcounts(race.id, event_ids.tolist())
+        regevents = np.array([r[0] for r in regcounts], dtype=np.int64)
+        regdays = np.array([r[1] for r in regcounts], dtype='datetime64[D]').astype(np.int64)
+        counts = np.array([r[2] for r in regcounts], dtype=np.int64)
+
+    racedays = eventracedays[np.searchsorted(event_ids, regevents)]
+    return registration_curves(regdays, racedays, counts=counts, numyears=numyears, today=today)
@@ -0,0 +1,189 @@
+'''
+responsecache - caches for service provider responses
+==========================================================
+
+responses are stored as text (e.g., json), so each hit gives the caller its own copy. Each cache counts
+hits, misses and evictions, see :meth:`ResponseCache.stats`
+'''
+
+# standard
+from time import time
+from hashlib import sha1
+from threading import Lock
+from collections import OrderedDict
+
+# pypi
+from flask import current_app, has_app_context
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# homegrown
+from .dbmodel import db, RsuResponseCache
+
+def cachekey(url, params):
+    """return cache key for url and request parameters"""
+    return sha1('{}?{}'.format(url, sorted(params.items())).encode()).hexdigest()
+
+class ResponseCache():
+    '''
+    base class for response caches
+
+    derived classes implement _get() and _set()
+    '''
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._statslock = Lock()
+
+    def get(self, key):
+        """return cached response text for key, or None if not cached or expired"""
+        value = self._get(key)
+        with self._statslock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl):
+        """cache response text for key, for ttl seconds
+
+        errors are logged rather than raised, as failing to cache a response mustn't fail the request
+        """
+        try:
+            self._set(key, value, ttl)
+        except Exception:
+            if has_app_context():
+                current_app.logger.exception(f'{type(self).__name__}.set(): error caching {key}')
+
+    def stats(self):
+        """return dict of counters"""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, ttl):
+        raise NotImplementedError
+
+class LRUResponseCache(ResponseCache):
+    '''
+    in-process cache, evicts least recently used entry when full
+
+    :param maxsize: max number of entries
+    '''
+    def __init__(self, maxsize=256):
+        super().__init__()
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+class DbResponseCache(ResponseCache):
+    '''
+    cache shared by all processes using the database, in rsuresponsecache table
+
+    uses its own connection and transaction, so the caller's session isn't affected
+
+    :param maxsize: max number of entries; when exceeded, expired entries then the entries which
+        expire soonest are evicted
+    '''
+    def __init__(self, maxsize=1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self.table = RsuResponseCache.__table__
+
+    def _get(self, key):
+        with db.engine.connect() as conn:
+            row = conn.execute(select(self.table.c.response, self.table.c.expires)
+                               .where(self.table.c.cachekey == key)).one_or_none()
+        if row is None or row.expires <= time():
+            return None
+        return row.response
+
+    def _set(self, key, value, ttl):
+        now = time()
+        with db.engine.begin() as conn:
+            self._upsert(conn, key, value, int(now + ttl))
+
+            numentries = conn.execute(select(func.count()).select_from(self.table)).scalar()
+            if numentries > self.maxsize:
+                evicted = conn.execute(delete(self.table).where(self.table.c.expires <= now)).rowcount
+                excess = numentries - evicted - self.maxsize
+                if excess > 0:
+                    ids = conn.execute(select(self.table.c.id).order_by(self.table.c.expires)
+                                       .limit(excess)).scalars().all()
+                    conn.execute(delete(self.table).where(self.table.c.id.in_(ids)))
+                    evicted += len(ids)
+                with self._statslock:
+                    self.evictions += evicted
+
+    def _upsert(self, conn, key, value, expires):
+        """insert or replace entry in one statement, as other processes may be caching the same key"""
+        values = dict(cachekey=key, response=value, expires=expires)
+        dialect = conn.dialect.name
+        if dialect == 'mysql':
+            stmt = mysql_insert(self.table).values(values)
+            conn.execute(stmt.on_duplicate_key_update(response=stmt.inserted.response, expires=stmt.inserted.expires))
+        elif dialect == 'sqlite':
+            stmt = sqlite_insert(self.table).values(values)
+            conn.execute(stmt.on_conflict_do_update(index_elements=['cachekey'], 
+                                                    set_=dict(response=stmt.excluded.response, expires=stmt.excluded.expires)))
+        else:
+            conn.execute(delete(self.table).where(self.table.c.cachekey == key))
+            conn.execute(self.table.insert().values(values))
+
+class TieredResponseCache(ResponseCache):
+    '''
+    in-process cache in front of a shared cache
+
+    entries found in the shared cache are copied to the local cache, for localttl seconds
+
+    :param local: ResponseCache in this process, e.g., LRUResponseCache
+    :param shared: ResponseCache shared by processes, e.g., DbResponseCache
+    :param localttl: max seconds entries from the shared cache are kept in the local cache
+    '''
+    def __init__(self, local, shared, localttl=60):
+        super().__init__()
+        self.local = local
+        self.shared = shared
+        self.localttl = localttl
+
+    def _get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.localttl)
+        return value
+
+    def _set(self, key, value, ttl):
+        self.local.set(key, value, ttl)
+        self.shared.set(key, value, ttl)
+
+    def stats(self):
+        stats = super().stats()
+        stats['local'] = self.local.stats()
+        stats['shared'] = self.shared.stats()
+        return stats
@@ -5,6 +5,12 @@
 #   ----        ------      ------
 #   02/19/19    Lou King    Create from loutilities.runsignup
 #   07/30/26    Lou King    refactor to use running.runsignup.RunSignupBase for shared auth/session handling
+#   10/18/26    Lou King    concurrent page fetching
+#   10/18/26    Lou King    iterator variants of paged methods
+#   10/18/26    Lou King    response cache for GET methods
+#   10/18/26    Lou King    request scheduler with rate limit, retry and backoff
+#   10/18/26    Lou King    batch coupon add/edit, coupon sync
+#   10/18/26    Lou King    paged requests run in the app context, for the response cache
 #
 #   Copyright 2019 Lou King
 ###########################################################################################
@@ -14,10 +20,21 @@ runsignup - access methods for runsignup.com
 '''
 
 # standard
-from json import dumps
+from json import dumps, loads
+from re import escape, fullmatch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+from random import uniform
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 # pypi
-from flask import current_app
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
 
 # github
 
@@ -25,6 +42,7 @@ from flask import current_app
 
 # home grown
 from running.runsignup import RunSignupBase, accessError
+from .responsecache import cachekey
 
 # use api.runsignup.com per https://info.runsignup.com/2025/08/06/upgrading-our-api-infrastructure-for-ai-api-runsignup-com/
 coupons_url = 'https://api.runsignup.com/rest/race/{race_id}/coupons'
@@ -32,6 +50,303 @@ race_url = 'https://api.runsignup.com/rest/race/{race_id}'
 raceparticipants_url = 'https://api.runsignup.com/rest/race/{race_id}/participants'
 removedparticipants_url = 'https://api.runsignup.com/rest/race/{race_id}/removed-participants'
 
+# max number of results RunSignUp returns per page
+BITESIZE = 100
+
+# default seconds GET responses are cached, by method url; methods not listed aren't cached
+# event metadata rarely changes within an hour
+CACHE_TTLS = {
+    race_url: 60*60,
+}
+
+# participant queries are never cached, as they're used for delta updates
+NOCACHE_URLS = [raceparticipants_url, removedparticipants_url]
+
+# request rate, see https://runsignup.com/API -- set RSU_RATE, RSU_BURST in config to match the limits for the account
+RATE = 10       # requests per second, sustained
+BURST = 20      # requests which can be sent at once after idle
+
+# retries for throttled (429) or failed (5xx) responses
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 30    # seconds
+
+# max number of coupons sent in one coupons POST
+COUPON_CHUNK = 50
+
+# coupon fields compared by RunSignUp.synccoupons() to decide whether a coupon needs to be sent
+COUPON_SYNC_FIELDS = ['end_date', 'max_num_race_registrants', 'coupon_notes']
+
+# endpoint names for latency tracking
+ENDPOINTS = {
+    'coupons': coupons_url,
+    'race': race_url,
+    'participants': raceparticipants_url,
+    'removed-participants': removedparticipants_url,
+}
+
+def _urlpattern(url):
+    '''return regex pattern which matches url template, with any value for the fields'''
+    return escape(url).replace(r'\{race_id\}', r'[^/]+')
+
+def couponspec(coupon_code, start, expiration, numregistrations, clientname, coupon_id=None):
+    '''
+    return coupon for coupons POST method, see RunSignUp.setcoupon() for parameters
+    '''
+    return {
+        "coupon_id": coupon_id,
+        "coupon_code": coupon_code,
+        "percentage": 100,
+        "fixed_discount_in_cents": 0,
+        "discount_type": "R",
+        "start_date": "{} 00:00:00".format(start),
+        "end_date": "{} 23:59:59".format(expiration),
+
+        "applies_to_race_fee": "T",
+        "exclude_event_cost": "F",
+        "applies_to_giveaway": "F",
+        "applies_to_addons": "F",
+        "applies_to_club_membership_discounts": "F",
+        "applies_to_race_memberships": "F",
+        "applies_to_group_setup_fees": "F",
+        "applies_to_group_special_event_costs": "F",
+        "applies_to_age_based_pricing": "F",
+        "applies_to_multi_person_pricing": "F",
+        "applies_to_extra_fee": "F",
+        "applies_with_multi_event_discount": "F",
+        "applies_to_store": "F",
+
+        "new_customer_only": "F",
+        "minimum_amount_in_cents": 0,
+        "max_num_race_registrants": numregistrations,
+
+        "event_specific": "F",
+        "applicable_event_ids": [],
+
+        "coupon_notes": clientname,
+        "tags": [],
+    }
+
+def couponrequest(coupon_code, start, expiration, numregistrations, clientname, coupon_id=None):
+    '''
+    return request for coupons POST method, for a single coupon, see RunSignUp.setcoupon() for parameters
+    '''
+    return {
+        'coupons' : [
+            couponspec(coupon_code, start, expiration, numregistrations, clientname, coupon_id=coupon_id)
+        ]
+    }
+
+########################################################################
+class TokenBucket():
+########################################################################
+    '''
+    thread safe token bucket rate limiter
+
+    :param rate: tokens added per second
+    :param capacity: max tokens held
+    '''
+
+    #----------------------------------------------------------------------
+    def __init__(self, rate, capacity, clock=monotonic, sleep=sleep):
+    #----------------------------------------------------------------------
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.pauseduntil = 0
+        self.lock = Lock()
+
+    #----------------------------------------------------------------------
+    def tryacquire(self):
+    #----------------------------------------------------------------------
+        '''take a token if available, return 0 if taken, else seconds to wait before trying again'''
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.pauseduntil and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            wait = max(self.pauseduntil - now, (1 - self.tokens) / self.rate)
+            # floor keeps float rounding from stalling progress toward a whole token
+            return max(wait, 0.001)
+
+    #----------------------------------------------------------------------
+    def acquire(self):
+    #----------------------------------------------------------------------
+        '''wait until a token is available, and take it'''
+        while True:
+            wait = self.tryacquire()
+            if not wait:
+                return
+            self.sleep(wait)
+
+    #----------------------------------------------------------------------
+    def pause(self, seconds):
+    #----------------------------------------------------------------------
+        '''hold all requests for seconds, e.g., when the server says we're being throttled'''
+        with self.lock:
+            self.pauseduntil = max(self.pauseduntil, self.clock() + seconds)
+            self.tokens = 0
+
+#----------------------------------------------------------------------
+def _notsent(exc):
+#----------------------------------------------------------------------
+    '''return True if requests exception was raised before the request was sent, i.e., while connecting'''
+    if isinstance(exc, ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(exc, ConnectionError) and isinstance(reason, NewConnectionError)
+
+########################################################################
+class RequestScheduler():
+########################################################################
+    '''
+    sends requests within a rate limit, retrying throttled and failed requests with backoff, and tracks
+    latency for each endpoint
+
+    share one scheduler among the clients using the same credentials, as the rate limit applies to all of them
+
+    GET requests are retried on 429, 5xx, connection errors and timeouts. Other requests may not be
+    idempotent, so are only retried on 429 (which RunSignUp didn't process) and on failures to connect,
+    as a read timeout or dropped connection may come after RunSignUp processed the request
+
+    :param rate: requests per second
+    :param burst: requests which can be sent at once after idle
+    :param maxretries: max number of retries for a request
+    :param backoffbase: seconds before first retry, doubles for each retry (with jitter)
+    :param backoffmax: max seconds before retry
+    '''
+
+    #----------------------------------------------------------------------
+    def __init__(self, rate=RATE, burst=BURST, maxretries=MAX_RETRIES, backoffbase=BACKOFF_BASE,
+                 backoffmax=BACKOFF_MAX, clock=monotonic, sleep=sleep):
+    #----------------------------------------------------------------------
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.maxretries = maxretries
+        self.backoffbase = backoffbase
+        self.backoffmax = backoffmax
+        self.clock = clock
+        self.sleep = sleep
+        self.endpoints = [(name, _urlpattern(url)) for name, url in ENDPOINTS.items()]
+        self.latency = {}
+        self.statslock = Lock()
+
+    #----------------------------------------------------------------------
+    def request(self, session, method, url, **kwargs):
+    #----------------------------------------------------------------------
+        '''
+        send request through session, retrying as needed
+
+        :param session: requests.Session
+        :param method: http method, e.g., 'GET'
+        :param url: url for request
+        :param kwargs: keyword arguments for session method, e.g., session.get()
+        :return: final response, which may still be an error
+        '''
+        endpoint = self.endpoint(url)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            start = self.clock()
+            try:
+                resp = getattr(session, method.lower())(url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                self.record(endpoint, self.clock() - start, error=True)
+                if attempt >= self.maxretries or (method.upper() != 'GET' and not _notsent(e)):
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                self.record(endpoint, self.clock() - start, error=resp.status_code != 200)
+                delay = self.retrydelay(method, resp.status_code, resp.headers, attempt)
+                if delay is None:
+                    return resp
+
+            attempt += 1
+            self.recordretry(endpoint)
+            self.sleep(delay)
+
+    #----------------------------------------------------------------------
+    def retrydelay(self, method, status, headers, attempt):
+    #----------------------------------------------------------------------
+        '''
+        return seconds to wait before retrying a response, or None if it shouldn't be retried
+
+        throttling (429) applies to all requests, so the bucket is paused for the delay
+
+        :param method: http method of request
+        :param status: http status of response
+        :param headers: response headers
+        :param attempt: number of retries already made
+        '''
+        retryable = (429, 500, 502, 503, 504) if method.upper() == 'GET' else (429,)
+        if status not in retryable or attempt >= self.maxretries:
+            return None
+        retryafter = self._retryafter(headers)
+        delay = retryafter if retryafter is not None else self.backoff(attempt)
+        if status == 429:
+            self.bucket.pause(delay)
+        return delay
+
+    #----------------------------------------------------------------------
+    def stats(self):
+    #----------------------------------------------------------------------
+        '''
+        return {endpoint: {count, errors, retries, mean, max}, ...} latencies in seconds
+        '''
+        with self.statslock:
+            return {endpoint: dict(count=l['count'], errors=l['errors'], retries=l['retries'],
+                                   mean=l['total'] / l['count'] if l['count'] else 0, max=l['max'])
+                    for endpoint, l in self.latency.items()}
+
+    #----------------------------------------------------------------------
+    def endpoint(self, url):
+    #----------------------------------------------------------------------
+        '''return endpoint name for url, for stats'''
+        return next((name for name, pattern in self.endpoints if fullmatch(pattern, url)), url)
+
+    #----------------------------------------------------------------------
+    def record(self, endpoint, duration, error):
+    #----------------------------------------------------------------------
+        '''record latency of a request'''
+        with self.statslock:
+            l = self.latency.setdefault(endpoint, dict(count=0, errors=0, retries=0, total=0, max=0))
+            l['count'] += 1
+            l['errors'] += 1 if error else 0
+            l['total'] += duration
+            l['max'] = max(l['max'], duration)
+
+    #----------------------------------------------------------------------
+    def recordretry(self, endpoint):
+    #----------------------------------------------------------------------
+        with self.statslock:
+            self.latency[endpoint]['retries'] += 1
+
+    #----------------------------------------------------------------------
+    def backoff(self, attempt):
+    #----------------------------------------------------------------------
+        '''exponential backoff with full jitter'''
+        return uniform(0, min(self.backoffmax, self.backoffbase * 2**attempt))
+
+    #----------------------------------------------------------------------
+    def _retryafter(self, headers):
+    #----------------------------------------------------------------------
+        '''return seconds from Retry-After header (seconds or http date), or None'''
+        retryafter = headers.get('Retry-After')
+        if not retryafter:
+            return None
+        try:
+            seconds = float(retryafter)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(retryafter) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoffmax, max(0, seconds))
+
 ########################################################################
 class RunSignUp(RunSignupBase):
 ########################################################################
@@ -39,49 +354,182 @@ class RunSignUp(RunSignupBase):
     access methods for RunSignUp.com
 
     see :class:`running.runsignup.RunSignupBase` for authentication / session parameters
+
+    :param concurrency: max number of pages fetched at the same time for paged methods, default 1 (serial).
+        Keep this within RunSignUp's rate limits
+    :param cache: optional :class:`contracts.responsecache.ResponseCache` for GET responses
+    :param cachettls: {method url: seconds, ...} for GET responses which are cached, default CACHE_TTLS.
+        Only use for methods whose data isn't changed through this client
+    :param scheduler: :class:`RequestScheduler` for rate limiting and retries, shared with other clients
+        using the same credentials. Default is a scheduler for this client only
     '''
 
     #----------------------------------------------------------------------
-    def getcoupons(self, race_id, coupon_code=None):
+    def __init__(self, concurrency=1, cache=None, cachettls=CACHE_TTLS, scheduler=None, **kwargs):
+    #----------------------------------------------------------------------
+        super().__init__(**kwargs)
+        self.scheduler = scheduler or RequestScheduler()
+        self.concurrency = concurrency
+        self.executor = None
+        self.cache = cache
+        # method url templates are matched against the formatted urls
+        self.cachettls = [(_urlpattern(url), ttl) for url, ttl in cachettls.items() if url not in NOCACHE_URLS]
+
+    #----------------------------------------------------------------------
+    def open(self):
+    #----------------------------------------------------------------------
+        super().open()
+
+        # pages are fetched concurrently over the shared session, so the connection pool needs to be
+        # at least as large as the number of worker threads
+        if self.concurrency > 1:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+        # even when serial, the next page is fetched in the background while the caller handles this one
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='runsignup')
+
+    #----------------------------------------------------------------------
+    def close(self):
+    #----------------------------------------------------------------------
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        super().close()
+
+    #----------------------------------------------------------------------
+    def _rsuget(self, methodurl, **payload):
+    #----------------------------------------------------------------------
+        '''
+        get method for runsignup access, using self.cache for method urls which have a ttl
+
+        replaces RunSignupBase._rsuget, so requests go through self.scheduler
+
+        :param methodurl: runsignup method url to call
+        :param **payload: parameters for the method
+        '''
+        ttl = None
+        if self.cache:
+            ttl = next((ttl for pattern, ttl in self.cachettls if fullmatch(pattern, methodurl)), None)
+        if not ttl:
+            return self._rsugetjson(methodurl, **payload)
+
+        # credentials are part of the key, as they determine what the response contains
+        key = cachekey(methodurl, dict(self.client_credentials, **payload))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return loads(cached)
+
+        data = self._rsugetjson(methodurl, **payload)
+        self.cache.set(key, dumps(data), ttl)
+        return data
+
+    #----------------------------------------------------------------------
+    def _rsugetjson(self, methodurl, **payload):
+    #----------------------------------------------------------------------
+        '''
+        get method for runsignup access (json format response), through self.scheduler
+
+        :param methodurl: runsignup method url to call
+        :param **payload: parameters for the method
+        '''
+        thispayload = self.client_credentials.copy()
+        thispayload.update(payload)
+        thispayload.update({'format':'json'})
+
+        resp = self.scheduler.request(self.session, 'GET', methodurl, params=thispayload)
+        if resp.status_code != 200:
+            raise accessError('HTTP response code={}, url={}'.format(resp.status_code,resp.url))
+
+        data = resp.json()
+
+        if 'error' in data:
+            raise accessError('RSU response code={}-{}, url={}'.format(data['error']['error_code'],data['error']['error_msg'],resp.url))
+
+        return data
+
+    #----------------------------------------------------------------------
+    def _iterpages(self, methodurl, pageitems, **params):
+    #----------------------------------------------------------------------
+        '''
+        generate the items from each page of a paged RunSignUp method, one page at a time, in page order
+
+        the first page is always fetched alone. Once a page is known to be full, more pages are requested
+        in the background, so that up to self.concurrency pages are in flight while the caller handles the
+        current one. The total isn't known, so pages past the end may be requested speculatively; these
+        come back empty
+
+        :param methodurl: runsignup method url to call
+        :param pageitems: function(data) which returns the list of items in a page's response data
+        :param params: parameters for the method, other than page and results_per_page
+        '''
+        # pages are fetched by executor threads, which need the app context for the cache, e.g., DbResponseCache
+        app = current_app._get_current_object() if has_app_context() else None
+        def getpage(page):
+            if app is None:
+                return pageitems(self._rsuget(methodurl, page=page, results_per_page=BITESIZE, **params))
+            with app.app_context():
+                return pageitems(self._rsuget(methodurl, page=page, results_per_page=BITESIZE, **params))
+
+        inflight = deque()
+        nextpage = 1
+        inflight.append(self.executor.submit(getpage, nextpage))
+        try:
+            while inflight:
+                theseitems = inflight.popleft().result()
+
+                # stop iterating if we've reached the end of the data
+                if len(theseitems) < BITESIZE:
+                    if theseitems:
+                        yield theseitems
+                    return
+
+                # keep the window full before handing this page to the caller
+                while len(inflight) < self.concurrency:
+                    nextpage += 1
+                    inflight.append(self.executor.submit(getpage, nextpage))
+
+                yield theseitems
+
+        # caller may stop early, or we're done; don't leave requests behind
+        finally:
+            for future in inflight:
+                future.cancel()
+
+    #----------------------------------------------------------------------
+    def itercoupons(self, race_id, coupon_code=None):
     #----------------------------------------------------------------------
         """
-        return coupons accessible to this application
+        generate coupons accessible to this application, one page (list of coupons) at a time
 
         :param race_id: id of race
         :param coupon_code: coupon code for specific coupon, None for all coupons
         """
 
         if self.debug:
-            current_app.logger.debug('getcoupons({}, coupon_code={})'.format(race_id, coupon_code))
-
-        # max number of coupons in coupon list is 100, so need to loop, collecting
-        # BITESIZE coupons at a time.  These are all added to coupons list, and final
-        # list is returned to the caller
-        BITESIZE = 100
-        page = 1
-        coupons = []
-        while True:
-            params = {
-                'page':page,
-                'results_per_page':BITESIZE,
-            }
-            if coupon_code:
-                params['coupon_code'] = coupon_code
-
-            data = self._rsuget(coupons_url.format(race_id=race_id),
-                                **params
+            current_app.logger.debug('itercoupons({}, coupon_code={})'.format(race_id, coupon_code))
+
+        # max number of coupons in coupon list is BITESIZE, so need to walk through all the pages
+        params = {}
+        if coupon_code:
+            params['coupon_code'] = coupon_code
+        return self._iterpages(coupons_url.format(race_id=race_id),
+                               lambda data: data['coupons'],
+                               **params
                                )
-            if len(data['coupons']) == 0: break
-
-            thesecoupons = data['coupons']
 
-            coupons += thesecoupons
-            page += 1
+    #----------------------------------------------------------------------
+    def getcoupons(self, race_id, coupon_code=None):
+    #----------------------------------------------------------------------
+        """
+        return coupons accessible to this application
 
-            # stop iterating if we've reached the end of the data
-            if len(data['coupons']) < BITESIZE: break
+        :param race_id: id of race
+        :param coupon_code: coupon code for specific coupon, None for all coupons
+        """
 
-        return coupons
+        return [coupon for page in self.itercoupons(race_id, coupon_code=coupon_code) for coupon in page]
 
     #----------------------------------------------------------------------
     def setcoupon(self, race_id, coupon_code, start, expiration, numregistrations, clientname, coupon_id=None):
@@ -107,43 +555,7 @@ class RunSignUp(RunSignupBase):
             'race_id'           : race_id,
             'request_format'    : 'json',
         }
-        request = {
-            'coupons' : [
-                {
-                    "coupon_id": coupon_id,
-                    "coupon_code": coupon_code,
-                    "percentage": 100,
-                    "fixed_discount_in_cents": 0,
-                    "discount_type": "R",
-                    "start_date": "{} 00:00:00".format(start),
-                    "end_date": "{} 23:59:59".format(expiration),
-
-                    "applies_to_race_fee": "T",
-                    "exclude_event_cost": "F",
-                    "applies_to_giveaway": "F",
-                    "applies_to_addons": "F",
-                    "applies_to_club_membership_discounts": "F",
-                    "applies_to_race_memberships": "F",
-                    "applies_to_group_setup_fees": "F",
-                    "applies_to_group_special_event_costs": "F",
-                    "applies_to_age_based_pricing": "F",
-                    "applies_to_multi_person_pricing": "F",
-                    "applies_to_extra_fee": "F",
-                    "applies_with_multi_event_discount": "F",
-                    "applies_to_store": "F",
-
-                    "new_customer_only": "F",
-                    "minimum_amount_in_cents": 0,
-                    "max_num_race_registrants": numregistrations,
-
-                    "event_specific": "F",
-                    "applicable_event_ids": [],
-
-                    "coupon_notes": clientname,
-                    "tags": [],
-                }
-            ]
-        }
+        request = couponrequest(coupon_code, start, expiration, numregistrations, clientname, coupon_id=coupon_id)
         request_json = dumps(request)
         params['request'] = request_json
 
@@ -153,6 +565,73 @@ class RunSignUp(RunSignupBase):
 
         return data['coupons']
 
+    #----------------------------------------------------------------------
+    def setcoupons(self, race_id, coupons, chunksize=COUPON_CHUNK):
+    #----------------------------------------------------------------------
+        """
+        add or edit many coupons, chunksize coupons per POST
+
+        :param race_id: id of race
+        :param coupons: list of coupons from :func:`couponspec`, with coupon_id for edit, None for add
+        :param chunksize: max number of coupons sent in one POST
+        :return: list of coupons returned by RunSignUp, in the order sent
+        """
+
+        if self.debug:
+            current_app.logger.debug('setcoupons({}, {} coupons)'.format(race_id, len(coupons)))
+
+        results = []
+        for i in range(0, len(coupons), chunksize):
+            params = {
+                'race_id'           : race_id,
+                'request_format'    : 'json',
+                'request'           : dumps({'coupons': coupons[i:i+chunksize]}),
+            }
+            data = self._rsupost(coupons_url.format(race_id=race_id),
+                                **params
+                               )
+            results += data['coupons']
+
+        return results
+
+    #----------------------------------------------------------------------
+    def synccoupons(self, race_id, coupons, current=None):
+    #----------------------------------------------------------------------
+        """
+        make RunSignUp coupons match coupons, sending only those which are new or changed
+
+        coupons already at RunSignUp are edited in place, keeping their start_date. A coupon is
+        changed if any of COUPON_SYNC_FIELDS differs
+
+        :param race_id: id of race
+        :param coupons: list of coupons from :func:`couponspec`
+        :param current: {coupon_code: coupon, ...} for coupons at RunSignUp, e.g., from a local index.
+            Default is to retrieve these with getcoupons()
+        :return: ({coupon_code: coupon, ...} with coupon_id, for all coupons; [coupon_code, ...] which were sent)
+        """
+        if current is None:
+            # rsu search includes any coupons with the coupon_code within the coupon string, so need to match exactly
+            # if more than one has the same code, the last is the current one
+            coupon_code = coupons[0]['coupon_code'] if len(coupons) == 1 else None
+            current = {c['coupon_code']: c for c in self.getcoupons(race_id, coupon_code=coupon_code)}
+
+        synced = {}
+        tosend = []
+        for coupon in coupons:
+            thiscurrent = current.get(coupon['coupon_code'])
+            if thiscurrent:
+                coupon = dict(coupon, coupon_id=thiscurrent['coupon_id'], start_date=thiscurrent['start_date'])
+                if not any(str(thiscurrent[f]) != str(coupon[f]) for f in COUPON_SYNC_FIELDS if f in thiscurrent):
+                    synced[coupon['coupon_code']] = thiscurrent
+                    continue
+            tosend.append(coupon)
+
+        # RunSignUp returns the coupons in the order sent
+        for sent, coupon in zip(tosend, self.setcoupons(race_id, tosend)):
+            synced[sent['coupon_code']] = dict(sent, **coupon)
+
+        return synced, [c['coupon_code'] for c in tosend]
+
 
     # ----------------------------------------------------------------------
     def getraceevents(self, race_id):
@@ -175,97 +654,76 @@ class RunSignUp(RunSignupBase):
 
 
     # ----------------------------------------------------------------------
-    def getraceparticipants(self, race_id, event_id, **kwargs):
+    def iterraceparticipants(self, race_id, event_id, **kwargs):
     # ----------------------------------------------------------------------
         """
-        return race information accessible to this application
+        generate race participants accessible to this application, one page (list of participants) at a time
 
         :param race_id: id of race
         :param event_id: id of event (instance of event for race in a given year)
         """
 
         if self.debug:
-            current_app.logger.debug('getraceparticipants({}, event_id={})'.format(race_id, event_id))
-
-        # max number of raceparticipants in raceparticipant list is 100, so need to loop, collecting
-        # BITESIZE raceparticipants at a time.  These are all added to raceparticipants list, and final
-        # list is returned to the caller
-        BITESIZE = 100
-        page = 1
-        raceparticipants = []
-        while True:
-            params = {
-                'event_id': event_id,
-                'page': page,
-                'results_per_page': BITESIZE,
-            }
-            params.update(**kwargs)
-
-            # note list is returned; only asking for one event, so data gets the first item in list
-            data = self._rsuget(raceparticipants_url.format(race_id=race_id),
-                                **params
-                                )[0]
-            if 'participants' not in data or len(data['participants']) == 0: break
-
-            theseraceparticipants = data['participants']
+            current_app.logger.debug('iterraceparticipants({}, event_id={})'.format(race_id, event_id))
+
+        # max number of raceparticipants in raceparticipant list is BITESIZE, so need to walk through all the pages
+        # note list is returned; only asking for one event, so data gets the first item in list
+        return self._iterpages(raceparticipants_url.format(race_id=race_id),
+                               lambda data: data[0].get('participants', []),
+                               event_id=event_id,
+                               **kwargs
+                               )
 
-            raceparticipants += theseraceparticipants
-            page += 1
+    # ----------------------------------------------------------------------
+    def getraceparticipants(self, race_id, event_id, **kwargs):
+    # ----------------------------------------------------------------------
+        """
+        return race participants accessible to this application
 
-            # stop iterating if we've reached the end of the data
-            if len(data['participants']) < BITESIZE: break
+        :param race_id: id of race
+        :param event_id: id of event (instance of event for race in a given year)
+        """
 
-        return raceparticipants
+        return [p for page in self.iterraceparticipants(race_id, event_id, **kwargs) for p in page]
 
     # ----------------------------------------------------------------------
-    def getremovedparticipants(self, race_id, event_id, **kwargs):
+    def iterremovedparticipants(self, race_id, event_id, **kwargs):
     # ----------------------------------------------------------------------
         """
-        return race information accessible to this application
+        generate removed race participants accessible to this application, one page (list of participants) at a time
 
         :param race_id: id of race
         :param event_id: id of event (instance of event for race in a given year)
         """
 
         if self.debug:
-            current_app.logger.debug('getremovedparticipants({}, event_id={})'.format(race_id, event_id))
-
-        # max number of raceparticipants in raceparticipant list is 100, so need to loop, collecting
-        # BITESIZE raceparticipants at a time.  These are all added to raceparticipants list, and final
-        # list is returned to the caller
-        BITESIZE = 100
-        page = 1
-        removedparticipants = []
-        while True:
-            params = {
-                'event_id': event_id,
-                'page': page,
-                'results_per_page': BITESIZE,
-            }
-            params.update(**kwargs)
-
-            # note list is returned; only asking for one event, so data gets the first item in list
-            data = self._rsuget(removedparticipants_url.format(race_id=race_id),
-                                **params
-                                )[0]
-            if 'event' not in data: break
-            if 'participants' not in data['event'] or len(data['event']['participants']) == 0: break
-
-            theseremovedparticipants = data['event']['participants']
+            current_app.logger.debug('iterremovedparticipants({}, event_id={})'.format(race_id, event_id))
+
+        # max number of removedparticipants in removedparticipant list is BITESIZE, so need to walk through all the pages
+        # note list is returned; only asking for one event, so data gets the first item in list
+        return self._iterpages(removedparticipants_url.format(race_id=race_id),
+                               lambda data: data[0].get('event', {}).get('participants', []),
+                               event_id=event_id,
+                               **kwargs
+                               )
 
-            removedparticipants += theseremovedparticipants
-            page += 1
+    # ----------------------------------------------------------------------
+    def getremovedparticipants(self, race_id, event_id, **kwargs):
+    # ----------------------------------------------------------------------
+        """
+        return removed race participants accessible to this application
 
-            # stop iterating if we've reached the end of the data
-            if len(data['event']['participants']) < BITESIZE: break
+        :param race_id: id of race
+        :param event_id: id of event (instance of event for race in a given year)
+        """
 
-        return removedparticipants
+        return [p for page in self.iterremovedparticipants(race_id, event_id, **kwargs) for p in page]
 
     #----------------------------------------------------------------------
     def _rsupost(self, methodurl, **data):
     #----------------------------------------------------------------------
         """
-        post method for runsignup access
+        post method for runsignup access, through self.scheduler
 
         RunSignupBase only implements _rsuget/_rsugetcsv; contracts needs POST for coupon management
 
@@ -280,7 +738,7 @@ class RunSignUp(RunSignupBase):
             'request_format':'json',
         })
 
-        resp = self.session.post(methodurl, data=thispayload)
+        resp = self.scheduler.request(self.session, 'POST', methodurl, data=thispayload)
         if resp.status_code != 200:
             raise accessError('HTTP response code={}, url={}'.format(resp.status_code,resp.url))
 
@@ -66,6 +66,9 @@ class Testing(Config):
     # need to allow logins in flask-security. see https://github.com/mattupstate/flask-security/issues/259
     LOGIN_DISABLED = False
 
+    # google drive uploads are processed by the tests which need them, see contracts.driveupload
+    CONTRACTS_UPLOAD_WORKER = False
+
     # required by loutilities.user.applogging.setlogging(), normally supplied by config/users.cfg
     EXCEPTION_EMAIL = 'test-exceptions@example.com'
 
@@ -0,0 +1,196 @@
+'''
+snapshot - columnar snapshots of the registration cache
+==========================================================
+
+a race's snapshot holds one row per cached registration, with columns event_id, registration day,
+gender, age at race and active flag. It is saved as a NumPy .npy file with one row per column, so each
+column is contiguous, and a json file with the race's events. Snapshots are memory-mapped when loaded,
+so charts can be served from them without querying the database
+'''
+
+# standard
+import os
+from json import dump, load
+from time import time
+from datetime import date, datetime
+from threading import Lock
+
+# pypi
+from flask import current_app
+import numpy as np
+
+# homegrown
+from .dbmodel import db, SponsorRaceRegCache, SponsorRaceRegPii
+
+# snapshot directory, override with REGCACHE_SNAPSHOT_DIR in config
+SNAPSHOT_DIR = '/tmp/contracts_regsnapshots'
+
+# rows of the snapshot array
+COLUMNS = ['event_id', 'regday', 'gender', 'age', 'active']
+EVENT_ID, REGDAY, GENDER, AGE, ACTIVE = range(len(COLUMNS))
+
+# gender codes, index in GENDERS; 0 is unknown
+GENDERS = ['', 'M', 'F', 'X']
+
+# age when dob isn't known
+AGE_UNKNOWN = -1
+
+# number of rows fetched from the database at a time
+SNAPSHOT_BATCHSIZE = 5000
+
+EPOCH = date(1970, 1, 1)
+
+def _snapshotdir():
+    return current_app.config.get('REGCACHE_SNAPSHOT_DIR', SNAPSHOT_DIR)
+
+def snapshot_paths(race_id):
+    """return (array path, metadata path) for race's snapshot
+
+    :param race_id: SponsorRace.id
+    """
+    base = os.path.join(_snapshotdir(), f'race-{race_id}')
+    return base + '.npy', base + '.json'
+
+def dayindex(d):
+    """return days since 1970-01-01 for date d"""
+    return (d - EPOCH).days
+
+def daydate(dayindex):
+    """return date for days since 1970-01-01"""
+    return date.fromordinal(EPOCH.toordinal() + int(dayindex))
+
+def _age(dob, racedate):
+    """return age at racedate for date of birth dob, AGE_UNKNOWN if dob is None"""
+    if not dob:
+        return AGE_UNKNOWN
+    return racedate.year - dob.year - ((racedate.month, racedate.day) < (dob.month, dob.day))
+
+def event_racedates(events):
+    """return {event_id: (event name, race date), ...} for RunSignUp events
+
+    race date is date of event start, unless end time is specified
+    """
+    return {e['event_id']: (e['name'], datetime.strptime((e['end_time'] or e['start_time']).split(' ')[0], '%m/%d/%Y').date())
+            for e in events}
+
+def write_regsnapshot(race, racedates):
+    """write snapshot of race's registration cache
+
+    the files are written under temporary names, then renamed, so readers always see a complete snapshot
+
+    :param race: SponsorRace
+    :param racedates: {event_id: (event name, race date), ...} for race's events, see event_racedates()
+    :return: number of registrations in the snapshot
+    """
+    c = SponsorRaceRegCache
+    p = SponsorRaceRegPii
+    query = (db.session.query(c.event_id, c.registration_date, p.gender, p.dob, c.is_active)
+             .outerjoin(p, p.registration_id == c.registration_id)
+             .filter(c.event_id.in_(list(racedates)))
+             .yield_per(SNAPSHOT_BATCHSIZE))
+    genders = {g: i for i, g in enumerate(GENDERS)}
+    rows = []
+    for event_id, regdate, gender, dob, is_active in query:
+        if not regdate:
+            continue
+        rows.append((event_id, dayindex(regdate.date()), genders.get((gender or '').upper()[:1], 0),
+                     _age(dob, racedates[event_id][1]), bool(is_active)))
+
+    # one row per column, so each column is contiguous
+    data = np.array(rows, dtype=np.int32).reshape(-1, len(COLUMNS)).T.copy()
+
+    snapshotpath, metapath = snapshot_paths(race.id)
+    os.makedirs(os.path.dirname(snapshotpath), exist_ok=True)
+    meta = dict(race_id=race.id, race=race.race, created=int(time()), cacheupdatets=race.cacheupdatets,
+                numrows=data.shape[1], columns=COLUMNS, genders=GENDERS,
+                events={str(event_id): dict(name=name, racedate=racedate.isoformat())
+                        for event_id, (name, racedate) in racedates.items()})
+
+    with open(snapshotpath + '.tmp', 'wb') as f:
+        np.save(f, data)
+    with open(metapath + '.tmp', 'w') as f:
+        dump(meta, f)
+    os.replace(snapshotpath + '.tmp', snapshotpath)
+    os.replace(metapath + '.tmp', metapath)
+    return data.shape[1]
+
+class RegSnapshot():
+    '''
+    loaded registration cache snapshot
+
+    :param data: array of shape (len(COLUMNS), number of registrations), usually memory-mapped
+    :param meta: snapshot metadata
+    '''
+    def __init__(self, data, meta):
+        self.data = data
+        self.meta = meta
+
+    def column(self, name):
+        """return column by name, see COLUMNS"""
+        return self.data[COLUMNS.index(name)]
+
+    def age(self):
+        """return seconds since the snapshot was created"""
+        return time() - self.meta['created']
+
+    def events(self):
+        """return {event_id: (event name, race date), ...}"""
+        return {int(event_id): (event['name'], date.fromisoformat(event['racedate']))
+                for event_id, event in self.meta['events'].items()}
+
+    def regcounts(self, event_ids):
+        """return active registrations per event and day, in the same form as caching.race_regcounts()
+
+        :param event_ids: list of RunSignUp event ids
+        :return: [(event_id, 'yyyy-mm-dd', count), ...] sorted by event_id, day
+        """
+        data = self.data
+        selected = data[:, (data[ACTIVE] != 0) & np.isin(data[EVENT_ID], event_ids)]
+        pairs, counts = np.unique(selected[[EVENT_ID, REGDAY]], axis=1, return_counts=True)
+        return [(int(event_id), daydate(day).isoformat(), int(count))
+                for event_id, day, count in zip(pairs[0], pairs[1], counts)]
+
+# loaded snapshots, keyed by path, with the file's (inode, mtime) when they were loaded
+_loaded = {}
+_loadedlock = Lock()
+
+def fresh_regsnapshot(race_id):
+    """return race's RegSnapshot if it's younger than REGCACHE_SNAPSHOT_MAXAGE seconds in config, else None
+
+    REGCACHE_SNAPSHOT_MAXAGE defaults to 0, so snapshots aren't used unless configured
+
+    :param race_id: SponsorRace.id
+    """
+    maxage = current_app.config.get('REGCACHE_SNAPSHOT_MAXAGE', 0)
+    if not maxage:
+        return None
+    snapshot = load_regsnapshot(race_id)
+    if not snapshot or snapshot.age() > maxage:
+        return None
+    return snapshot
+
+def load_regsnapshot(race_id):
+    """return RegSnapshot for race, memory-mapped, or None if race has no snapshot
+
+    snapshots are kept loaded within the process until their file is replaced
+
+    :param race_id: SponsorRace.id
+    """
+    snapshotpath, metapath = snapshot_paths(race_id)
+    try:
+        stat = os.stat(snapshotpath)
+    except FileNotFoundError:
+        return None
+
+    with _loadedlock:
+        loaded = _loaded.get(snapshotpath)
+        # replaced files have a new inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if loaded and loaded[0] == version:
+            return loaded[1]
+
+        with open(metapath) as f:
+            meta = load(f)
+        snapshot = RegSnapshot(np.load(snapshotpath, mmap_mode='r'), meta)
+        _loaded[snapshotpath] = (version, snapshot)
+        return snapshot
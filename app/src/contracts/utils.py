@@ -4,6 +4,7 @@
 #       Date            Author          Reason
 #       ----            ------          ------
 #       11/19/18        Lou King        Create
+#       10/18/26        Lou King        Add event_servicefees, event_docfields from eventscontract
 #
 #   Copyright 2018 Lou King.  All rights reserved
 ###########################################################################################
@@ -18,13 +19,30 @@ from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy import and_
 
 # homegrown
-from contracts.dbmodel import db, Event, Tag, DateRule, State
+from contracts.dbmodel import db, Event, Tag, DateRule, State, FeeBasedOn
 from contracts.dbmodel import Sponsor, SponsorTag, SPONSORTAG_RACERENEWED
 from contracts.dbmodel import STATE_COMMITTED, STATE_RENEWED_PENDING, TAG_RACERENEWED
 from contracts.daterule import date2daterule, daterule2dates
 
 class parameterError(Exception): pass
 
+class feeError(parameterError):
+    '''
+    fee can't be calculated for event
+
+    :param message: error message
+    :param field: Event attribute which needs to be changed
+    :param status: what's wrong with field
+    '''
+    def __init__(self, message, field, status):
+        super().__init__(message)
+        self.field = field
+        self.status = status
+
+    # keep field and status when pickled, e.g., raised in a worker process
+    def __reduce__(self):
+        return (feeError, (str(self), self.field, self.status))
+
 #----------------------------------------------------------------------
 def time24(time):
 #----------------------------------------------------------------------
@@ -207,4 +225,108 @@ def renew_sponsorship(sponsorship):
                                                     Sponsor.client_id == sponsorship.client_id,
                                                     Sponsor.raceyear > thisraceyear)).all()
 
-    return newsponsorships
\ No newline at end of file
+    return newsponsorships
+#----------------------------------------------------------------------
+def event_servicefees(event):
+#----------------------------------------------------------------------
+    '''
+    calculate fees for event's services and addons
+
+    :param event: Event
+    :rtype: (servicefees, feetotal), servicefees is list of dict(service=, fee=, qty=, unitfee=)
+    :raises feeError: if a fee can't be calculated
+    '''
+    servicefees = []
+
+    feetotal = 0
+    for service in event.services:
+        servicefee = { 'service' : service.serviceLong }
+        # fixed fee
+        if service.feeType.feeType =='fixed':
+            thisfee = service.fee
+            servicefee.update( {'fee':thisfee, 'qty': '', 'unitfee': 'fixed' } ) 
+            servicefees.append( servicefee )
+
+        # fee is based on another field
+        elif service.feeType.feeType =='basedOnField':
+            field = service.basedOnField
+            # not clear why this needs to be converted to int, but otherwise see unicode value
+            # if can't be converted, then invalid format
+            try:
+                fieldval = int(getattr(event, field))
+            except (TypeError, ValueError) as e:
+                fieldval = None
+
+            # field not set
+            if not fieldval:
+                raise feeError('cannot calculate fee if {} not set'.format(field), field, 'needed to calculate fee')
+
+            feebasedons = FeeBasedOn.query.filter_by(serviceId=service.id).order_by(FeeBasedOn.fieldValue).all()
+            foundfee = False
+            for feebasedon in feebasedons:
+                lastfieldval = feebasedon.fieldValue
+                if fieldval <= feebasedon.fieldValue:
+                    thisfee = feebasedon.fee
+                    servicefee.update( {'fee':thisfee, 'qty':fieldval, 'unitfee': 'fixed' } ) 
+                    servicefees.append( servicefee )
+                    foundfee = True
+                    break
+
+            # fee not found
+            if not foundfee:
+                raise feeError('cannot calculate fee if {} greater than {}'.format(field, lastfieldval), field,
+                               'cannot calculate fee if this is greater than {}'.format(lastfieldval))
+                
+        # not sure how we could get here, but best to be defensive
+        else:
+            raise parameterError('unknown feeType: {}'.format(service.feeType.feeType))
+
+        # accumulate total fee
+        feetotal += thisfee
+
+    # need to calculate addons in addition to services (note automatically sorted by priority)
+    for addon in event.addOns:
+        servicefee = {'service': addon.longDescr}
+        if not addon.is_upricing:
+            thisfee = addon.fee
+            servicefee.update({'fee': thisfee, 'qty': '', 'unitfee': 'fixed'})
+        else:
+            qty = getattr(event, addon.up_basedon) - addon.up_subfixed
+            if qty < 0:
+                qty = 0
+            thisfee = addon.fee * qty
+            servicefee.update({'fee': thisfee, 'qty':qty, 'unitfee': f'${addon.fee}'})
+        servicefees.append(servicefee)
+
+        # accumulate total fee
+        feetotal += thisfee
+
+    return servicefees, feetotal
+
+#----------------------------------------------------------------------
+def event_docfilename(event):
+#----------------------------------------------------------------------
+    '''
+    return file name for event's contract or invoice
+    '''
+    return '{}-{}-{}.docx'.format(event.client.client, event.race.race, event.date)
+
+#----------------------------------------------------------------------
+def event_docfields(event, is_quote):
+#----------------------------------------------------------------------
+    '''
+    return additional merge fields for event's contract or invoice, see ContractManager.create()
+
+    :param event: Event
+    :param is_quote: True for contract (agreement/quote), False for invoice
+    :raises feeError: if a fee can't be calculated
+    '''
+    servicefees, feetotal = event_servicefees(event)
+    return {'servicenames': [s.service for s in event.services],
+            'addons'      : [a.shortDescr for a in event.addOns],
+            'doctype'     : 'AGREEMENT/QUOTE' if is_quote else 'INVOICE',
+            'is_quote'    : is_quote,
+            'servicefees' : servicefees,
+            'event'       : event.race.race,
+            'totalfees'   : { 'service' : 'TOTAL', 'fee' : feetotal },
+            }
@@ -5,19 +5,88 @@ common - views and apis common to different admin types
 
 # standard
 from re import match
+from hashlib import sha1
 
 # pypi
+from flask import request, make_response, current_app
 from flask_security import roles_accepted, current_user
+from sqlalchemy import func
 from loutilities.tables import DbCrudApiRolePermissions
 from loutilities.tables import REGEX_URL, REGEX_EMAIL
 
 # homegrown
 from . import bp
 from ...dbmodel import db, Client, State
-from ...version import __docversion__
+from ...version import __docversion__, __version__
 
 adminguide = f'https://contractility.readthedocs.io/en/{__docversion__}/contract-admin-guide.html'
 
+##########################################################################################
+# conditional GET support
+###########################################################################################
+
+def tablestoken(*models):
+    """return string which changes when any row of the models' tables is added, deleted or updated
+    
+    updates are detected through version_id, so models must have version_id_col
+    """
+    parts = []
+    for model in models:
+        count, maxid, versions = db.session.query(func.count(model.id), func.max(model.id), 
+                                                  func.sum(model.version_id)).one()
+        parts.append(f'{count}.{maxid}.{versions}')
+    return '-'.join(parts)
+
+class ConditionalGetMixin():
+    '''
+    answer GET with 304 Not Modified when the client's copy of the page or rest data is current
+    
+    derived class supplies versiontoken(), which needs to be cheap compared to building the response.
+    Responses are private to the user, and the client revalidates every time
+    '''
+    def versiontoken(self):
+        '''
+        return (token, lastmodified) for the current version of the data, or None to skip conditional handling
+        
+        token is a string which changes whenever the response would change, lastmodified is
+        timezone aware datetime or None
+        '''
+        return None
+
+    def get(self):
+        # full response path handles permission failures
+        if not self.permission():
+            return super().get()
+        
+        version = self.versiontoken()
+        if not version:
+            return super().get()
+        
+        token, lastmodified = version
+        userid = current_user.id if current_user.is_authenticated else ''
+        etag = sha1(f'{__version__}:{userid}:{token}'.encode()).hexdigest()
+        
+        # If-None-Match takes precedence over If-Modified-Since, see RFC 9110 13.2.2
+        if request.if_none_match:
+            notmodified = request.if_none_match.contains(etag)
+        else:
+            notmodified = (lastmodified is not None and request.if_modified_since is not None
+                           and lastmodified.replace(microsecond=0) <= request.if_modified_since)
+        
+        if notmodified:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(super().get())
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag)
+        if lastmodified:
+            response.last_modified = lastmodified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
 ##########################################################################################
 # clients endpoint
 ###########################################################################################
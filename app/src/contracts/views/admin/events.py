@@ -4,6 +4,7 @@
 #       Date            Author          Reason
 #       ----            ------          ------
 #       07/09/18        Lou King        Create
+#       10/18/26        Lou King        show contract and invoice upload status
 #
 #   Copyright 2018 Lou King
 #
@@ -33,6 +34,7 @@ from ...dbmodel import STATE_TENTATIVE
 from ...apicommon import failure_response, success_response
 from ...version import __docversion__
 from ...daterule import daterule2dates
+from ...driveupload import latest_uploads, upload_status
 from .daterules import daterule
 from .common import client
 from .eventscontract import EventsContract
@@ -482,6 +484,12 @@ dow = asctime('%a')
 event_dbmapping['dow'] = '__readonly__'
 event_formmapping['dow'] = lambda dbrow: dow.dt2asc(tYmd.asc2dt(dbrow.date)) if dbrow.date else ''
 
+# documents are uploaded in the background, see driveupload
+event_dbmapping['contractUpload'] = '__readonly__'
+event_formmapping['contractUpload'] = lambda dbrow: upload_status(latest_uploads(Event).get((dbrow.id, 'contractDocId')))
+event_dbmapping['invoiceUpload'] = '__readonly__'
+event_formmapping['invoiceUpload'] = lambda dbrow: upload_status(latest_uploads(Event).get((dbrow.id, 'invoiceDocId')))
+
 ## validate fields
 def event_validate(action, formdata):
     results = []
@@ -744,6 +752,7 @@ event_view = EventsContract(
                         { 'data': 'contractDocId', 'name': 'contractDocId', 'label': 'Contract Doc', 'type':'googledoc', 'opts':{'text':'click for contract'},
                           'visible': False,
                           },
+                        { 'data': 'contractUpload', 'name': 'contractUpload', 'label': 'Contract Upload', 'type':'readonly' },
                         { 'data': 'contractSignedDate', 'name': 'contractSignedDate', 'label': 'Contract Signed Date', 'type':'readonly' },
                         { 'data': 'contractApprover', 'name': 'contractApprover', 'label': 'Approver', 'type':'readonly' },
                         { 'data': 'contractApproverEmail', 'name': 'contractApproverEmail', 'label': 'Approver Email', 'type':'readonly' },
@@ -753,6 +762,7 @@ event_view = EventsContract(
                         { 'data': 'invoiceDocId', 'name': 'invoiceDocId', 'label': 'Invoice Doc', 'type':'googledoc', 'opts':{'text':'click for invoice'},
                           'visible': False,
                           },
+                        { 'data': 'invoiceUpload', 'name': 'invoiceUpload', 'label': 'Invoice Upload', 'type':'readonly' },
                         { 'data': 'isInvoiceInitiated', 'name': 'isInvoiceInitiated', 'label': 'Invoice Initiated', 'type':'readonly' },
                         { 'data': 'isInvoiceUpdated', 'name': 'isInvoiceUpdated', 'label': 'Invoice Updated', 'type':'readonly' },
                         { 'data': 'invoiceSentDate', 'name': 'invoiceSentDate', 'label': 'Invoice Sent Date', 'type':'datetime', 'dateFormat': 'yy-mm-dd',
@@ -14,10 +14,14 @@ from loutilities.tables import DbCrudApiRolePermissions, get_request_data
 from loutilities.timeu import asctime
 
 # homegrown
-from ...dbmodel import db, Event, State, FeeBasedOn, Contract, ContractType, TemplateType
+from ...dbmodel import db, Event, State, DocUpload
 from ...dbmodel import STATE_COMMITTED, STATE_CONTRACT_SENT
 from .common import CLIENT_EMAIL_SEPARATOR
 from ...contractmanager import ContractManager
+from ...contractblocks import contract_block
+from ...utils import event_docfields, event_docfilename, feeError
+from ...driveupload import latest_upload, upload_status
+from ...dbmodel import UPLOAD_DONE, UPLOAD_FAILED
 
 dt = asctime('%Y-%m-%d')
 
@@ -104,102 +108,29 @@ class EventsContract(DbCrudApiRolePermissions):
                         raise parameterError('missing fields')
 
 
-                # calculate service fees
-                servicefees = []
-
-                feetotal = 0
-                for service in eventdb.services:
-                    servicefee = { 'service' : service.serviceLong }
-                    # fixed fee
-                    if service.feeType.feeType =='fixed':
-                        thisfee = service.fee
-                        servicefee.update( {'fee':thisfee, 'qty': '', 'unitfee': 'fixed' } ) 
-                        servicefees.append( servicefee )
-
-                    # fee is based on another field
-                    elif service.feeType.feeType =='basedOnField':
-                        field = service.basedOnField
-                        # not clear why this needs to be converted to int, but otherwise see unicode value
-                        # if can't be converted, then invalid format
-                        try:
-                            fieldval = int(getattr(eventdb, field))
-                        except (TypeError, ValueError) as e:
-                            fieldval = None
-
-                        # field not set, then set self._fielderrors appropriately
-                        if not fieldval:
-                            formfield = self.dbmapping[field]   # hopefully not a function
-                            self._fielderrors = [{ 'name' : formfield, 'status' : 'needed to calculate fee' }]
-                            raise parameterError('cannot calculate fee if {} not set'.format(field))
-
-                        feebasedons = FeeBasedOn.query.filter_by(serviceId=service.id).order_by(FeeBasedOn.fieldValue).all()
-                        foundfee = False
-                        for feebasedon in feebasedons:
-                            lastfieldval = feebasedon.fieldValue
-                            if debug: current_app.logger.debug('fieldval={} feebasedon.fieldValue={}'.format(fieldval, feebasedon.fieldValue))
-                            if debug: current_app.logger.debug('type(fieldval)={} type(feebasedon.fieldValue)={}'.format(type(fieldval), type(feebasedon.fieldValue)))
-                            if fieldval <= feebasedon.fieldValue:
-                                thisfee = feebasedon.fee
-                                servicefee.update( {'fee':thisfee, 'qty':fieldval, 'unitfee': 'fixed' } ) 
-                                servicefees.append( servicefee )
-                                foundfee = True
-                                break
-
-                        # if fee not found, then set fielderrors appropriately
-                        if not foundfee:
-                            formfield = self.dbmapping[field]   # hopefully not a function
-                            self._fielderrors = [{ 'name' : formfield, 'status' : 'cannot calculate fee if this is greater than {}'.format(lastfieldval) }]
-                            raise parameterError('cannot calculate fee if {} greater than {}'.format(field, lastfieldval))
-                            
-                    # not sure how we could get here, but best to be defensive
-                    else:
-                        raise parameterError('unknown feeType: {}'.format(service.feeType.feeType))
-
-                    # accumulate total fee
-                    feetotal += thisfee
-
-                # need to calculate addons in addition to services (note automatically sorted by priority)
-                for addon in eventdb.addOns:
-                    servicefee = {'service': addon.longDescr}
-                    if not addon.is_upricing:
-                        thisfee = addon.fee
-                        servicefee.update({'fee': thisfee, 'qty': '', 'unitfee': 'fixed'})
-                    else:
-                        qty = getattr(eventdb, addon.up_basedon) - addon.up_subfixed
-                        if qty < 0:
-                            qty = 0
-                        thisfee = addon.fee * qty
-                        servicefee.update({'fee': thisfee, 'qty':qty, 'unitfee': f'${addon.fee}'})
-                    servicefees.append(servicefee)
-
-                    # accumulate total fee
-                    feetotal += thisfee
+                # calculate service fees, fields for contract / invoice
+                try:
+                    addlfields = event_docfields(eventdb, is_quote)
+                except feeError as e:
+                    formfield = self.dbmapping[e.field]   # hopefully not a function
+                    self._fielderrors = [{ 'name' : formfield, 'status' : e.status }]
+                    raise parameterError(str(e))
 
                 # generate contract / invoice
+                # upload to google drive is queued, and sets the document id when done
                 if debug: current_app.logger.debug('editor_method_posthook(): (before create()) eventdb.__dict__={}'.format(eventdb.__dict__))
-                docid = cm.create('{}-{}-{}.docx'.format(eventdb.client.client, eventdb.race.race, eventdb.date), eventdb, 
-                                    addlfields={'servicenames': [s.service for s in eventdb.services],
-                                                'addons'      : [a.shortDescr for a in eventdb.addOns],
-                                                'doctype'     : doctype,
-                                                'is_quote'    : is_quote,
-                                                'servicefees' : servicefees,
-                                                'event'       : eventdb.race.race,
-                                                'totalfees'   : { 'service' : 'TOTAL', 'fee' : feetotal },
-                                                },
-                                    is_quote=is_quote)
-                
-                # update database to show contract sent
-                if is_quote:
-                    eventdb.contractDocId = docid
-                else:
-                    eventdb.invoiceDocId = docid
+                docfield = 'contractDocId' if is_quote else 'invoiceDocId'
+                jobid = cm.create(event_docfilename(eventdb), eventdb, addlfields=addlfields, is_quote=is_quote, 
+                                  uploadfor=(eventdb, docfield))
                 
                 # find index with correct id and show database updates
+                # the document isn't available until it's uploaded, so show the upload rather than the old document
                 for resprow in self._responsedata:
                     if resprow['rowid'] == thisid: 
                         resprow['state'] = { key:val for (key,val) in list(eventdb.state.__dict__.items()) if key[0] != '_' }
                         resprow['contractSentDate'] = eventdb.contractSentDate
-                        resprow['contractDocId'] = eventdb.contractDocId
+                        resprow[docfield] = None
+                        resprow['contractUpload' if is_quote else 'invoiceUpload'] = upload_status(db.session.get(DocUpload, jobid))
 
         elif 'addlaction' in form and form['addlaction'] in ['sendcontract', 'resendcontract', 'initiateinvoice']:
              
@@ -207,6 +138,13 @@ class EventsContract(DbCrudApiRolePermissions):
             for thisid in data:
                 eventdb = Event.query.filter_by(id=thisid).one()
 
+                # document must have been uploaded to google drive
+                upload = latest_upload(eventdb, 'invoiceDocId' if form['addlaction'] == 'initiateinvoice' else 'contractDocId')
+                if upload and upload.status == UPLOAD_FAILED:
+                    raise parameterError(f'document upload failed, please create document again: {upload.lasterror}')
+                if upload and upload.status != UPLOAD_DONE:
+                    raise parameterError('document is still being uploaded, please try again in a few moments')
+
                 if form['addlaction'] == 'sendcontract':
                     eventdb.state = State.query.filter_by(state=STATE_CONTRACT_SENT).one()
                     eventdb.contractSentDate = dt.dt2asc( date.today() )
@@ -224,13 +162,7 @@ class EventsContract(DbCrudApiRolePermissions):
                 # email sent depends on current state as this flows from 'sendcontract' and 'resendcontract'
                 if eventdb.state.state == STATE_COMMITTED:
                     # prepare agreement accepted or invoice email 
-                    templatestr = (db.session.query(Contract)
-                                   .filter(Contract.contractTypeId==ContractType.id)
-                                   .filter(ContractType.contractType=='race services')
-                                   .filter(Contract.templateTypeId==TemplateType.id)
-                                   .filter(TemplateType.templateType==templatetype)
-                                   .one()
-                                  ).block
+                    templatestr = contract_block('race services', templatetype)
                     template = Template( templatestr )
                     if is_quote:
                         subject = f'{annotation}ACCEPTED - FSRC Race Services {doctype}: {eventdb.race.race} - {eventdb.date}'
@@ -239,13 +171,7 @@ class EventsContract(DbCrudApiRolePermissions):
 
                 elif eventdb.state.state == STATE_CONTRACT_SENT:
                     # send contract mail to client
-                    templatestr = (db.session.query(Contract)
-                               .filter(Contract.contractTypeId==ContractType.id)
-                               .filter(ContractType.contractType=='race services')
-                               .filter(Contract.templateTypeId==TemplateType.id)
-                               .filter(TemplateType.templateType=='contract email')
-                               .one()
-                              ).block
+                    templatestr = contract_block('race services', 'contract email')
                     template = Template( templatestr )
                     subject = f'{annotation}FSRC Race Services {doctype}: {eventdb.race.race} - {eventdb.date}'
 
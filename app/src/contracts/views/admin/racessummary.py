@@ -3,19 +3,31 @@ racessummary - summary views for races
 ====================================================
 '''
 # standard
+from json import dumps
+from time import time
+from datetime import datetime, timezone
 
 # pypi
-from flask import current_app, request
+from flask import current_app, request, stream_with_context, jsonify
+from flask.views import MethodView
 from flask_security import auth_required
+from flask_security.decorators import roles_accepted
+from loutilities.flask_helpers.blueprints import add_url_rules
 from loutilities.timeu import asctime
 from loutilities.tables import CrudApi
-from dominate.tags import div, h2
+from dominate.tags import div, h2, p
 from loutilities.filters import filtercontainerdiv, filterdiv, yadcfoption
 
 # homegrown
 from . import bp
+from .common import ConditionalGetMixin
 from ...dbmodel import db, SponsorRace, SponsorRaceRegCache
-from ...caching import update_raceregcache
+from ...caching import refresh_raceregcache_background, raceregcache_refreshing, race_regcounts
+from ...caching import raceregcache_version
+from ...caching import RACEREGCACHE_MAXAGE
+from ...snapshot import fresh_regsnapshot, event_racedates
+from ...regcurves import race_registration_curves
+from ...helpers import make_runsignup_client
 from ...version import __docversion__
 
 adminguide = f'https://contractility.readthedocs.io/en/{__docversion__}/contract-admin-sponsor-guide.html'
@@ -28,7 +40,7 @@ getdate = lambda d: ymd.dt2asc(mdy.asc2dt(d.split(' ')[0]))
 debug = False
 class parameterError(Exception): pass
 
-class RaceRegistrationsApi(CrudApi):
+class RaceRegistrationsApi(ConditionalGetMixin, CrudApi):
 
     from flask_security import current_user
     decorators = [auth_required()]
@@ -87,6 +99,30 @@ class RaceRegistrationsApi(CrudApi):
     
         return allowed
 
+    def refreshcache(self, race):
+        """start background refresh of race's registration cache if it's stale"""
+        # normally cache is used, but if url arg resetcache is present, the cache will be reset
+        onlyrecentevents = True
+        maxage = current_app.config.get('RACEREGCACHE_MAXAGE', RACEREGCACHE_MAXAGE)
+        resetcache = request.args.get('resetcache', None)
+        if resetcache:
+            onlyrecentevents = False
+            maxage = 0
+        refresh_raceregcache_background(race.couponproviderid, onlyrecentevents=onlyrecentevents, maxage=maxage)
+
+    def versiontoken(self):
+        race = SponsorRace.query.filter_by(id=request.args.get('race', None), display=True).one_or_none()
+        if not race or request.args.get('resetcache', None):
+            return None
+        
+        # a revalidating client may be answered 304 without open(), so start the refresh here. The response
+        # changes when the cache is updated, or a refresh starts or finishes
+        self.refreshcache(race)
+        version, lastupdatets = raceregcache_version(race)
+        refreshing = raceregcache_refreshing(race.couponproviderid)
+        lastmodified = datetime.fromtimestamp(lastupdatets, timezone.utc) if lastupdatets else None
+        return f'{race.id}:{version}:{refreshing}', lastmodified
+
     def open(self):
         race_id = request.args.get('race', None)
         race = SponsorRace.query.filter_by(id=race_id, display=True).one_or_none()
@@ -101,19 +137,12 @@ class RaceRegistrationsApi(CrudApi):
             thisrace = race.race
             racedata[thisrace] = {}
 
-        # normally cache is used, but if url arg resetcache is present, the cache will be reset
-        onlyrecentevents = True
-        resetcache = request.args.get('resetcache', None)
-        if resetcache:
-            onlyrecentevents = False
-        
-        try:
-            events = update_raceregcache(race.couponproviderid, onlyrecentevents=onlyrecentevents)
-            db.session.commit()
-        except:
-            db.session.rollback()
-            raise
+        # cache is refreshed in the background, and the page is rendered from what's already cached
+        self.refreshcache(race)
+        with make_runsignup_client() as rsu:
+            events = rsu.getraceevents(race.couponproviderid)
 
+        eventdates = {}
         for event in events:
             # race date is date of event start, unless end time is specified
             racedate = getdate(event['start_time'])
@@ -126,18 +155,24 @@ class RaceRegistrationsApi(CrudApi):
                 racedata[thisrace][thisevent]['dates'][racedate] = {'regcounts': {}}
                 if event['registration_opens']:
                     racedata[thisrace][thisevent]['dates'][racedate]['regopendate'] = getdate(event['registration_opens'])
+            eventdates[event['event_id']] = racedata[thisrace][thisevent]['dates'][racedate]
 
-            participants = SponsorRaceRegCache.query.filter_by(event_id=event['event_id'], is_active=True).all()
-
-            for participant in participants:
-                regdate = ymd.dt2asc(participant.registration_date)
-                if regdate not in racedata[thisrace][thisevent]['dates'][racedate]['regcounts']:
-                    racedata[thisrace][thisevent]['dates'][racedate]['regcounts'][regdate] = 0
-                racedata[thisrace][thisevent]['dates'][racedate]['regcounts'][regdate] += 1
+        # registration counts for all the events are maintained in the daily counts table as the cache is updated,
+        # or can come from a recent snapshot of the cache, see REGCACHE_SNAPSHOT_MAXAGE
+        snapshot = fresh_regsnapshot(race.id)
+        if snapshot:
+            regcounts = snapshot.regcounts(list(eventdates))
+        else:
+            regcounts = race_regcounts(race.id, list(eventdates))
+        for event_id, regdate, count in regcounts:
+            regcounts = eventdates[event_id]['regcounts']
+            regcounts[regdate] = regcounts.get(regdate, 0) + count
 
-        # build response
-        self.response = []
+        # rows are produced as they're requested
+        self.rows = self._regrows(racedata)
 
+    def _regrows(self, racedata):
+        """generate table rows from racedata"""
         for thisrace in racedata:
             for thisevent in racedata[thisrace]:
                 for racedate in racedata[thisrace][thisevent]['dates']:
@@ -152,29 +187,81 @@ class RaceRegistrationsApi(CrudApi):
                         regopendate = min(regdates)
                     for regdate in racedata[thisrace][thisevent]['dates'][racedate]['regcounts']:
                         count = racedata[thisrace][thisevent]['dates'][racedate]['regcounts'][regdate]
-                        self.response.append(
-                            {'race': thisrace,
-                                'event': thisevent,
-                                'regopen_date': regopendate,
-                                'registration_date': regdate,
-                                'race_date': racedate,
-                                'count': count,
-                                }
-                        )
+                        yield {'race': thisrace,
+                               'event': thisevent,
+                               'regopen_date': regopendate,
+                               'registration_date': regdate,
+                               'race_date': racedate,
+                               'count': count,
+                               }
 
     def nexttablerow(self):
-        if len(self.response) > 0:
-            return self.response.pop(0)
-        else:
-            raise StopIteration
+        # raises StopIteration when rows are exhausted
+        return next(self.rows)
 
     def close(self):
         pass
 
+    def _retrieverows(self):
+        """stream rows to client as a JSON list while they're produced, rather than collecting them first"""
+        try:
+            redirect = self.init()
+            if redirect:
+                return redirect
+            
+            # verify user can read the data, otherwise abort
+            if not self.permission():
+                self.rollback()
+                self.abort()
+            
+            self.beforequery()
+            self.open()
+
+            # open() may have produced the whole response, e.g., serverside tables, as in CrudApi._retrieverows()
+            if hasattr(self, 'output_result'):
+                self.close()
+                self.output_result.update(self.responsekeys)
+                return jsonify(self.output_result)
+        
+        except:
+            # roll back database updates and close transaction
+            self.rollback()
+            raise
+        
+        def generate():
+            # the response has started by the time rows are produced, so errors can only end the stream
+            try:
+                yield '['
+                separator = ''
+                try:
+                    while True:
+                        yield separator + dumps(self.nexttablerow())
+                        separator = ','
+                except StopIteration:
+                    pass
+                self.close()
+                yield ']'
+            except:
+                self.rollback()
+                raise
+        
+        return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
 ##########################################################################################
 # raceregistrations endpoint
 ###########################################################################################
 
+def regcache_status(race):
+    """return text describing freshness of race's registration cache"""
+    if race.cacheupdatets:
+        minutes = int(time() - race.cacheupdatets) // 60
+        status = f'last updated {minutes} minute{"" if minutes == 1 else "s"} ago'
+    else:
+        status = 'not yet cached'
+    if raceregcache_refreshing(race.couponproviderid):
+        status = f'refreshing, {status}'
+    return status
+
 ## yadcf external filters
 def raceregistrations_pretablehtml():
     race_id = request.args.get('race')
@@ -182,6 +269,7 @@ def raceregistrations_pretablehtml():
     pretablehtml = div()
     with pretablehtml:
         h2(race.race)
+        p(regcache_status(race), _class='regcache-status')
         raceregistrations_filters = filtercontainerdiv()
         with raceregistrations_filters:
             filterdiv('external-filter-events', 'Events')
@@ -268,4 +356,54 @@ raceregistrations_view = RaceRegistrationsApi(
                     pretablehtml = raceregistrations_pretablehtml,
                     yadcfoptions = raceregistrations_yadcf_options,
                     )
-raceregistrations_view.register()
\ No newline at end of file
+raceregistrations_view.register()
+
+##########################################################################################
+# raceregistrationcurves endpoint
+###########################################################################################
+
+class RaceRegistrationCurvesApi(MethodView):
+    '''
+    cumulative registrations by days before race for the race's years, computed on the server. The Race 
+    Registrations chart still computes its curves in the browser from the table rows
+
+    url args race (SponsorRace.id), optional numyears, optional events (comma separated event ids)
+    '''
+    url_rules = {
+                'raceregistrationcurves': ['/raceregistrations/curves', ('GET',)],
+                }
+    decorators = [roles_accepted('super-admin', 'sponsor-admin')]
+
+    def get(self):
+        race = SponsorRace.query.filter_by(id=request.args.get('race', None), display=True).one_or_none()
+        if not race or race.couponprovider != 'RunSignUp' or not race.couponproviderid:
+            return jsonify(error='invalid race'), 400
+        numyears = request.args.get('numyears', None, type=int)
+        if numyears == -1:
+            numyears = None
+        events = request.args.get('events', None)
+        event_ids = None
+        if events:
+            try:
+                event_ids = [int(e) for e in events.split(',')]
+            except ValueError:
+                return jsonify(error='invalid events'), 400
+
+        with make_runsignup_client() as rsu:
+            racedates = event_racedates(rsu.getraceevents(race.couponproviderid))
+        # if none of the requested events are the race's, there are no registrations rather than all of them
+        if event_ids is not None:
+            event_ids = [e for e in event_ids if e in racedates]
+        curves = race_registration_curves(race, racedates, event_ids=event_ids, numyears=numyears)
+
+        # nan isn't valid json
+        pace = curves['pace']
+        return jsonify(
+            years = curves['years'],
+            daysbefore = curves['daysbefore'].tolist(),
+            cumulative = curves['cumulative'].astype(int).tolist(),
+            pace = [None if p != p else round(p, 3) for p in pace.tolist()] if pace is not None else None,
+            currentpace = curves['currentpace'],
+        )
+
+add_url_rules(bp, RaceRegistrationCurvesApi)
@@ -14,13 +14,15 @@ from jinja2 import Template
 # homegrown
 from contracts.dbmodel import db, State, Sponsor, SponsorRaceDate, SponsorBenefit, SponsorLevel
 from contracts.dbmodel import SponsorRaceVbl
-from contracts.dbmodel import Contract, ContractType, TemplateType
 from contracts.dbmodel import STATE_COMMITTED, SPONSORRACE_CC_SEPARATOR
 from .common import CLIENT_EMAIL_SEPARATOR
 from ...trends import check_sponsorship_conflicts, render_sponsorship_conflicts
 from contracts.contractmanager import ContractManager
+from contracts.contractblocks import contract_block
 from loutilities.flask_helpers.mailer import sendmail
 from contracts.helpers import make_runsignup_client
+from contracts.runsignup import couponspec
+from contracts.caching import sync_racecoupons
 from contracts.trends import calculateTrend
 
 from loutilities.tables import DbCrudApiRolePermissions, get_request_data
@@ -164,22 +166,13 @@ class SponsorContract(DbCrudApiRolePermissions):
                         expiration = racedate.racedate
                         numregistrations = thissponsorship.level.couponcount
                         clientname = thissponsorship.client.client
-                        raceid = thissponsorship.race.couponproviderid
                         couponcode = thissponsorship.couponcode
                         start = thissponsorship.dateagreed
                         if thissponsorship.race.couponprovider.lower() == 'runsignup':
                             with make_runsignup_client(debug=debug) as rsu:
-                                coupons = rsu.getcoupons(raceid, couponcode)
-                                # rsu search includes any coupons with the couponcode with the coupon string, so we need to filter
-                                coupons = [c for c in coupons if c['coupon_code']==couponcode]
-                                if coupons:
-                                    coupon = coupons[-1]     # should be only one entry, but last is the current one (?)
-                                    coupon_id = coupon['coupon_id']
-                                    # override start with the date portion of start_date
-                                    start = coupon['start_date'].split(' ')[0]
-                                else:
-                                    coupon_id = None
-                                rsu.setcoupon(raceid, couponcode, start, expiration, numregistrations, clientname, coupon_id=coupon_id)
+                                # existing coupon keeps its start date, and is only sent if changed
+                                sync_racecoupons(rsu, thissponsorship.race, 
+                                                 [couponspec(couponcode, start, expiration, numregistrations, clientname)])
 
                 # if we are just resending current version of the contract
                 else:
@@ -187,13 +180,7 @@ class SponsorContract(DbCrudApiRolePermissions):
 
 
                 # prepare agreement email (new contract or resending)
-                templatestr = (db.session.query(Contract)
-                               .filter(Contract.contractTypeId==ContractType.id)
-                               .filter(ContractType.contractType=='race sponsorship')
-                               .filter(Contract.templateTypeId==TemplateType.id)
-                               .filter(TemplateType.templateType=='sponsor email')
-                               .one()
-                              ).block
+                templatestr = contract_block('race sponsorship', 'sponsor email')
                 template = Template( templatestr )
                 subject = '{} Sponsorship Agreement for {}'.format(thissponsorship.race.race, thissponsorship.client.client)
 
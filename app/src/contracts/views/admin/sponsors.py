@@ -33,7 +33,7 @@ from . import bp
 from ...dbmodel import db, Sponsor, SponsorRace, SponsorLevel, SponsorBenefit, SponsorTag
 from ...dbmodel import SponsorQueryLog, SponsorRaceDate, SponsorRaceVbl
 from ...dbmodel import Client, State
-from .common import client
+from .common import client, ConditionalGetMixin, tablestoken
 from .sponsorcontract import SponsorContract
 from ...trends import check_sponsorship_conflicts, render_sponsorship_conflicts
 from ...version import __docversion__
@@ -567,7 +567,7 @@ sponsorsummary_yadcf_options = [
           },
     ]
 
-class SponsorSummary(DbCrudApiRolePermissions):
+class SponsorSummary(ConditionalGetMixin, DbCrudApiRolePermissions):
     def __init__(self, **kwargs):
         args = dict(
                     app = bp,   # use blueprint instead of app
@@ -645,6 +645,10 @@ class SponsorSummary(DbCrudApiRolePermissions):
         # this initialization needs to be done before checking any self.xxx attributes
         super().__init__(**args)
 
+    def versiontoken(self):
+        # summary shows sponsorships and the names of their related rows
+        return tablestoken(Sponsor, SponsorRace, Client, SponsorLevel, State), None
+
     def open(self):
         super().open()
 
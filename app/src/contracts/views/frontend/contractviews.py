@@ -26,7 +26,8 @@ from jinja2 import Template
 
 # home grown
 from . import bp
-from contracts.dbmodel import db, Event, State, Contract, ContractType, TemplateType
+from contracts.dbmodel import db, Event, State
+from contracts.contractblocks import contract_block
 from contracts.dbmodel import STATE_COMMITTED
 from contracts.views.admin.common import CLIENT_EMAIL_SEPARATOR
 from loutilities.flask_helpers.mailer import sendmail
@@ -53,13 +54,7 @@ class AcceptAgreement(MethodView):
         # Could not find docid in the database, so url used was obsolete
         # Tell user to request new email containing URL from contact
         except NoResultFound:
-            templatestr = (db.session.query(Contract)
-                           .filter(Contract.contractTypeId==ContractType.id)
-                           .filter(ContractType.contractType=='race services')
-                           .filter(Contract.templateTypeId==TemplateType.id)
-                           .filter(TemplateType.templateType=='accept agreement error view')
-                           .one()
-                          ).block
+            templatestr = contract_block('race services', 'accept agreement error view')
             context = {
                        'pagename'          : 'contract not found',
                        'contracts_contact' : current_app.config['CONTRACTS_CONTACT'],
@@ -68,13 +63,7 @@ class AcceptAgreement(MethodView):
 
 
         # give user form to accept contract
-        templatestr = (db.session.query(Contract)
-                       .filter(Contract.contractTypeId==ContractType.id)
-                       .filter(ContractType.contractType=='race services')
-                       .filter(Contract.templateTypeId==TemplateType.id)
-                       .filter(TemplateType.templateType=='accept agreement view')
-                       .one()
-                      ).block
+        templatestr = contract_block('race services', 'accept agreement view')
 
         if debug: current_app.logger.debug('AcceptAgreement.get(): thisevent.__dict__={}'.format(thisevent.__dict__))
         thisevent.contracts_contact = current_app.config['CONTRACTS_CONTACT']
@@ -124,13 +113,7 @@ class AcceptAgreement(MethodView):
         db.session.commit()
 
         # prepare agreement accepted email and view
-        templatestr = (db.session.query(Contract)
-                       .filter(Contract.contractTypeId==ContractType.id)
-                       .filter(ContractType.contractType=='race services')
-                       .filter(Contract.templateTypeId==TemplateType.id)
-                       .filter(TemplateType.templateType=='agreement accepted view')
-                       .one()
-                      ).block
+        templatestr = contract_block('race services', 'agreement accepted view')
 
         # add needed fields
         mergefields['servicenames'] = [s.service for s in thisevent.services] 
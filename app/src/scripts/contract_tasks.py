@@ -5,20 +5,22 @@ contract_tasks - background tasks needed for contract event management
 '''
 # standard
 from copy import deepcopy
+from time import perf_counter
 from datetime import date, timedelta
 from urllib.parse import quote_plus
 from re import match
+from os.path import getsize
 
 # pypi
 from flask import current_app
 from flask.cli import with_appcontext
 from jinja2 import Template
-from click import argument, group
+from click import argument, group, option, Choice
 
 # homegrown
 from contracts import create_app
-from contracts.dbmodel import db, Event, Contract, ContractType, TemplateType, Tag, State
-from contracts.dbmodel import Sponsor, SponsorRaceDate
+from contracts.dbmodel import db, Event, Tag, State
+from contracts.dbmodel import Sponsor, SponsorRace, SponsorRaceDate
 from contracts.dbmodel import TAG_PRERACEMAILSENT, TAG_PRERACEMAILINHIBITED
 from contracts.dbmodel import TAG_BIBCOUNTMAILSENT, TAG_BIBCOUNTMAILINHIBITED
 from contracts.dbmodel import TAG_POSTRACEMAILSENT, TAG_POSTRACEMAILINHIBITED
@@ -27,9 +29,19 @@ from contracts.dbmodel import TAG_LEADEMAILSENT
 from contracts.dbmodel import TAG_PRERACERENEWEDREMINDEREMAILSENT, TAG_PRERACERENEWEDCANCELED
 from contracts.dbmodel import TAG_CONTRACTSENTREMINDERINHIBITED
 from contracts.dbmodel import STATE_COMMITTED, STATE_RENEWED_PENDING, STATE_CANCELED, STATE_CONTRACT_SENT
+from contracts.dbmodel import STATE_TENTATIVE
 from contracts.views.admin.common import CLIENT_EMAIL_SEPARATOR
 from loutilities.flask_helpers.mailer import sendmail
 from contracts.utils import renew_event, renew_sponsorship
+from contracts.caching import refresh_raceregcaches, rebuild_regcounts, sync_racecoupons, reconcile_couponindex
+from contracts.caching import eventsync_report
+from contracts.snapshot import event_racedates, write_regsnapshot, snapshot_paths
+from contracts.helpers import make_runsignup_client, rsucache, rsuscheduler
+from contracts.runsignup import couponspec
+from contracts.contractblocks import contract_block
+from contracts.docgen import generate_docs, DOCGEN_WORKERS, DOCGEN_UPLOADERS
+from contracts.driveupload import process_uploads, retry_failed_uploads
+from contracts.dbmodel import DocUpload, UPLOAD_DONE
 from loutilities.timeu import asctime
 
 from scripts import catch_errors, ParameterError
@@ -93,13 +105,7 @@ def preraceemail(startdate, enddate):
         if len(event.services) == 1 and event.services[0].service == 'premiumpromotion': continue
 
         # send pre-race mail to client
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='pre-race email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'pre-race email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -179,13 +185,7 @@ def chipcountemail(startdate, enddate):
         if 'chiptiming' not in [e.service for e in event.services]: continue
 
         # send bib count mail to client
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='bib count email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'bib count email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -265,13 +265,7 @@ def leademail(startdate, enddate):
         if len(event.services) == 1 and event.services[0].service == 'premiumpromotion': continue
 
         # send pre-race mail to client
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='lead email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'lead email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -351,13 +345,7 @@ def postraceprocessing(startdate, enddate):
         if len(event.services) == 1 and event.services[0].service == 'premiumpromotion': continue
 
         # get post-race mail template
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='post-race email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'post-race email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -450,13 +438,7 @@ def preraceprempromoemail(startdate, enddate):
         if len(event.services) > 1 or 'premiumpromotion' not in [s.service for s in event.services]: continue
 
         # get post-race mail template
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='prempromo email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'prempromo email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -538,13 +520,7 @@ def latereminderemail(startdate, enddate):
         if len(event.services) == 1 and 'premiumpromotion' in [s.service for s in event.services]: continue
 
         # get late renewed reminder email template
-        templatestr = (db.session.query(Contract)
-                       .filter(Contract.contractTypeId == ContractType.id)
-                       .filter(ContractType.contractType == 'race services')
-                       .filter(Contract.templateTypeId == TemplateType.id)
-                       .filter(TemplateType.templateType == 'late renewed reminder email')
-                       .one()
-                       ).block
+        templatestr = contract_block('race services', 'late renewed reminder email')
         template = Template(templatestr)
 
         # bring in needed relations
@@ -626,13 +602,7 @@ def cancellaterace(startdate, enddate):
         event.state = State.query.filter_by(state=STATE_CANCELED).one()
 
         # get canceled email template
-        templatestr = (db.session.query(Contract)
-                       .filter(Contract.contractTypeId == ContractType.id)
-                       .filter(ContractType.contractType == 'race services')
-                       .filter(Contract.templateTypeId == TemplateType.id)
-                       .filter(TemplateType.templateType == 'canceled email')
-                       .one()
-                       ).block
+        templatestr = contract_block('race services', 'canceled email')
         template = Template(templatestr)
 
         # bring in needed relations
@@ -687,13 +657,7 @@ def contractsentreminder():
             if days_since_reminder < interval:
                 continue
 
-        templatestr = (db.session.query(Contract)
-                       .filter(Contract.contractTypeId == ContractType.id)
-                       .filter(ContractType.contractType == 'race services')
-                       .filter(Contract.templateTypeId == TemplateType.id)
-                       .filter(TemplateType.templateType == 'contract sent reminder email')
-                       .one()
-                       ).block
+        templatestr = contract_block('race services', 'contract sent reminder email')
         template = Template(templatestr)
 
         garbage = event.client
@@ -767,6 +731,191 @@ def renewsponsorship(startdate, enddate):
         db.session.commit()
 
 
+@contract.command()
+@argument('raceyear', type=int)
+@with_appcontext
+@catch_errors
+def synccoupons(raceyear):
+    '''Add or update RunSignUp coupons for all committed sponsorships in raceyear which have a coupon code'''
+    sponsorships = (Sponsor.query
+                    .filter_by(raceyear=raceyear)
+                    .join(Sponsor.state).filter(State.state == STATE_COMMITTED)
+                    .filter(Sponsor.couponcode != None)
+                    .filter(Sponsor.couponcode != '')
+                    .all())
+
+    # coupons for each race are sent together
+    racecoupons = {}
+    for sponsorship in sponsorships:
+        race = sponsorship.race
+        if (not race.couponprovider or race.couponprovider.lower() != 'runsignup' or not race.couponproviderid
+                or not sponsorship.level.couponcount or sponsorship.level.couponcount <= 0):
+            continue
+        racedate = SponsorRaceDate.query.filter_by(race_id=race.id, raceyear=raceyear).one()
+        coupon = couponspec(sponsorship.couponcode, sponsorship.dateagreed, racedate.racedate,
+                            sponsorship.level.couponcount, sponsorship.client.client)
+        racecoupons.setdefault(race, []).append((sponsorship, coupon))
+
+    with make_runsignup_client() as rsu:
+        for race, theseitems in racecoupons.items():
+            synced, sent = sync_racecoupons(rsu, race, [coupon for sponsorship, coupon in theseitems])
+            print(f'{race.race}: {len(sent)} of {len(theseitems)} coupons sent')
+            for sponsorship, coupon in theseitems:
+                print('    {} {}: coupon_id {}'.format(sponsorship.client.client, sponsorship.couponcode,
+                                                       synced[sponsorship.couponcode]['coupon_id']))
+    db.session.commit()
+
+@contract.command()
+@with_appcontext
+@catch_errors
+def reconcilecoupons():
+    '''Reconcile coupon index with RunSignUp coupons for all displayed RunSignUp sponsor races.'''
+    with make_runsignup_client() as rsu:
+        for race in regcacheraces():
+            result = reconcile_couponindex(rsu, race)
+            print('{}: {total} coupons, {added} added, {changed} changed, {removed} removed'.format(race.race, **result))
+            db.session.commit()
+
+def regcacheraces():
+    '''return displayed RunSignUp sponsor races, which have registration caches'''
+    return (SponsorRace.query
+            .filter_by(display=True, couponprovider='RunSignUp')
+            .filter(SponsorRace.couponproviderid != None)
+            .filter(SponsorRace.couponproviderid != '')
+            .all())
+
+@contract.command()
+@option('--workers', default=4, help='number of events refreshed in parallel')
+@option('--resetcache', is_flag=True, help='refresh all events and participants rather than recent changes')
+@with_appcontext
+@catch_errors
+def refreshregcache(workers, resetcache):
+    '''Refresh registration cache for all displayed RunSignUp sponsor races.'''
+    races = regcacheraces()
+
+    start = perf_counter()
+    raceresults, eventresults = refresh_raceregcaches(races, workers=workers, onlyrecentevents=not resetcache)
+    duration = perf_counter() - start
+
+    for raceresult in raceresults:
+        print('{race}: {numjobs} of {numevents} events refreshed, getraceevents {geteventsduration:.1f}s, '
+              'events {eventsduration:.1f}s, {errors} errors'.format(**raceresult))
+        thisevents = [r for r in eventresults if r['race_id'] == raceresult['race_id']]
+        for eventresult in sorted(thisevents, key=lambda r: r['duration'], reverse=True):
+            if eventresult['error']:
+                print('    {event} {start_time}: ERROR {error} ({duration:.1f}s)'.format(**eventresult))
+            else:
+                print('    {event} {start_time}: {updated} updated, {removed} removed ({duration:.1f}s)'.format(**eventresult))
+    print(f'{len(raceresults)} races, {len(eventresults)} events refreshed in {duration:.1f}s with {workers} workers')
+    if rsucache():
+        print(f'RunSignUp response cache: {rsucache().stats()}')
+    for endpoint, stats in rsuscheduler().stats().items():
+        print('RunSignUp {}: {count} requests, {errors} errors, {retries} retries, '
+              'mean {mean:.2f}s, max {max:.2f}s'.format(endpoint, **stats))
+
+@contract.command()
+@option('--top', default=20, help='number of events to show, 0 for all')
+@with_appcontext
+@catch_errors
+def regcachereport(top):
+    '''Show registration cache sync cost per event, costliest first, for spotting hot events.'''
+    report = eventsync_report([race.id for race in regcacheraces()])
+    for event in report[:top or None]:
+        print('{race} {event} ({event_id}): {numsyncs} syncs, total {totalduration:.1f}s, mean {meanduration:.2f}s, '
+              'last {lastduration:.2f}s'.format(**event), end='')
+        if event['numfailures']:
+            print(f', {event["numfailures"]} consecutive failures, last error: {event["lasterror"]}')
+        else:
+            print(f', last {event["numupdated"]} updated, {event["numremoved"]} removed')
+
+@contract.command()
+@with_appcontext
+@catch_errors
+def regsnapshot():
+    '''Write columnar snapshot of registration cache for all displayed RunSignUp sponsor races.'''
+    with make_runsignup_client() as rsu:
+        for race in regcacheraces():
+            start = perf_counter()
+            racedates = event_racedates(rsu.getraceevents(race.couponproviderid))
+            numrows = write_regsnapshot(race, racedates)
+            snapshotpath, metapath = snapshot_paths(race.id)
+            print(f'{race.race}: {numrows} registrations, {getsize(snapshotpath)} bytes in {perf_counter()-start:.1f}s')
+
+@contract.command()
+@option('--check', is_flag=True, help='only report inconsistent counts, don\'t save the rebuilt counts')
+@with_appcontext
+@catch_errors
+def rebuildregcounts(check):
+    '''Rebuild daily registration counts from registration cache for all displayed RunSignUp sponsor races.'''
+    with make_runsignup_client() as rsu:
+        for race in regcacheraces():
+            events = rsu.getraceevents(race.couponproviderid)
+            inconsistent = rebuild_regcounts(race.id, [e['event_id'] for e in events])
+            print(f'{race.race}: {len(inconsistent)} inconsistent daily counts')
+            for event_id, day, oldcount, newcount in inconsistent:
+                print(f'    event {event_id} {day}: {oldcount} counted, {newcount} in cache')
+    
+    if check:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+@contract.command()
+@option('--type', 'doctype', type=Choice(['contract', 'invoice']), default='invoice', 
+        help='contracts are generated for tentative events, invoices for committed events')
+@option('--start', required=True, help='first event date yyyy-mm-dd')
+@option('--end', required=True, help='last event date yyyy-mm-dd')
+@option('--workers', default=DOCGEN_WORKERS, help='number of documents rendered in parallel processes, 0 to render in this process')
+@option('--uploaders', default=DOCGEN_UPLOADERS, help='number of documents uploaded to google drive in parallel')
+@with_appcontext
+@catch_errors
+def generatedocs(doctype, start, end, workers, uploaders):
+    '''Generate race services contracts or invoices for events between two dates.'''
+    for thisdate in [start, end]:
+        if not match(r'^(19[0-9]{2}|2[0-9]{3})-(0[1-9]|1[012])-([123]0|[012][1-9]|31)$', thisdate):
+            raise ParameterError('start and end must be in yyyy-mm-dd format')
+
+    is_quote = doctype == 'contract'
+    state = STATE_TENTATIVE if is_quote else STATE_COMMITTED
+    events = (Event.query.filter(Event.date.between(start, end))
+              .filter(Event.state_id == State.id).filter(State.state == state)
+              .order_by(Event.date).all())
+    names = {e.id: f'{e.date} {e.race.race}' for e in events}
+
+    wallstart = perf_counter()
+    results = generate_docs([e.id for e in events], is_quote, workers=workers, uploaders=uploaders)
+    db.session.commit()
+    wall = perf_counter() - wallstart
+
+    fmt = lambda t: f'{t:8.2f}' if t is not None else f'{"-":>8}'
+    print(f'{"event":40} {"render":>8} {"upload":>8} {"perm":>8}  document')
+    for result in results:
+        print(f'{names[result["event_id"]][:40]:40} {fmt(result["render"])} {fmt(result["upload"])} '
+              f'{fmt(result["permission"])}  {result["docid"] or "ERROR " + str(result["error"])}')
+    done = [r for r in results if r['docid']]
+    totals = {key: sum(r[key] for r in done) for key in ['render', 'upload', 'permission']}
+    print(f'{len(done)} of {len(results)} {doctype}s generated in {wall:.1f}s with {workers} workers, {uploaders} uploaders; '
+          'total render {render:.1f}s, upload {upload:.1f}s, permission {permission:.1f}s'.format(**totals))
+
+@contract.command()
+@option('--retry', is_flag=True, help='requeue failed uploads before processing')
+@with_appcontext
+@catch_errors
+def uploads(retry):
+    '''Upload queued documents which are due, and show uploads which are not done.'''
+    if retry:
+        print(f'{retry_failed_uploads()} failed uploads requeued')
+        db.session.commit()
+
+    attempted = process_uploads()
+    print(f'{len(attempted)} uploads attempted')
+
+    notdone = DocUpload.query.filter(DocUpload.status != UPLOAD_DONE).order_by(DocUpload.id).all()
+    for job in notdone:
+        print(f'{job.id:6} {job.status:10} {job.attempts:3}  {job.target} {job.target_id} {job.docfield}  '
+              f'{job.drivename}  {job.lasterror or ""}')
+
+
 #######################################################################
 ### the following commands are designed for initial deployment
 #######################################################################
@@ -862,13 +1011,7 @@ def xsendrenewemails(startdate, enddate):
         if len(event.services) == 1 and event.services[0].service == 'premiumpromotion': continue
 
         # get post-race mail template
-        templatestr = (db.session.query(Contract)
-                   .filter(Contract.contractTypeId==ContractType.id)
-                   .filter(ContractType.contractType=='race services')
-                   .filter(Contract.templateTypeId==TemplateType.id)
-                   .filter(TemplateType.templateType=='post-race email')
-                   .one()
-                  ).block
+        templatestr = contract_block('race services', 'post-race email')
         template = Template( templatestr )
 
         # bring in needed relations
@@ -0,0 +1,105 @@
+'''
+bench_regcache - database round trips for registration cache updates
+=========================================================================
+
+compares the original per-participant query loop with the batched upsert used by
+contracts.caching.update_raceregcache, for a cold cache (all inserts) and for a
+resetcache rebuild of a warm cache (all updates)
+
+    python benchmarks/bench_regcache.py [numparticipants]
+'''
+
+# standard
+import sys
+
+# pypi
+from loutilities.timeu import asctime
+from loutilities.transform import Transform
+
+# homegrown
+from common import bareapp, StatementCounter, timer
+from contracts.caching import upsert_regcache, deactivate_regcache, regcache_xform, REGCACHE_BATCHSIZE, ymd
+from contracts.dbmodel import db, SponsorRaceRegCache
+
+EVENT = {'event_id': 11, 'name': '5K'}
+RACE_ID = 1
+
+def participants(num):
+    return [{
+        'registration_id': regid,
+        'registration_date': '01/02/2026 10:00',
+        'last_modified': 1767000000,
+        'user': {'first_name': 'Jo', 'last_name': 'Smith', 'email': f'runner{regid}@example.com',
+                 'gender': 'F', 'dob': '1990-05-04'},
+    } for regid in range(num)]
+
+def legacy_xform():
+    '''the original regcache_xform(), setting model attributes'''
+    rsudt = asctime('%m/%d/%Y %H:%M')
+    return Transform(dict(
+        registration_date   = lambda r: rsudt.asc2dt(r['registration_date']),
+        last_modified_ts    = 'last_modified',
+        first_name          = lambda r: r['user']['first_name'],
+        last_name           = lambda r: r['user']['last_name'],
+        email               = lambda r: r['user']['email'],
+        gender              = lambda r: r['user']['gender'],
+        dob                 = lambda r: ymd.asc2dt(r['user']['dob']) if r['user']['dob'] else None,
+    ), sourceattr=False, targetattr=True)
+
+def legacy_upsert(participants, event, xform):
+    '''the original update_raceregcache loop, one query per participant'''
+    for participant in participants:
+        regid = participant['registration_id']
+        thisparticipant = SponsorRaceRegCache.query.filter_by(registration_id=regid).one_or_none()
+        if not thisparticipant:
+            thisparticipant = SponsorRaceRegCache(registration_id=regid)
+            db.session.add(thisparticipant)
+        xform.transform(participant, thisparticipant)
+        thisparticipant.event_id = event['event_id']
+        thisparticipant.event_name = event['name']
+        thisparticipant.is_active = True
+        # the app's session doesn't autoflush, but flushing here matches what the queries see
+        db.session.flush()
+
+def legacy_deactivate(participants):
+    for participant in participants:
+        thisparticipant = SponsorRaceRegCache.query.filter_by(registration_id=participant['registration_id']).one_or_none()
+        if thisparticipant:
+            thisparticipant.is_active = False
+    db.session.flush()
+
+# bulk path also maintains the daily counts for the race
+def bulk_upsert(participants, event, xform):
+    upsert_regcache(participants, event, xform, RACE_ID)
+
+def bulk_deactivate(participants):
+    deactivate_regcache(participants, RACE_ID)
+
+def run(num):
+    app = bareapp()
+    data = participants(num)
+    removed = [{'registration_id': p['registration_id']} for p in data[:num//10]]
+    per1k = 1000 / num
+
+    print(f'{num} participants, REGCACHE_BATCHSIZE={REGCACHE_BATCHSIZE}; counts are per 1k participants')
+    print(f'{"path":10} {"phase":10} {"statements":>10} {"rows":>8} {"seconds":>8}')
+    for name, upsert, deactivate, makexform in [('legacy', legacy_upsert, legacy_deactivate, legacy_xform),
+                                                ('bulk', bulk_upsert, bulk_deactivate, regcache_xform)]:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            counter = StatementCounter(db.engine)
+            thisxform = makexform()
+            for phase, action in [('cold', lambda: upsert(data, EVENT, thisxform)),
+                                  ('rebuild', lambda: upsert(data, EVENT, thisxform)),
+                                  ('remove', lambda: deactivate(removed))]:
+                counter.reset()
+                times = {}
+                with timer(times, phase):
+                    action()
+                    db.session.commit()
+                print(f'{name:10} {phase:10} {counter.statements*per1k:10.1f} {counter.rows*per1k:8.1f} {times[phase]:8.3f}')
+            db.session.remove()
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
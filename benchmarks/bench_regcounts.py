@@ -0,0 +1,68 @@
+'''
+bench_regcounts - registration counts per event and day for the Race Registrations view
+==========================================================================================
+
+compares the original ORM path, which loads every active SponsorRaceRegCache row per event and
+counts in python, with the GROUP BY query used by contracts.caching.regcache_counts
+
+    python benchmarks/bench_regcounts.py [numparticipants] [numevents]
+'''
+
+# standard
+import sys
+from datetime import datetime, timedelta
+
+# homegrown
+from common import bareapp, StatementCounter, timer
+from contracts.caching import regcache_counts, ymd
+from contracts.dbmodel import db, SponsorRaceRegCache
+
+def populate(num, numevents):
+    '''num registrations spread over numevents events and 120 days, with 5% removed'''
+    start = datetime(2026, 1, 1)
+    db.session.bulk_insert_mappings(SponsorRaceRegCache, [
+        {'registration_id': regid, 'event_id': regid % numevents,
+         'registration_date': start + timedelta(minutes=regid * 120 * 24 * 60 // num),
+         'is_active': regid % 20 != 0}
+        for regid in range(num)])
+    db.session.commit()
+
+def orm_counts(event_ids):
+    '''the original RaceRegistrationsApi.open() loop'''
+    counts = {}
+    for event_id in event_ids:
+        participants = SponsorRaceRegCache.query.filter_by(event_id=event_id, is_active=True).all()
+        for participant in participants:
+            regdate = ymd.dt2asc(participant.registration_date)
+            counts[event_id, regdate] = counts.get((event_id, regdate), 0) + 1
+    return counts
+
+def aggregate_counts(event_ids):
+    return {(event_id, regdate): count for event_id, regdate, count in regcache_counts(event_ids)}
+
+def run(num, numevents):
+    app = bareapp()
+    event_ids = list(range(numevents))
+    with app.app_context():
+        db.create_all()
+        populate(num, numevents)
+        counter = StatementCounter(db.engine)
+
+        print(f'{num} registrations, {numevents} events')
+        print(f'{"path":10} {"statements":>10} {"resultrows":>10} {"seconds":>8}')
+        results = {}
+        for name, counts in [('orm', orm_counts), ('aggregate', aggregate_counts)]:
+            counter.reset()
+            times = {}
+            with timer(times, name):
+                results[name] = counts(event_ids)
+            # expunge loaded instances so each path starts with an empty identity map
+            db.session.expunge_all()
+            print(f'{name:10} {counter.statements:10d} {len(results[name]):10d} {times[name]:8.3f}')
+
+        assert results['orm'] == results['aggregate']
+        db.session.remove()
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4)
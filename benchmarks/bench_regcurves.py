@@ -0,0 +1,73 @@
+'''
+bench_regcurves - cumulative registration curves by days before race, for multi-year comparisons
+====================================================================================================
+
+compares building nested dicts per year per day and accumulating in python, which is what the
+Race Registrations chart does in the browser, with contracts.regcurves.registration_curves
+
+    python benchmarks/bench_regcurves.py [numyears] [registrationsperyear]
+'''
+
+# standard
+import sys
+from datetime import date, timedelta
+from random import Random
+
+# homegrown
+from common import timer
+from contracts.regcurves import registration_curves
+from contracts.snapshot import dayindex
+
+def registrations(numyears, peryear):
+    '''peryear registrations for each of numyears races, over the 300 days before the race'''
+    rand = Random(1)
+    regdates, racedates = [], []
+    for year in range(2026 - numyears + 1, 2027):
+        racedate = date(year, 6, 1)
+        for i in range(peryear):
+            regdates.append(racedate - timedelta(int(rand.triangular(0, 300, 0))))
+            racedates.append(racedate)
+    return regdates, racedates
+
+def dict_curves(regdates, racedates):
+    '''nested dicts per year per day, then accumulated'''
+    years = {}
+    for regdate, racedate in zip(regdates, racedates):
+        before = max((racedate - regdate).days, 0)
+        days = years.setdefault(racedate.year, {})
+        days[before] = days.get(before, 0) + 1
+    maxdays = max(max(days) for days in years.values())
+    curves = {}
+    for year in sorted(years, reverse=True):
+        total = 0
+        curves[year] = []
+        for before in range(maxdays, -1, -1):
+            total += years[year].get(before, 0)
+            curves[year].append(total)
+    return curves
+
+def numpy_curves(regdays, racedays):
+    curves = registration_curves(regdays, racedays)
+    return dict(zip(curves['years'], curves['cumulative'].astype(int).tolist()))
+
+def run(numyears, peryear):
+    regdates, racedates = registrations(numyears, peryear)
+    # day indexes are what snapshots and daily counts provide
+    regdays = [dayindex(d) for d in regdates]
+    racedays = [dayindex(d) for d in racedates]
+
+    print(f'{numyears} years, {peryear} registrations per year')
+    print(f'{"path":10} {"seconds":>8}')
+    times = {}
+    with timer(times, 'dict'):
+        expected = dict_curves(regdates, racedates)
+    with timer(times, 'numpy'):
+        actual = numpy_curves(regdays, racedays)
+    for name in ['dict', 'numpy']:
+        print(f'{name:10} {times[name]:8.3f}')
+
+    assert actual == expected
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 12,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
@@ -0,0 +1,78 @@
+'''
+bench_render - rendering html sponsor agreements
+=====================================================
+
+renders the sponsor agreement blocks from contracts.dbinit_contracts with the original
+recursive_render, which creates an environment and compiles the template for every render and
+always renders the output again, and with contracts.contractmanager.recursive_render. Race 
+variables may hold template text, so agreements are rendered with and without a nested variable
+
+    python benchmarks/bench_render.py [numagreements]
+'''
+
+# standard
+import sys
+
+# pypi
+from flask import current_app
+from jinja2 import Environment
+
+# homegrown
+from common import bareapp, timer
+from contracts.contractmanager import recursive_render, templatekey
+from contracts.dbmodel import db, Contract, TemplateType
+
+class Obj():
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def legacy_render(tpl, values):
+    '''the original recursive_render'''
+    env = Environment(trim_blocks=True, lstrip_blocks=True, loader=current_app.jinja_env.loader)
+    prev = tpl
+    while True:
+        curr = env.from_string(prev).render(**values)
+        if curr != prev:
+            prev = curr
+        else:
+            return curr
+
+def mergefields(i, nested):
+    race = Obj(race='Lighthouse 10K', racedirector='Jo Smith', isRDCertified=i % 2 == 0, raceurl='https://example.com',
+               rdemail='rd@example.com', rdphone='555-1212' if i % 3 else None)
+    values = dict(_raceheader_='<img src="header.png" width=6in>', level=Obj(level='Gold'), _date_='October 18, 2026',
+                  client=Obj(client=f'Sponsor {i}'), amount=500 + i, race=race, _racedate_='June 1, 2027',
+                  _raceloc_='Baker Park', _benefits_=[f'benefit {b}' for b in range(8)],
+                  _racebeneficiary_='the food bank', _rdcertlogo_='rd-cert-logo.png')
+    if nested:
+        values['_racebeneficiary_'] = '{{ race.race }} beneficiary, the food bank'
+    return values
+
+def run(num):
+    app = bareapp()
+    with app.app_context():
+        db.create_all()
+        # dbinit_contracts builds its queries when imported, which needs the app context
+        from contracts.dbinit_contracts import dbinit_contracts
+        dbinit_contracts()
+        db.session.commit()
+        blocks = (Contract.query
+                  .filter(Contract.templateTypeId == TemplateType.id)
+                  .filter(TemplateType.templateType == 'sponsor agreement')
+                  .order_by(Contract.blockPriority).all())
+
+        print(f'{num} agreements, {len(blocks)} blocks each')
+        print(f'{"path":10} {"nested":>6} {"seconds":>8} {"ms/agreement":>13}')
+        for nested in [False, True]:
+            values = [mergefields(i, nested) for i in range(num)]
+            times = {}
+            with timer(times, 'legacy'):
+                legacy = [[legacy_render(b.block, v) for b in blocks] for v in values]
+            with timer(times, 'cached'):
+                cached = [[recursive_render(b.block, v, key=templatekey(b)) for b in blocks] for v in values]
+            assert legacy == cached
+            for path in ['legacy', 'cached']:
+                print(f'{path:10} {str(nested):>6} {times[path]:8.3f} {times[path] * 1000 / num:13.3f}')
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
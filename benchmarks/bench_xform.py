@@ -0,0 +1,85 @@
+'''
+bench_xform - transform of RunSignUp participants to registration cache rows
+=================================================================================
+
+compares the original loutilities Transform mapping, which parses registration_date with strptime
+for every participant, with contracts.caching.regcache_xform
+
+    python benchmarks/bench_xform.py [numparticipants]
+'''
+
+# standard
+import sys
+from random import Random
+
+# pypi
+from loutilities.timeu import asctime
+from loutilities.transform import Transform
+
+# homegrown
+from common import timer
+from contracts.caching import regcache_xform, parse_rsudatetime, ymd
+
+EVENT_ID = 11
+
+def participants(num):
+    '''num participants registering over 120 days, at random minutes'''
+    rand = Random(1)
+    result = []
+    for regid in range(num):
+        day = rand.randrange(120)
+        result.append({
+            'registration_id': regid,
+            'registration_date': f'{1 + day // 30}/{1 + day % 28}/2026 {rand.randrange(24):02d}:{rand.randrange(60):02d}',
+            'last_modified': 1767000000 + regid,
+            'user': {'first_name': 'Jo', 'last_name': 'Smith', 'email': f'runner{regid}@example.com',
+                     'gender': 'F', 'dob': f'{1950 + regid % 60}-05-04'},
+        })
+    return result
+
+def legacy_rows(participants):
+    '''the original regcache_xform(), built for each update, and the rows upsert_regcache made from it'''
+    rsudt = asctime('%m/%d/%Y %H:%M')
+    xform = Transform(dict(
+        registration_date   = lambda r: rsudt.asc2dt(r['registration_date']),
+        last_modified_ts    = 'last_modified',
+        first_name          = lambda r: r['user']['first_name'],
+        last_name           = lambda r: r['user']['last_name'],
+        email               = lambda r: r['user']['email'],
+        gender              = lambda r: r['user']['gender'],
+        dob                 = lambda r: ymd.asc2dt(r['user']['dob']) if r['user']['dob'] else None,
+    ), sourceattr=False, targetattr=False)
+    rows = []
+    for participant in participants:
+        row = {'registration_id': participant['registration_id']}
+        xform.transform(participant, row)
+        row['event_id'] = EVENT_ID
+        row['is_active'] = True
+        rows.append(row)
+    return rows
+
+def fast_rows(participants):
+    xform = regcache_xform()
+    return [xform.rows(participant, EVENT_ID) for participant in participants]
+
+def run(num):
+    data = participants(num)
+    times = {}
+    with timer(times, 'legacy'):
+        legacy = legacy_rows(data)
+    # cold parse cache, then warm as in the next update of the same participants
+    parse_rsudatetime.cache_clear()
+    with timer(times, 'fast cold'):
+        fast = fast_rows(data)
+    with timer(times, 'fast warm'):
+        fast_rows(data)
+
+    assert [r['registration_date'] for r in legacy] == [r['registration_date'] for r, pii in fast]
+
+    print(f'{num} participants')
+    print(f'{"path":10} {"seconds":>8} {"us/participant":>15}')
+    for path in ['legacy', 'fast cold', 'fast warm']:
+        print(f'{path:10} {times[path]:8.3f} {times[path] * 1e6 / num:15.2f}')
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
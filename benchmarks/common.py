@@ -0,0 +1,64 @@
+'''
+common - shared setup for benchmarks
+=========================================================
+
+benchmarks run against a bare Flask app with contracts' db bound to an in-memory sqlite
+database, so they don't need the docker / mysql environment. Run from the repo root, e.g.,
+
+    python benchmarks/bench_regcache.py
+'''
+
+# standard
+import os
+import sys
+from time import perf_counter
+from contextlib import contextmanager
+
+# make contracts importable, and supply the environment contracts reads at import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'src'))
+os.environ.setdefault('APP_NAME', 'contracts')
+os.environ.setdefault('APP_VER', 'latest')
+
+# pypi
+from flask import Flask
+from sqlalchemy import event as sqlevent
+
+# homegrown
+from contracts.dbmodel import db
+
+def bareapp():
+    '''Minimal Flask app with contracts' db bound to in-memory sqlite'''
+    app = Flask('contracts')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite:///:memory:'}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+class StatementCounter():
+    '''
+    count statements sent to the database
+
+    statements counts each execute() or executemany() call, rows counts each parameter set of
+    an executemany(). Some drivers (e.g., pymysql for UPDATE) send each executemany() parameter
+    set as its own round trip, so rows is the worst case round trip count
+    '''
+    def __init__(self, engine):
+        self.statements = 0
+        self.rows = 0
+        sqlevent.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self.rows += len(parameters) if executemany else 1
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+
+@contextmanager
+def timer(results, key):
+    '''save elapsed seconds for the with block in results[key]'''
+    start = perf_counter()
+    yield
+    results[key] = perf_counter() - start
@@ -9,6 +9,8 @@ from flask import Flask
 # APP_NAME is normally supplied by Docker Compose's .env; set it here so the
 # contracts package (which reads it at import time) also works for local/CI pytest runs
 os.environ.setdefault('APP_NAME', 'contracts')
+# likewise APP_VER, read by contracts.version
+os.environ.setdefault('APP_VER', 'latest')
 
 from contracts import create_app
 from contracts.dbmodel import db
@@ -0,0 +1,230 @@
+###########################################################################################
+# test_asyncrunsignup - test contracts.asyncrunsignup, against local aiohttp stub server
+#
+#       Date            Author          Reason
+#       ----            ------          ------
+#       10/18/26        Lou King        Create
+#
+#   Copyright 2026 Lou King.  All rights reserved
+###########################################################################################
+
+# standard
+import asyncio
+from json import loads
+from threading import Thread
+
+# pypi
+import pytest
+import aiohttp
+from aiohttp import web
+
+# homegrown
+from contracts import runsignup
+from contracts.asyncrunsignup import AsyncRunSignUp, SyncRunSignUp
+from contracts.runsignup import RequestScheduler
+from running.runsignup import accessError
+
+
+class AioStubRunSignUp():
+    '''
+    local aiohttp server which serves race, participants, removed-participants and coupons like RunSignUp
+
+    runs on its own event loop in a background thread, records requests and max requests in flight
+    '''
+    def __init__(self, numparticipants, delay=0.02, failures=0, dropposts=False):
+        self.numparticipants = numparticipants
+        self.delay = delay
+        # drop the connection after receiving posts, as if the response was lost
+        self.dropposts = dropposts
+        # first `failures` requests get 503
+        self.failures = failures
+        self.requests = []
+        self.posts = []
+        self.inflight = 0
+        self.maxinflight = 0
+
+        app = web.Application()
+        app.router.add_get('/rest/race/{race_id}', self.race)
+        app.router.add_get('/rest/race/{race_id}/participants', self.participants)
+        app.router.add_get('/rest/race/{race_id}/removed-participants', self.participants)
+        app.router.add_get('/rest/race/{race_id}/coupons', self.coupons)
+        app.router.add_post('/rest/race/{race_id}/coupons', self.setcoupon)
+
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, daemon=True).start()
+        self.runner = web.AppRunner(app)
+        asyncio.run_coroutine_threadsafe(self.runner.setup(), self.loop).result()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        asyncio.run_coroutine_threadsafe(site.start(), self.loop).result()
+        self.url = 'http://127.0.0.1:{}'.format(self.runner.addresses[0][1])
+
+    async def _track(self, request):
+        self.requests.append((request.path, dict(request.query)))
+        self.inflight += 1
+        self.maxinflight = max(self.maxinflight, self.inflight)
+        await asyncio.sleep(self.delay)
+        self.inflight -= 1
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=503, headers={'Retry-After': '0'})
+
+    async def race(self, request):
+        return await self._track(request) or web.json_response(
+            {'race': {'events': [{'event_id': 11, 'name': '5K'}]}})
+
+    async def participants(self, request):
+        failed = await self._track(request)
+        if failed:
+            return failed
+        page = int(request.query['page'])
+        perpage = int(request.query['results_per_page'])
+        participants = [{'registration_id': i}
+                        for i in range((page-1)*perpage, min(page*perpage, self.numparticipants))]
+        if request.path.endswith('/removed-participants'):
+            return web.json_response([{'event': {'participants': participants}}])
+        return web.json_response([{'participants': participants}])
+
+    async def coupons(self, request):
+        return await self._track(request) or web.json_response({'coupons': [{'coupon_code': 'ABC'}]})
+
+    async def setcoupon(self, request):
+        data = await request.post()
+        self.posts.append(dict(data))
+        if self.dropposts:
+            request.transport.close()
+        request = loads(data['request'])
+        return web.json_response({'coupons': [dict(request['coupons'][0], coupon_id=99)]})
+
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture
+def aiostub(monkeypatch):
+    '''create a stub server; call returned function with number of participants'''
+    stubs = []
+    def create(numparticipants=0, **kwargs):
+        stub = AioStubRunSignUp(numparticipants, **kwargs)
+        for name, path in [('race_url', '/rest/race/{race_id}'),
+                           ('raceparticipants_url', '/rest/race/{race_id}/participants'),
+                           ('removedparticipants_url', '/rest/race/{race_id}/removed-participants'),
+                           ('coupons_url', '/rest/race/{race_id}/coupons')]:
+            monkeypatch.setattr(runsignup, name, stub.url + path)
+        stubs.append(stub)
+        return stub
+    yield create
+    for stub in stubs:
+        stub.shutdown()
+
+
+def withclient(coro, **kwargs):
+    '''run coro(client) with an open AsyncRunSignUp'''
+    async def run():
+        async with AsyncRunSignUp(key='testkey', secret='testsecret', **kwargs) as client:
+            return await coro(client)
+    return asyncio.run(run())
+
+
+def test_getraceevents(aiostub):
+    stub = aiostub()
+    events = withclient(lambda rsu: rsu.getraceevents(1234))
+
+    assert events == [{'event_id': 11, 'name': '5K'}]
+    path, query = stub.requests[0]
+    assert query['api_key'] == 'testkey'
+    assert query['format'] == 'json'
+
+
+def test_getraceparticipants_concurrent_pages(aiostub):
+    stub = aiostub(1050)
+    participants = withclient(lambda rsu: rsu.getraceparticipants(1234, 11), concurrency=4)
+
+    assert [p['registration_id'] for p in participants] == list(range(1050))
+    assert 1 < stub.maxinflight <= 4
+
+
+def test_getraceparticipants_single_page(aiostub):
+    stub = aiostub(30)
+    participants = withclient(lambda rsu: rsu.getraceparticipants(1234, 11, modified_after_timestamp=100))
+
+    assert len(participants) == 30
+    assert len(stub.requests) == 1
+    assert stub.requests[0][1]['modified_after_timestamp'] == '100'
+
+
+def test_getremovedparticipants(aiostub):
+    aiostub(150)
+    removed = withclient(lambda rsu: rsu.getremovedparticipants(1234, 11))
+
+    assert len(removed) == 150
+
+
+def test_fan_out_over_events(aiostub):
+    stub = aiostub(250)
+    async def allevents(rsu):
+        return await asyncio.gather(*[rsu.getraceparticipants(1234, event_id) for event_id in range(5)])
+    results = withclient(allevents, concurrency=8)
+
+    assert [len(r) for r in results] == [250] * 5
+    assert stub.maxinflight <= 8
+
+
+def test_getcoupons_and_setcoupon(aiostub):
+    stub = aiostub()
+    async def coupons(rsu):
+        return await rsu.getcoupons(1234), await rsu.setcoupon(1234, 'NEW', '2026-01-01', '2026-12-31', 2, 'Acme')
+    coupons, newcoupons = withclient(coupons)
+
+    assert coupons == [{'coupon_code': 'ABC'}]
+    assert newcoupons[0]['coupon_id'] == 99
+    assert newcoupons[0]['coupon_code'] == 'NEW'
+    assert stub.posts[0]['api_key'] == 'testkey'
+
+
+def test_retries_through_scheduler(aiostub):
+    stub = aiostub(failures=2)
+    scheduler = RequestScheduler()
+    events = withclient(lambda rsu: rsu.getraceevents(1234), scheduler=scheduler)
+
+    assert events == [{'event_id': 11, 'name': '5K'}]
+    # endpoint patterns are from the real urls, so stub requests are keyed by url
+    assert scheduler.stats()[runsignup.race_url.format(race_id=1234)]['retries'] == 2
+
+
+def test_post_not_retried_after_sent(aiostub):
+    # RunSignUp may have created the coupon before the connection was lost
+    stub = aiostub(dropposts=True)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        withclient(lambda rsu: rsu.setcoupon(1234, 'NEW', '2026-01-01', '2026-12-31', 2, 'Acme'))
+
+    assert len(stub.posts) == 1
+
+
+def test_post_retried_on_connect_failure(aiostub, monkeypatch):
+    stub = aiostub()
+    # nothing listens on the original port for the first attempt
+    monkeypatch.setattr(runsignup, 'coupons_url', 'http://127.0.0.1:1/rest/race/{race_id}/coupons')
+    scheduler = RequestScheduler(backoffbase=0)
+    with pytest.raises(aiohttp.ClientConnectorError):
+        withclient(lambda rsu: rsu.setcoupon(1234, 'NEW', '2026-01-01', '2026-12-31', 2, 'Acme'), scheduler=scheduler)
+
+    assert scheduler.stats()['http://127.0.0.1:1/rest/race/1234/coupons']['retries'] == scheduler.maxretries
+    assert stub.posts == []
+
+
+def test_http_error_raises(aiostub):
+    aiostub(failures=10)
+    with pytest.raises(accessError):
+        withclient(lambda rsu: rsu.getraceevents(1234), scheduler=RequestScheduler(maxretries=1))
+
+
+def test_syncrunsignup_bridge(aiostub):
+    aiostub(120)
+    with SyncRunSignUp(key='testkey', secret='testsecret') as rsu:
+        assert rsu.getraceevents(1234) == [{'event_id': 11, 'name': '5K'}]
+        assert len(rsu.getraceparticipants(1234, 11)) == 120
+        # connection pool is reused across calls
+        session = rsu.client.session
+        rsu.getraceevents(1234)
+        assert rsu.client.session is session
@@ -0,0 +1,773 @@
+'''
+test_caching - test contracts.caching
+=========================================================
+'''
+
+# standard
+import subprocess
+from datetime import date, datetime
+import sys
+import threading
+import time
+
+# pypi
+import pytest
+from flask import Flask
+from sqlalchemy import event as sqlevent
+
+# homegrown
+from contracts import caching
+from contracts.caching import update_raceregcache, refresh_raceregcaches
+from contracts.caching import refresh_raceregcache_background, raceregcache_refreshing, regcache_counts
+from contracts.caching import race_regcounts, rebuild_regcounts
+from contracts.caching import raceregcache_version
+from contracts.caching import upsert_couponindex, couponindex, reconcile_couponindex, refresh_couponindex
+from contracts.caching import sync_racecoupons
+from contracts.dbmodel import db, SponsorRace, SponsorRaceRegCache, SponsorRaceRegCount, SponsorRaceCoupon
+from contracts.dbmodel import SponsorRaceEventSync, SponsorRaceRegEvent, SponsorRaceRegPii
+from contracts.runsignup import RunSignUp, couponspec
+
+
+RACE_ID = '1234'
+EVENT = {
+    'event_id': 11,
+    'name': '5K',
+    'start_time': '6/1/2026 08:00',
+    'end_time': None,
+    'registration_opens': '1/1/2026 00:00',
+    'registration_periods': [{'registration_closes': '05/31/2026 23:59'}],
+}
+
+
+def make_participant(regid, regdate='01/02/2026 10:00', first_name='Jo'):
+    return {
+        'registration_id': regid,
+        'registration_date': regdate,
+        'last_modified': 1767000000,
+        'user': {
+            'first_name': first_name,
+            'last_name': 'Smith',
+            'email': f'runner{regid}@example.com',
+            'gender': 'F',
+            'dob': '1990-05-04',
+        },
+    }
+
+
+def pages(items, pagesize=100):
+    for i in range(0, len(items), pagesize):
+        yield items[i:i+pagesize]
+
+
+class FakeRunSignUp():
+    '''
+    stands in for contracts.runsignup.RunSignUp, returning canned events / participants
+
+    participants and removed may be lists, or dicts of lists keyed by event_id
+    '''
+    def __init__(self, events, participants=[], removed=[]):
+        self.events = events
+        self.participants = participants
+        self.removed = removed
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def getraceevents(self, race_id):
+        self.calls.append(('getraceevents', race_id))
+        return self.events
+
+    def iterraceparticipants(self, race_id, event_id, **kwargs):
+        self.calls.append(('iterraceparticipants', event_id, kwargs))
+        return pages(self._forevent(self.participants, event_id))
+
+    def iterremovedparticipants(self, race_id, event_id, **kwargs):
+        self.calls.append(('iterremovedparticipants', event_id, kwargs))
+        return pages(self._forevent(self.removed, event_id))
+
+    def _forevent(self, items, event_id):
+        if isinstance(items, dict):
+            if isinstance(items.get(event_id), Exception):
+                raise items[event_id]
+            return items.get(event_id, [])
+        return items
+
+
+@pytest.fixture
+def race(bare_dbapp):
+    race = SponsorRace(race='Test Race', couponprovider='RunSignUp', couponproviderid=RACE_ID,
+                       display=True, timezone='America/New_York')
+    db.session.add(race)
+    db.session.commit()
+    return race
+
+
+@pytest.fixture
+def fakersu(monkeypatch):
+    '''install a FakeRunSignUp; call returned function to set its data'''
+    def install(*args, **kwargs):
+        rsu = FakeRunSignUp(*args, **kwargs)
+        monkeypatch.setattr(caching, 'make_runsignup_client', lambda: rsu)
+        return rsu
+    return install
+
+
+def count_statements(engine):
+    '''collect statements executed against engine'''
+    statements = []
+    sqlevent.listen(engine, 'before_cursor_execute',
+                    lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+# ----------------------------------------------------------------------
+# update_raceregcache
+# ----------------------------------------------------------------------
+
+def test_update_raceregcache_inserts_participants(race, fakersu):
+    fakersu([EVENT], participants=[make_participant(1), make_participant(2)])
+
+    events = update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    assert events == [EVENT]
+    rows = SponsorRaceRegCache.query.order_by(SponsorRaceRegCache.registration_id).all()
+    assert [r.registration_id for r in rows] == [1, 2]
+    assert rows[0].event_id == 11
+    assert rows[0].is_active == True
+    assert rows[0].registration_date.year == 2026
+    assert race.cacheupdatets > 0
+    # event name and participant details are kept out of the registration cache table
+    assert [(e.event_id, e.name) for e in SponsorRaceRegEvent.query.all()] == [(11, '5K')]
+    pii = SponsorRaceRegPii.query.order_by(SponsorRaceRegPii.registration_id).all()
+    assert [p.registration_id for p in pii] == [1, 2]
+    assert pii[0].email == 'runner1@example.com'
+    assert pii[0].dob.isoformat().startswith('1990-05-04')
+
+
+def test_update_raceregcache_updates_existing_rows(race, fakersu):
+    db.session.add(SponsorRaceRegCache(registration_id=1, event_id=11, is_active=False))
+    db.session.add(SponsorRaceRegPii(registration_id=1, first_name='Old'))
+    db.session.add(SponsorRaceRegEvent(event_id=11, name='Old 5K'))
+    db.session.commit()
+    fakersu([EVENT], participants=[make_participant(1, first_name='New'), make_participant(2)])
+
+    update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    assert SponsorRaceRegCache.query.count() == 2
+    row = SponsorRaceRegCache.query.filter_by(registration_id=1).one()
+    assert row.is_active == True
+    assert SponsorRaceRegPii.query.count() == 2
+    assert SponsorRaceRegPii.query.filter_by(registration_id=1).one().first_name == 'New'
+    assert [(e.event_id, e.name) for e in SponsorRaceRegEvent.query.all()] == [(11, '5K')]
+
+
+def test_update_raceregcache_duplicate_participants_in_one_fetch(race, fakersu):
+    fakersu([EVENT], participants=[make_participant(1, first_name='First'), make_participant(1, first_name='Last')])
+
+    update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    assert SponsorRaceRegCache.query.count() == 1
+    assert SponsorRaceRegPii.query.filter_by(registration_id=1).one().first_name == 'Last'
+
+
+def test_update_raceregcache_deactivates_removed(race, fakersu):
+    db.session.add(SponsorRaceRegCache(registration_id=1, event_id=11, is_active=True))
+    db.session.commit()
+    # registration 99 isn't in the cache, and is ignored
+    fakersu([EVENT], removed=[{'registration_id': 1}, {'registration_id': 99}])
+
+    update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    assert SponsorRaceRegCache.query.filter_by(registration_id=1).one().is_active == False
+    assert SponsorRaceRegCache.query.filter_by(registration_id=99).one_or_none() is None
+
+
+def test_update_raceregcache_statements_per_batch(race, fakersu, monkeypatch):
+    # statement count depends on number of batches, not number of participants
+    monkeypatch.setattr(caching, 'REGCACHE_BATCHSIZE', 100)
+    existing = [SponsorRaceRegCache(registration_id=regid, event_id=11, is_active=True) for regid in range(150)]
+    db.session.add_all(existing)
+    db.session.commit()
+    fakersu([EVENT], participants=[make_participant(regid) for regid in range(300)],
+            removed=[{'registration_id': regid} for regid in range(250)])
+
+    statements = count_statements(db.engine)
+    update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    cachestatements = [s for s in statements if 'sponsorraceregcache' in s]
+    # 3 participant batches: select + insert/update each (one batch has both), 
+    # 3 deactivate batches: select + update each, and the aggregate query which rebuilds daily counts
+    assert len(cachestatements) <= 3*3 + 3*2 + 1
+    assert SponsorRaceRegCache.query.count() == 300
+    assert SponsorRaceRegCache.query.filter_by(is_active=True).count() == 50
+
+
+def test_update_raceregcache_onlyrecentevents_single_query(race, fakersu):
+    race.cacheupdatets = 1000
+    db.session.commit()
+    rsu = fakersu([EVENT], participants=[make_participant(1), make_participant(2)])
+
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+
+    calls = [c for c in rsu.calls if c[0] == 'iterraceparticipants']
+    assert [c[2] for c in calls] == [{'modified_after_timestamp': 1000}]
+    assert SponsorRaceRegCache.query.count() == 2
+
+
+def test_update_raceregcache_onlyrecentevents_merges_queries(race, fakersu, monkeypatch):
+    monkeypatch.setitem(caching.current_app.config, 'REGCACHE_DELTA_PARAMS',
+                        ['modified_after_timestamp', 'registered_after_timestamp'])
+    race.cacheupdatets = 1000
+    db.session.commit()
+    rsu = fakersu([EVENT], participants=[make_participant(1), make_participant(2)])
+
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+
+    # both modified and registered queries return the same participants, which are only cached once
+    calls = [c for c in rsu.calls if c[0] == 'iterraceparticipants']
+    assert [c[2] for c in calls] == [{'modified_after_timestamp': 1000}, {'registered_after_timestamp': 1000}]
+    assert SponsorRaceRegCache.query.count() == 2
+
+
+def test_update_raceregcache_uses_event_highwater_marks(race, fakersu):
+    event12 = dict(EVENT, event_id=12, name='10K')
+    race.cacheupdatets = 1000
+    # event 11 was synced after its registration closed, event 12 more recently than the race
+    db.session.add_all([SponsorRaceEventSync(race_id=race.id, event_id=11, synced_ts=2000000000),
+                        SponsorRaceEventSync(race_id=race.id, event_id=12, synced_ts=1500)])
+    db.session.commit()
+    rsu = fakersu([EVENT, event12], participants={12: [make_participant(1)]})
+
+    before = int(time.time())
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+
+    # event 11 costs no participant calls
+    calls = [c for c in rsu.calls if c[0] in ['iterraceparticipants', 'iterremovedparticipants']]
+    assert [(c[1], c[2]) for c in calls] == [(12, {'modified_after_timestamp': 1500}), 
+                                             (12, {'modified_after_timestamp': 1500})]
+    syncs = caching.eventsyncs(race)
+    assert syncs[11] == 2000000000
+    assert syncs[12] >= before
+
+
+def test_refresh_raceregcaches_failed_event_keeps_highwater_mark(race, fakersu):
+    event12 = dict(EVENT, event_id=12, name='10K')
+    race.cacheupdatets = 1000
+    db.session.commit()
+    fakersu([EVENT, event12], participants={11: [make_participant(1)], 12: RuntimeError('rsu down')})
+
+    before = int(time.time())
+    raceresults, eventresults = refresh_raceregcaches([race], workers=1)
+
+    syncs = caching.eventsyncs(race)
+    assert syncs[11] >= before
+    assert 12 not in syncs
+    failed = SponsorRaceEventSync.query.filter_by(race_id=race.id, event_id=12).one()
+    assert failed.numfailures == 1
+    assert failed.lasterror == 'rsu down'
+    assert failed.event_name == '10K 6/1/2026 08:00'
+    # race wasn't completed, so its timestamp isn't updated
+    assert db.session.get(SponsorRace, race.id).cacheupdatets == 1000
+
+    # failed event is retried from the race timestamp, as it never had a high-water mark, 
+    # and event 11 is skipped as its registration closed before its high-water mark
+    rsu = fakersu([EVENT, event12], participants={12: [make_participant(2)]})
+    refresh_raceregcaches([race], workers=1)
+
+    calls = [c for c in rsu.calls if c[0] == 'iterraceparticipants']
+    assert [(c[1], c[2]) for c in calls] == [(12, {'modified_after_timestamp': 1000})]
+    retried = SponsorRaceEventSync.query.filter_by(race_id=race.id, event_id=12).one()
+    assert retried.numfailures == 0
+    assert retried.lasterror is None
+    assert retried.numsyncs == 2
+    assert retried.numupdated == 1
+    assert retried.synced_ts >= before
+
+
+def test_eventsync_report(race):
+    event12 = dict(EVENT, event_id=12, name='10K')
+    caching.record_eventsync(race.id, EVENT, 1000, 2.0, 10, 1)
+    caching.record_eventsync(race.id, EVENT, 2000, 4.0, 5, 0)
+    caching.record_eventsync(race.id, event12, 2000, 1.0, error='timeout')
+    db.session.commit()
+
+    report = caching.eventsync_report([race.id])
+
+    assert [(r['event_id'], r['numsyncs'], r['totalduration']) for r in report] == [(11, 2, 6.0), (12, 1, 1.0)]
+    assert report[0]['meanduration'] == 3.0
+    assert report[0]['lastduration'] == 4.0
+    assert (report[0]['numupdated'], report[0]['numremoved'], report[0]['synced_ts']) == (5, 0, 2000)
+    assert (report[1]['numfailures'], report[1]['lasterror'], report[1]['synced_ts']) == (1, 'timeout', None)
+
+
+def test_update_raceregcache_onlyrecentevents_skips_closed_events(race, fakersu):
+    # registration closed well before the last cache update
+    race.cacheupdatets = 2000000000
+    db.session.commit()
+    rsu = fakersu([EVENT], participants=[make_participant(1)])
+
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+
+    assert [c[0] for c in rsu.calls] == ['getraceevents']
+    assert SponsorRaceRegCache.query.count() == 0
+
+
+# ----------------------------------------------------------------------
+# regcache_counts
+# ----------------------------------------------------------------------
+
+def test_regcache_counts_groups_by_event_and_day(bare_dbapp):
+    rows = [(1, 11, datetime(2026, 1, 2, 10), True), (2, 11, datetime(2026, 1, 2, 23, 59), True),
+            (3, 11, datetime(2026, 1, 3, 0, 1), True), (4, 11, datetime(2026, 1, 3, 9), False),
+            (5, 12, datetime(2026, 1, 2, 8), True), (6, 13, datetime(2026, 1, 2, 8), True)]
+    db.session.add_all([SponsorRaceRegCache(registration_id=regid, event_id=event_id, registration_date=regdate,
+                                            is_active=is_active)
+                        for regid, event_id, regdate, is_active in rows])
+    db.session.commit()
+
+    statements = count_statements(db.engine)
+    counts = regcache_counts([11, 12])
+
+    assert len(statements) == 1
+    assert counts == [(11, '2026-01-02', 2), (11, '2026-01-03', 1), (12, '2026-01-02', 1)]
+
+
+# ----------------------------------------------------------------------
+# daily registration counts
+# ----------------------------------------------------------------------
+
+def test_regcounts_maintained_incrementally(race, fakersu):
+    race.cacheupdatets = 1000
+    db.session.commit()
+    fakersu([EVENT], participants=[make_participant(1), make_participant(2), make_participant(3, '01/03/2026 09:00')])
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+    assert race_regcounts(race.id, [11]) == [(11, '2026-01-02', 2), (11, '2026-01-03', 1)]
+
+    # registration 1 was modified to a different day, 2 is unchanged, 3 was removed
+    SponsorRaceEventSync.query.delete()
+    race.cacheupdatets = 1000
+    fakersu([EVENT], participants=[make_participant(1, '01/03/2026 12:00'), make_participant(2)],
+            removed=[{'registration_id': 3}])
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+    assert race_regcounts(race.id, [11]) == [(11, '2026-01-02', 1), (11, '2026-01-03', 1)]
+
+    # registration 3 is reactivated
+    SponsorRaceEventSync.query.delete()
+    race.cacheupdatets = 1000
+    fakersu([EVENT], participants=[make_participant(3, '01/03/2026 09:00')])
+    update_raceregcache(RACE_ID)
+    db.session.commit()
+    assert race_regcounts(race.id, [11]) == [(11, '2026-01-02', 1), (11, '2026-01-03', 2)]
+    assert race_regcounts(race.id, [11]) == regcache_counts([11])
+
+
+def test_rebuild_regcounts_reports_inconsistencies(race):
+    db.session.add_all([
+        SponsorRaceRegCache(registration_id=1, event_id=11, registration_date=datetime(2026, 1, 2, 10), is_active=True),
+        SponsorRaceRegCache(registration_id=2, event_id=11, registration_date=datetime(2026, 1, 3, 10), is_active=True),
+        SponsorRaceRegCount(race_id=race.id, event_id=11, registration_day=date(2026, 1, 2), regcount=1),
+        SponsorRaceRegCount(race_id=race.id, event_id=11, registration_day=date(2026, 1, 4), regcount=3),
+    ])
+    db.session.commit()
+
+    inconsistent = rebuild_regcounts(race.id, [11])
+    db.session.commit()
+
+    assert inconsistent == [(11, '2026-01-03', 0, 1), (11, '2026-01-04', 3, 0)]
+    assert race_regcounts(race.id, [11]) == [(11, '2026-01-02', 1), (11, '2026-01-03', 1)]
+
+
+def test_update_raceregcache_full_refresh_rebuilds_regcounts(race, fakersu):
+    db.session.add(SponsorRaceRegCount(race_id=race.id, event_id=11, registration_day=date(2026, 1, 2), regcount=5))
+    db.session.commit()
+    fakersu([EVENT], participants=[make_participant(1)])
+
+    update_raceregcache(RACE_ID, onlyrecentevents=False)
+    db.session.commit()
+
+    assert race_regcounts(race.id, [11]) == [(11, '2026-01-02', 1)]
+
+
+# ----------------------------------------------------------------------
+# regcache_xform
+# ----------------------------------------------------------------------
+
+def test_parse_rsudatetime():
+    assert caching.parse_rsudatetime('1/2/2026 09:05') == datetime(2026, 1, 2, 9, 5)
+    assert caching.parse_rsudatetime('12/31/2025 23:59') == datetime(2025, 12, 31, 23, 59)
+    # other formats fall back to strptime, which rejects what it can't parse
+    with pytest.raises(ValueError):
+        caching.parse_rsudatetime('2026-01-02')
+
+
+def test_regcache_xform_rows():
+    participant = make_participant(7, regdate='01/02/2026 10:00')
+    participant['user']['dob'] = None
+
+    row, piirow = caching.regcache_xform().rows(participant, 11)
+
+    assert row == {'registration_id': 7, 'event_id': 11, 'registration_date': datetime(2026, 1, 2, 10, 0),
+                   'last_modified_ts': 1767000000, 'is_active': True}
+    assert piirow == {'registration_id': 7, 'first_name': 'Jo', 'last_name': 'Smith',
+                      'email': 'runner7@example.com', 'gender': 'F', 'dob': None}
+    assert caching.regcache_xform().rows(make_participant(8), 11)[1]['dob'] == date(1990, 5, 4)
+
+
+# ----------------------------------------------------------------------
+# _regroup
+# ----------------------------------------------------------------------
+
+def test_regroup_collects_pages_into_groups():
+    groups = list(caching._regroup(pages(list(range(250)), pagesize=100), 120))
+
+    assert [len(g) for g in groups] == [120, 120, 10]
+    assert sum(groups, []) == list(range(250))
+
+
+def test_regroup_is_lazy():
+    fetched = []
+    def trackedpages():
+        for page in pages(list(range(300)), pagesize=100):
+            fetched.append(page[0])
+            yield page
+
+    groups = caching._regroup(trackedpages(), 100)
+    next(groups)
+
+    assert fetched == [0]
+
+
+# ----------------------------------------------------------------------
+# refresh_raceregcaches
+# ----------------------------------------------------------------------
+
+EVENT2 = dict(EVENT, event_id=12, name='10K')
+
+@pytest.fixture
+def file_dbapp(tmp_path):
+    '''like bare_dbapp, but with a file database so worker threads each get their own connection'''
+    app = Flask('contracts')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'contracts.db')
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite:///{}'.format(tmp_path / 'users.db')}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def races(file_dbapp):
+    races = [
+        SponsorRace(race='Race A', couponprovider='RunSignUp', couponproviderid='100', display=True,
+                    timezone='America/New_York'),
+    ]
+    db.session.add_all(races)
+    db.session.commit()
+    return races
+
+
+def test_refresh_raceregcaches_all_events(races, fakersu):
+    fakersu([EVENT, EVENT2], participants={11: [make_participant(1), make_participant(2)],
+                                           12: [make_participant(3)]})
+
+    raceresults, eventresults = refresh_raceregcaches(races, workers=2, onlyrecentevents=False)
+
+    assert SponsorRaceRegCache.query.count() == 3
+    assert SponsorRaceRegCache.query.filter_by(registration_id=3).one().event_id == 12
+    assert sorted((r['event'], r['updated']) for r in eventresults) == [('10K', 1), ('5K', 2)]
+    assert raceresults[0]['numjobs'] == 2
+    assert raceresults[0]['errors'] == 0
+    assert db.session.get(SponsorRace, races[0].id).cacheupdatets == raceresults[0]['cacheupdatets']
+
+
+def test_refresh_raceregcaches_event_error_keeps_race_timestamp(races, fakersu):
+    fakersu([EVENT, EVENT2], participants={11: [make_participant(1)], 12: RuntimeError('rsu down')})
+
+    raceresults, eventresults = refresh_raceregcaches(races, workers=2, onlyrecentevents=False)
+
+    # the event which worked is committed, but the race will be retried next time
+    assert SponsorRaceRegCache.query.count() == 1
+    assert [r['error'] for r in eventresults if r['event'] == '10K'] == ['rsu down']
+    assert raceresults[0]['errors'] == 1
+    assert db.session.get(SponsorRace, races[0].id).cacheupdatets == 0
+
+
+def test_refresh_raceregcaches_sees_workers_commits(races, fakersu, monkeypatch):
+    fakersu([EVENT, EVENT2], participants={11: [make_participant(1)], 12: [make_participant(2)]})
+    session = db.session()
+    intransaction = []
+    regcacheworker = caching._regcacheworker
+    def worker(app, jobs, results):
+        intransaction.append(session.in_transaction())
+        regcacheworker(app, jobs, results)
+    monkeypatch.setattr(caching, '_regcacheworker', worker)
+
+    raceresults, eventresults = refresh_raceregcaches(races, workers=2, onlyrecentevents=False)
+
+    # counts rebuilt after a full refresh are read in a transaction which started after the workers committed
+    assert intransaction == [False, False]
+    assert sum(count for event_id, regdate, count in race_regcounts(races[0].id, [11, 12])) == 2
+
+
+def test_raceregcache_version_changes_when_some_events_fail(races, fakersu):
+    before = raceregcache_version(races[0])
+    fakersu([EVENT, EVENT2], participants={11: [make_participant(1)], 12: RuntimeError('rsu down')})
+
+    refresh_raceregcaches(races, workers=2, onlyrecentevents=False)
+
+    # the race's timestamp is unchanged, but the committed event changes the version
+    version, lastupdatets = raceregcache_version(db.session.get(SponsorRace, races[0].id))
+    assert version != before[0]
+    assert lastupdatets is not None
+
+
+# ----------------------------------------------------------------------
+# refresh_raceregcache_background
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def blockedrefresh(monkeypatch, tmp_path):
+    '''update_raceregcache waits for returned event to be set, records race_ids it was called for'''
+    monkeypatch.setattr(caching, 'REGCACHE_LOCKFILE', str(tmp_path / 'regcache_{}.lock'))
+    release = threading.Event()
+    calls = []
+    def update_raceregcache(race_id, onlyrecentevents=True):
+        calls.append((race_id, onlyrecentevents))
+        release.wait(5)
+    monkeypatch.setattr(caching, 'update_raceregcache', update_raceregcache)
+    release.calls = calls
+    return release
+
+
+def waitrefreshed(race_id):
+    for i in range(100):
+        if not raceregcache_refreshing(race_id):
+            return
+        time.sleep(0.05)
+    raise AssertionError('background refresh did not finish')
+
+
+def test_refresh_raceregcache_background_dedups(races, blockedrefresh):
+    race_id = races[0].couponproviderid
+
+    assert refresh_raceregcache_background(race_id) == True
+    assert raceregcache_refreshing(race_id) == True
+    # second request while the first is running doesn't start another refresh
+    assert refresh_raceregcache_background(race_id) == False
+
+    blockedrefresh.set()
+    waitrefreshed(race_id)
+    assert blockedrefresh.calls == [(race_id, True)]
+
+
+def otherprocess_acquires(path):
+    other = subprocess.run(
+        [sys.executable, '-c',
+         'import sys; from fasteners import InterProcessLock; print(InterProcessLock(sys.argv[1]).acquire(blocking=False))',
+         path],
+        capture_output=True, text=True)
+    return other.stdout.strip() == 'True'
+
+
+def test_raceregcache_refreshing_keeps_this_process_lock(races, blockedrefresh, file_dbapp, monkeypatch):
+    race_id = races[0].couponproviderid
+
+    # another thread starts a refresh while this one checks whether another process is refreshing
+    started = []
+    def startrefresh():
+        with file_dbapp.app_context():
+            started.append(refresh_raceregcache_background(race_id))
+    class ProbedLock(caching.InterProcessLock):
+        def release(self):
+            if not started and threading.current_thread() is threading.main_thread():
+                thread = threading.Thread(target=startrefresh)
+                thread.start()
+                thread.join(0.5)
+            super().release()
+    monkeypatch.setattr(caching, 'InterProcessLock', ProbedLock)
+
+    assert raceregcache_refreshing(race_id) == False
+    for i in range(100):
+        if started:
+            break
+        time.sleep(0.01)
+    assert started == [True]
+
+    # checking didn't release the lock taken for the refresh, so another process can't start a refresh
+    assert not otherprocess_acquires(caching.REGCACHE_LOCKFILE.format(race_id))
+
+    blockedrefresh.set()
+    waitrefreshed(race_id)
+
+
+def test_refresh_raceregcache_background_lock_held_by_other_process(races, blockedrefresh):
+    race_id = races[0].couponproviderid
+    # file locks are per process, so the lock has to be held by a real separate process
+    holder = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys; from fasteners import InterProcessLock; lock = InterProcessLock(sys.argv[1]); '
+         'lock.acquire(); print("locked", flush=True); sys.stdin.read()',
+         caching.REGCACHE_LOCKFILE.format(race_id)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        assert raceregcache_refreshing(race_id) == True
+        assert refresh_raceregcache_background(race_id) == False
+    finally:
+        holder.communicate('')
+
+    assert raceregcache_refreshing(race_id) == False
+    assert blockedrefresh.calls == []
+
+
+def test_refresh_raceregcache_background_fresh_cache(races, blockedrefresh):
+    races[0].cacheupdatets = int(time.time()) - 60
+    db.session.commit()
+
+    assert refresh_raceregcache_background(races[0].couponproviderid, maxage=300) == False
+    assert refresh_raceregcache_background(races[0].couponproviderid, maxage=30) == True
+
+    blockedrefresh.set()
+    waitrefreshed(races[0].couponproviderid)
+
+
+def test_refresh_raceregcache_background_updates_cache(races, fakersu, monkeypatch, tmp_path):
+    monkeypatch.setattr(caching, 'REGCACHE_LOCKFILE', str(tmp_path / 'regcache_{}.lock'))
+    fakersu([EVENT], participants=[make_participant(1), make_participant(2)])
+    race_id = races[0].couponproviderid
+
+    assert refresh_raceregcache_background(race_id, onlyrecentevents=False) == True
+    waitrefreshed(race_id)
+
+    db.session.expire_all()
+    assert SponsorRaceRegCache.query.count() == 2
+    assert db.session.get(SponsorRace, races[0].id).cacheupdatets > 0
+
+
+def test_regcache_status(races, blockedrefresh):
+    from contracts.views.admin.racessummary import regcache_status
+    race = races[0]
+    assert regcache_status(race) == 'not yet cached'
+
+    race.cacheupdatets = int(time.time()) - 125
+    assert regcache_status(race) == 'last updated 2 minutes ago'
+
+    refresh_raceregcache_background(race.couponproviderid)
+    assert regcache_status(race) == 'refreshing, last updated 2 minutes ago'
+    blockedrefresh.set()
+    waitrefreshed(race.couponproviderid)
+
+
+def make_coupon(coupon_id, code, registrants=2, notes='Client', num_uses=0):
+    return {'coupon_id': coupon_id, 'coupon_code': code, 'start_date': '2025-11-01 00:00:00',
+            'end_date': '2026-12-31 23:59:59', 'max_num_race_registrants': registrants,
+            'num_uses': num_uses, 'coupon_notes': notes}
+
+
+class FakeCouponRunSignUp(RunSignUp):
+    '''RunSignUp with canned coupons, which records getcoupons() and coupons POST calls'''
+    def __init__(self, coupons):
+        super().__init__(key='testkey', secret='testsecret')
+        self.coupons = coupons
+        self.gets = []
+        self.posts = []
+
+    def getcoupons(self, race_id, coupon_code=None):
+        self.gets.append(coupon_code)
+        return [c for c in self.coupons if coupon_code is None or coupon_code in c['coupon_code']]
+
+    def _rsupost(self, methodurl, **params):
+        from json import loads
+        coupons = loads(params['request'])['coupons']
+        self.posts.append(coupons)
+        return {'coupons': [{'coupon_id': c['coupon_id'] or 900 + i, 'coupon_code': c['coupon_code']}
+                            for i, c in enumerate(coupons)]}
+
+
+def test_upsert_couponindex(race):
+    upsert_couponindex(race.id, [make_coupon(1, 'A'), make_coupon(2, 'B'), make_coupon(3, 'B', registrants=5)])
+    db.session.commit()
+    upsert_couponindex(race.id, [make_coupon(1, 'A', num_uses=1), make_coupon(4, 'C')])
+    db.session.commit()
+
+    index = couponindex(race.id)
+    assert sorted(index) == ['A', 'B', 'C']
+    # last of duplicate codes is current
+    assert index['B']['coupon_id'] == 3
+    assert index['B']['max_num_race_registrants'] == 5
+    assert index['A']['num_uses'] == 1
+    assert SponsorRaceCoupon.query.count() == 3
+    assert sorted(couponindex(race.id, ['A', 'C', 'X'])) == ['A', 'C']
+
+
+def test_reconcile_couponindex(race):
+    upsert_couponindex(race.id, [make_coupon(1, 'SAME'), make_coupon(2, 'USED'), make_coupon(3, 'GONE')])
+    db.session.commit()
+    rsu = FakeCouponRunSignUp([make_coupon(1, 'SAME'), make_coupon(2, 'USED', num_uses=2), make_coupon(4, 'NEW')])
+
+    result = reconcile_couponindex(rsu, race)
+    db.session.commit()
+
+    assert result == dict(added=1, changed=1, removed=1, total=3)
+    index = couponindex(race.id)
+    assert sorted(index) == ['NEW', 'SAME', 'USED']
+    assert index['USED']['num_uses'] == 2
+
+
+def test_refresh_couponindex(race):
+    upsert_couponindex(race.id, [make_coupon(1, 'ABC'), make_coupon(2, 'GONE')])
+    db.session.commit()
+    rsu = FakeCouponRunSignUp([make_coupon(1, 'ABC', num_uses=1), make_coupon(5, 'ABCD')])
+
+    found = refresh_couponindex(rsu, race, ['ABC', 'GONE'])
+    db.session.commit()
+
+    assert rsu.gets == ['ABC', 'GONE']
+    assert found['ABC']['num_uses'] == 1
+    index = couponindex(race.id)
+    assert sorted(index) == ['ABC']
+    assert index['ABC']['num_uses'] == 1
+
+
+def test_sync_racecoupons_builds_index_then_uses_it(race):
+    rsu = FakeCouponRunSignUp([make_coupon(1, 'SAME', notes='Same Client', num_uses=1),
+                               make_coupon(2, 'MORE', notes='More Client')])
+    coupons = [couponspec('SAME', '2026-01-01', '2026-12-31', 2, 'Same Client'),
+               couponspec('MORE', '2026-01-01', '2026-12-31', 4, 'More Client'),
+               couponspec('NEW', '2026-01-01', '2026-12-31', 2, 'New Client')]
+
+    synced, sent = sync_racecoupons(rsu, race, coupons)
+    db.session.commit()
+
+    # index was empty, so was reconciled with a single full scan
+    assert rsu.gets == [None]
+    assert sent == ['MORE', 'NEW']
+    assert {code: c['coupon_id'] for code, c in synced.items()} == {'SAME': 1, 'MORE': 2, 'NEW': 901}
+    index = couponindex(race.id)
+    assert index['MORE']['max_num_race_registrants'] == 4
+    assert index['MORE']['start_date'] == '2025-11-01 00:00:00'
+    assert index['NEW']['coupon_id'] == 901
+
+    # second sync uses the index, without RunSignUp scans, and sends nothing
+    synced, sent = sync_racecoupons(rsu, race, coupons)
+    assert rsu.gets == [None]
+    assert sent == []
+    assert len(rsu.posts) == 1
@@ -0,0 +1,116 @@
+'''
+test_conditionalget - test ConditionalGetMixin and tablestoken from contracts.views.admin.common
+=========================================================
+'''
+
+# standard
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# pypi
+import pytest
+
+# homegrown
+from contracts.views.admin import common
+from contracts.views.admin.common import ConditionalGetMixin, tablestoken
+from contracts.dbmodel import db, Client, State
+
+
+class FakeCrudApi():
+    '''stands in for CrudApi, counts full responses'''
+    allowed = True
+    def __init__(self):
+        self.built = 0
+
+    def permission(self):
+        return self.allowed
+
+    def get(self):
+        self.built += 1
+        return 'the page'
+
+
+class Api(ConditionalGetMixin, FakeCrudApi):
+    token = ('v1', datetime(2026, 10, 18, 12, 0, 0, tzinfo=timezone.utc))
+    def versiontoken(self):
+        return self.token
+
+
+@pytest.fixture
+def api(bare_dbapp, monkeypatch):
+    monkeypatch.setattr(common, 'current_user', SimpleNamespace(id=5, is_authenticated=True))
+    return Api()
+
+
+def test_conditionalget_full_response_has_validators(bare_dbapp, api):
+    with bare_dbapp.test_request_context('/page'):
+        response = api.get()
+
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'the page'
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified'] == 'Sun, 18 Oct 2026 12:00:00 GMT'
+    assert 'no-cache' in response.headers['Cache-Control']
+    assert 'private' in response.headers['Cache-Control']
+
+
+def test_conditionalget_if_none_match(bare_dbapp, api):
+    with bare_dbapp.test_request_context('/page'):
+        etag = api.get().headers['ETag']
+
+    with bare_dbapp.test_request_context('/page', headers={'If-None-Match': etag}):
+        response = api.get()
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert api.built == 1
+
+    # data changed
+    api.token = ('v2', None)
+    with bare_dbapp.test_request_context('/page', headers={'If-None-Match': etag}):
+        response = api.get()
+    assert response.status_code == 200
+    assert api.built == 2
+
+
+def test_conditionalget_etag_depends_on_user(bare_dbapp, api, monkeypatch):
+    with bare_dbapp.test_request_context('/page'):
+        etag = api.get().headers['ETag']
+
+    monkeypatch.setattr(common, 'current_user', SimpleNamespace(id=6, is_authenticated=True))
+    with bare_dbapp.test_request_context('/page', headers={'If-None-Match': etag}):
+        assert api.get().status_code == 200
+
+
+def test_conditionalget_if_modified_since(bare_dbapp, api):
+    with bare_dbapp.test_request_context('/page', headers={'If-Modified-Since': 'Sun, 18 Oct 2026 12:00:00 GMT'}):
+        assert api.get().status_code == 304
+    with bare_dbapp.test_request_context('/page', headers={'If-Modified-Since': 'Sun, 18 Oct 2026 11:59:59 GMT'}):
+        assert api.get().status_code == 200
+
+
+def test_conditionalget_no_permission_skips_check(bare_dbapp, api):
+    api.allowed = False
+    with bare_dbapp.test_request_context('/page', headers={'If-Modified-Since': 'Sun, 18 Oct 2026 12:00:00 GMT'}):
+        assert api.get() == 'the page'
+
+
+def test_tablestoken_changes_on_insert_update_delete(bare_dbapp):
+    client = Client(client='Acme')
+    db.session.add_all([client, State(state='new')])
+    db.session.commit()
+    tokens = [tablestoken(Client, State)]
+
+    client.client = 'Acme Inc'
+    db.session.commit()
+    tokens.append(tablestoken(Client, State))
+
+    db.session.add(Client(client='Other'))
+    db.session.commit()
+    tokens.append(tablestoken(Client, State))
+
+    db.session.delete(client)
+    db.session.commit()
+    tokens.append(tablestoken(Client, State))
+
+    assert len(set(tokens)) == 4
+    assert tablestoken(Client, State) == tokens[-1]
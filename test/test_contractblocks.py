@@ -0,0 +1,92 @@
+'''
+test_contractblocks - test contracts.contractblocks
+=========================================================
+'''
+
+# pypi
+import pytest
+from sqlalchemy import event as sqlevent
+from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
+
+# homegrown
+from contracts.contractblocks import contract_registry, contract_blocks, contract_block
+from contracts.dbmodel import db, Contract, ContractType, TemplateType, ContractBlockType
+
+
+@pytest.fixture
+def blocks(bare_dbapp):
+    contract_registry.clear()
+    bare_dbapp.config['CONTRACT_BLOCKS_MAXAGE'] = 3600
+    services = ContractType(contractType='race services')
+    contract = TemplateType(templateType='contract')
+    email = TemplateType(templateType='contract email')
+    para = ContractBlockType(blockType='para')
+    html = ContractBlockType(blockType='html')
+    db.session.add_all([
+        Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=20, block='second'),
+        Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=10, block='first'),
+        Contract(contractType=services, templateType=email, contractBlockType=html, blockPriority=1, block='Hi {{ name }}'),
+    ])
+    db.session.commit()
+    yield bare_dbapp
+    contract_registry.clear()
+
+
+@pytest.fixture
+def statements(blocks):
+    executed = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    sqlevent.listen(db.engine, 'before_cursor_execute', count)
+    yield executed
+    sqlevent.remove(db.engine, 'before_cursor_execute', count)
+
+
+def test_contract_blocks_ordered_by_priority(blocks):
+    result = contract_blocks('race services', 'contract')
+
+    assert [b.block for b in result] == ['first', 'second']
+    assert [b.blockType for b in result] == ['para', 'para']
+    assert contract_blocks('race services', 'unknown') == []
+
+
+def test_contract_block(blocks):
+    assert contract_block('race services', 'contract email') == 'Hi {{ name }}'
+    with pytest.raises(NoResultFound):
+        contract_block('race services', 'unknown')
+    with pytest.raises(MultipleResultsFound):
+        contract_block('race services', 'contract')
+
+
+def test_contract_blocks_served_from_memory(statements):
+    contract_blocks('race services', 'contract')
+    contract_block('race services', 'contract email')
+    loaded = len(statements)
+
+    contract_blocks('race services', 'contract')
+    contract_block('race services', 'contract email')
+
+    assert len(statements) == loaded
+
+
+def test_contract_edit_clears_registry(blocks):
+    assert contract_block('race services', 'contract email') == 'Hi {{ name }}'
+
+    contract = Contract.query.filter_by(blockPriority=1).one()
+    contract.block = 'Hello {{ name }}'
+    db.session.commit()
+
+    assert contract_block('race services', 'contract email') == 'Hello {{ name }}'
+
+
+def test_contract_edit_by_other_process_detected(blocks):
+    blocks.config['CONTRACT_BLOCKS_MAXAGE'] = 0
+    assert contract_block('race services', 'contract email') == 'Hi {{ name }}'
+
+    # bypass the orm, as another process would
+    with db.engine.begin() as conn:
+        conn.execute(Contract.__table__.update()
+                     .where(Contract.__table__.c.blockPriority == 1)
+                     .values(block='Hello {{ name }}', update_time=db.func.datetime('now', '+1 minute')))
+
+    assert contract_block('race services', 'contract email') == 'Hello {{ name }}'
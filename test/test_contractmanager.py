@@ -3,14 +3,22 @@ test_contractmanager - test contracts.contractmanager
 =========================================================
 '''
 
+# standard
+import os
+from shutil import rmtree
+
 # pypi
 import pytest
 from flask import Flask
+from docx import Document
 
 # homegrown
 from contracts.contractmanager import (
     _evaluate, recursive_render, ContractManagerTemplate, ContractManager, parameterError,
+    TemplateCache, contract_templates, templatekey,
 )
+from contracts.contractblocks import contract_registry
+from contracts.dbmodel import db, Contract, ContractType, TemplateType, ContractBlockType
 
 
 class Obj:
@@ -137,6 +145,33 @@ def test_recursive_render_no_template_syntax_returns_as_is(app):
     assert result == 'plain text'
 
 
+def test_recursive_render_compiles_template_once(app):
+    with app.app_context():
+        recursive_render('Hello {{ name }}', {'name': 'World'})
+        result = recursive_render('Hello {{ name }}', {'name': 'Jo'})
+        stats = app.extensions['contracts_render'][1].stats()
+
+    assert result == 'Hello Jo'
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_recursive_render_keyed_by_contract(app):
+    with app.app_context():
+        recursive_render('Hello {{ name }}', {'name': 'World'}, key=(1, 1))
+        # same key is the same block version, so the cached template is used
+        result = recursive_render('Hello {{ name }}', {'name': 'Jo'}, key=(1, 1))
+        edited = recursive_render('Goodbye {{ name }}', {'name': 'Jo'}, key=(1, 2))
+
+    assert result == 'Hello Jo'
+    assert edited == 'Goodbye Jo'
+
+
+def test_recursive_render_depth_is_bounded(app):
+    with app.app_context():
+        with pytest.raises(parameterError):
+            recursive_render('{{ grow }}', {'grow': '{{ grow }}x'}, maxdepth=5)
+
+
 # ----------------------------------------------------------------------
 # ContractManagerTemplate
 # ----------------------------------------------------------------------
@@ -175,6 +210,70 @@ def test_contractmanagertemplate_generate_yields_loop_output(app):
     assert result == 'a\nb\nc\n'
 
 
+# ----------------------------------------------------------------------
+# TemplateCache
+# ----------------------------------------------------------------------
+
+def test_templatecache_compiles_each_key_once():
+    cache = TemplateCache()
+
+    first = cache.get((1, 1), 'Hello {{ name }}')
+    second = cache.get((1, 1), 'Hello {{ name }}')
+    edited = cache.get((1, 2), 'Goodbye {{ name }}')
+
+    assert first is second
+    assert edited.render(name='Jo') == 'Goodbye Jo'
+    assert cache.stats() == dict(size=2, hits=1, misses=2, evictions=0)
+
+
+def test_templatecache_evicts_least_recently_used():
+    cache = TemplateCache(maxsize=2)
+    cache.get((1, 1), 'a')
+    cache.get((2, 1), 'b')
+    cache.get((1, 1), 'a')
+    cache.get((3, 1), 'c')
+
+    assert cache.get((1, 1), 'a').render() == 'a'
+    assert cache.stats()['evictions'] == 1
+    # (2, 1) was evicted, so it's compiled again
+    misses = cache.stats()['misses']
+    cache.get((2, 1), 'b')
+    assert cache.stats()['misses'] == misses + 1
+
+
+def test_templatecache_invalidate():
+    cache = TemplateCache()
+    cache.get((1, 1), 'a')
+    cache.get((1, 2), 'a2')
+    cache.get((2, 1), 'b')
+
+    cache.invalidate(1)
+
+    assert cache.stats()['size'] == 1
+
+
+def test_contract_edit_invalidates_template(bare_dbapp):
+    contract_templates.clear()
+    contract = Contract(blockPriority=1, block='Hello {{ name }}')
+    db.session.add(contract)
+    db.session.commit()
+    key = templatekey(contract)
+
+    merge = Obj()
+    merge.name = 'Jo'
+    assert ContractManagerTemplate(contract.block, key=key).render(merge) == 'Hello Jo'
+    assert ContractManagerTemplate(contract.block, key=key).template is contract_templates.get(key, contract.block)
+
+    contract.block = 'Goodbye {{ name }}'
+    db.session.commit()
+
+    assert templatekey(contract) != key
+    assert contract_templates.stats()['size'] == 0
+    merge = Obj()
+    merge.name = 'Jo'
+    assert ContractManagerTemplate(contract.block, key=templatekey(contract)).render(merge) == 'Goodbye Jo'
+
+
 # ----------------------------------------------------------------------
 # ContractManager.__init__
 # ----------------------------------------------------------------------
@@ -199,3 +298,54 @@ def test_contractmanager_kwargs_override_defaults():
 def test_contractmanager_invalid_doctype_raises():
     with pytest.raises(parameterError):
         ContractManager(doctype='pdf')
+
+
+# ----------------------------------------------------------------------
+# ContractManager.render
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def invoiceblocks(bare_dbapp):
+    # Contract ids repeat in each test's database
+    contract_registry.clear()
+    contract_templates.clear()
+    services = ContractType(contractType='race services')
+    para = ContractBlockType(blockType='para')
+    invoicestart = ContractBlockType(blockType='invoicestart')
+    invoiceend = ContractBlockType(blockType='invoiceend')
+    contract = TemplateType(templateType='contract')
+    db.session.add_all([
+        Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=1, block='Agreement'),
+        Contract(contractType=services, templateType=contract, contractBlockType=invoicestart, blockPriority=2, block=''),
+        Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=3, block='Invoice'),
+        Contract(contractType=services, templateType=contract, contractBlockType=invoiceend, blockPriority=4, block=''),
+        Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=5, block='Signature'),
+        # invoice block types exist, but this contract doesn't use them
+        Contract(contractType=services, templateType=TemplateType(templateType='plain'), contractBlockType=para,
+                 blockPriority=1, block='Agreement'),
+    ])
+    db.session.commit()
+    yield bare_dbapp
+    contract_registry.clear()
+    contract_templates.clear()
+
+
+def rendered_paras(templateType, is_quote):
+    cm = ContractManager(contractType='race services', templateType=templateType)
+    drivename, path = cm.render('doc', Obj(), is_quote=is_quote)
+    paras = [para.text for para in Document(path).paragraphs]
+    rmtree(os.path.dirname(path))
+    return paras
+
+
+def test_render_quote_skips_invoice_markers(invoiceblocks):
+    assert rendered_paras('contract', True) == ['Agreement', 'Invoice', 'Signature']
+
+
+def test_render_invoice_between_markers(invoiceblocks):
+    assert rendered_paras('contract', False) == ['Invoice']
+
+
+def test_render_invoice_without_markers_is_empty(invoiceblocks):
+    # trimming depends on the invoicestart and invoiceend block types existing, not the contract using them
+    assert rendered_paras('plain', False) == []
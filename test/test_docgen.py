@@ -0,0 +1,115 @@
+'''
+test_docgen - test contracts.docgen
+=========================================================
+'''
+
+# standard
+import os
+
+# pypi
+import pytest
+from flask import Flask
+from docx import Document
+
+# homegrown
+from contracts import driveupload
+from contracts.contractmanager import contract_templates
+from contracts.contractblocks import contract_registry
+from contracts.docgen import generate_docs
+from contracts.dbmodel import db, Event, Race, Client, State, Service, FeeType
+from contracts.dbmodel import Contract, ContractType, TemplateType, ContractBlockType
+
+
+class FakeGoogleAuthService():
+    '''records uploads instead of sending them to google drive'''
+    uploads = []
+
+    def __init__(self, keyfile, scopes):
+        pass
+
+    def create_file(self, folder, name, path, doctype=None):
+        self.uploads.append((name, Document(path).paragraphs[0].text))
+        return f'doc-{name}'
+
+    def set_permission(self, fid, permission):
+        pass
+
+
+def configure(app):
+    app.config.update(CONTRACTS_DB_FOLDER='folder', GSUITE_SERVICE_KEY_FILE='key.json', GSUITE_SCOPES=[])
+
+
+def populate():
+    services = ContractType(contractType='race services')
+    contract = TemplateType(templateType='contract')
+    para = ContractBlockType(blockType='para')
+    db.session.add(Contract(contractType=services, templateType=contract, contractBlockType=para, blockPriority=1,
+                            block='{{ doctype }} for {{ event }}, total ${{ totalfees.fee }}'))
+    committed = State(state='committed')
+    fixed = FeeType(feeType='fixed')
+    timing = Service(service='chiptiming', serviceLong='Chip Timing', feeType=fixed, fee=500, priority=1)
+    client = Client(client='Running Club')
+    events = [Event(race=Race(race=f'Race {i}'), client=client, date=f'2026-06-0{i}', state=committed,
+                    services=[timing]) for i in range(1, 4)]
+    # fee can't be calculated for this event
+    basedon = FeeType(feeType='basedOnField')
+    events.append(Event(race=Race(race='Race 4'), client=client, date='2026-06-04', state=committed,
+                        services=[Service(service='basic', serviceLong='Basic', feeType=basedon,
+                                          basedOnField='finishersPrevYear', priority=2)]))
+    db.session.add_all(events)
+    db.session.commit()
+    return [e.id for e in events]
+
+
+@pytest.fixture
+def fakedrive(monkeypatch):
+    FakeGoogleAuthService.uploads = []
+    monkeypatch.setattr(driveupload, 'GoogleAuthService', FakeGoogleAuthService)
+    # Contract ids repeat in each test's database
+    contract_registry.clear()
+    contract_templates.clear()
+    yield FakeGoogleAuthService
+    contract_registry.clear()
+    contract_templates.clear()
+
+
+def check_results(results, event_ids, fakedrive):
+    assert [r['event_id'] for r in results] == event_ids
+    assert [r['docid'] for r in results] == ['doc-Running Club-Race 1-2026-06-01', 'doc-Running Club-Race 2-2026-06-02',
+                                             'doc-Running Club-Race 3-2026-06-03', None]
+    assert 'finishersPrevYear' in results[3]['error']
+    for result in results[:3]:
+        assert result['render'] > 0 and result['upload'] >= 0 and result['permission'] >= 0
+    assert sorted(fakedrive.uploads)[0] == ('Running Club-Race 1-2026-06-01', 'INVOICE for Race 1, total $500.00')
+
+    events = Event.query.order_by(Event.id).all()
+    assert [e.invoiceDocId for e in events] == [r['docid'] for r in results]
+    assert events[0].isInvoiceInitiated == False
+
+
+def test_generate_docs_in_process(bare_dbapp, fakedrive):
+    configure(bare_dbapp)
+    event_ids = populate()
+
+    results = generate_docs(event_ids, is_quote=False, workers=0, uploaders=2)
+    db.session.commit()
+
+    check_results(results, event_ids, fakedrive)
+
+
+def test_generate_docs_worker_processes(tmp_path, fakedrive):
+    # worker processes need a database they can open, so an in-memory database won't do
+    app = Flask('contracts')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(tmp_path, "contracts.db")}'
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite:///:memory:'}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure(app)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        event_ids = populate()
+
+        results = generate_docs(event_ids, is_quote=False, workers=2, uploaders=2)
+        db.session.commit()
+
+        check_results(results, event_ids, fakedrive)
@@ -0,0 +1,220 @@
+'''
+test_driveupload - test contracts.driveupload
+=========================================================
+'''
+
+# standard
+import os
+from time import time, sleep
+from tempfile import mkdtemp
+
+# pypi
+import pytest
+from flask import Flask
+
+# homegrown
+from contracts.driveupload import LocalDriveService, enqueue_upload, process_uploads, latest_upload
+from contracts.driveupload import retry_failed_uploads, latest_uploads, upload_status
+from contracts.contractmanager import ContractManager, contract_templates
+from contracts.contractblocks import contract_registry
+from contracts.dbmodel import db, Event, Race, Client, DocUpload
+from contracts.dbmodel import Contract, ContractType, TemplateType, ContractBlockType
+from contracts.dbmodel import UPLOAD_PENDING, UPLOAD_DONE, UPLOAD_FAILED
+
+
+def configure(app, drive):
+    app.config.update(CONTRACTS_DB_FOLDER='folder', CONTRACTS_LOCAL_DRIVE=str(drive), CONTRACTS_UPLOAD_WORKER=False)
+
+
+def rendered():
+    '''return path of a rendered document in its own temporary folder, as ContractManager.render() leaves it'''
+    path = os.path.join(mkdtemp(prefix='contracts_'), 'doc.docx')
+    with open(path, 'w') as doc:
+        doc.write('document')
+    return path
+
+
+def drivefiles(drive):
+    folder = os.path.join(drive, 'folder')
+    return sorted(os.listdir(folder)) if os.path.exists(folder) else []
+
+
+@pytest.fixture
+def event(bare_dbapp, tmp_path):
+    configure(bare_dbapp, tmp_path)
+    event = Event(race=Race(race='Race 1'), client=Client(client='Running Club'), date='2026-06-01')
+    db.session.add(event)
+    db.session.commit()
+    yield event
+
+
+def test_create_queues_upload(event, tmp_path):
+    # Contract ids repeat in each test's database
+    contract_registry.clear()
+    contract_templates.clear()
+    db.session.add(Contract(contractType=ContractType(contractType='race services'),
+                            templateType=TemplateType(templateType='contract'),
+                            contractBlockType=ContractBlockType(blockType='para'), blockPriority=1, block='Agreement'))
+    db.session.commit()
+    cm = ContractManager(contractType='race services', templateType='contract', driveFolderId='folder')
+
+    jobid = cm.create('Running Club-Race 1-2026-06-01', event, uploadfor=(event, 'contractDocId'))
+    db.session.commit()
+
+    # rendered document is kept in the queue, so any worker can upload it
+    job = db.session.get(DocUpload, jobid)
+    assert job.status == UPLOAD_PENDING
+    assert job.filename.endswith('.docx') and job.document.startswith(b'PK')
+    assert event.contractDocId is None
+    assert drivefiles(tmp_path) == []
+
+    assert process_uploads() == [jobid]
+
+    job = db.session.get(DocUpload, jobid)
+    assert job.status == UPLOAD_DONE
+    assert db.session.get(Event, event.id).contractDocId == job.docid
+    assert drivefiles(tmp_path) == [f'{job.docid}.docx']
+    assert job.document is None
+    assert process_uploads() == []
+    contract_registry.clear()
+    contract_templates.clear()
+
+
+def test_upload_retries(event, tmp_path, monkeypatch):
+    create_file = LocalDriveService.create_file
+    failures = []
+    def flaky(self, folder, name, path, doctype=None):
+        if len(failures) < 2:
+            failures.append(name)
+            raise ConnectionError('drive unavailable')
+        return create_file(self, folder, name, path, doctype)
+    monkeypatch.setattr(LocalDriveService, 'create_file', flaky)
+
+    now = int(time())
+    jobid = enqueue_upload('contract', rendered(), event, 'contractDocId')
+    db.session.commit()
+
+    assert process_uploads(now) == [jobid]
+    job = db.session.get(DocUpload, jobid)
+    assert (job.status, job.attempts, job.next_try_ts) == (UPLOAD_PENDING, 1, now + 30)
+    assert 'drive unavailable' in job.lasterror
+
+    # not due yet
+    assert process_uploads(now + 29) == []
+
+    # backoff doubles
+    assert process_uploads(now + 30) == [jobid]
+    assert db.session.get(DocUpload, jobid).next_try_ts == now + 30 + 60
+
+    assert process_uploads(now + 90) == [jobid]
+    job = db.session.get(DocUpload, jobid)
+    assert (job.status, job.attempts, job.lasterror) == (UPLOAD_DONE, 2, None)
+    assert db.session.get(Event, event.id).contractDocId == job.docid
+
+
+def test_upload_fails_after_max_attempts(event, bare_dbapp, monkeypatch):
+    bare_dbapp.config.update(UPLOAD_MAXATTEMPTS=2, UPLOAD_RETRYDELAY=0)
+    def broken(self, folder, name, path, doctype=None):
+        raise ConnectionError('drive unavailable')
+    monkeypatch.setattr(LocalDriveService, 'create_file', broken)
+
+    jobid = enqueue_upload('invoice', rendered(), event, 'invoiceDocId')
+    db.session.commit()
+    process_uploads()
+    process_uploads()
+
+    job = latest_upload(event, 'invoiceDocId')
+    assert (job.id, job.status, job.attempts) == (jobid, UPLOAD_FAILED, 2)
+    assert job.document == b'document'
+    assert process_uploads() == []
+
+    monkeypatch.undo()
+    assert retry_failed_uploads() == 1
+    db.session.commit()
+    assert process_uploads() == [jobid]
+    assert db.session.get(Event, event.id).invoiceDocId == db.session.get(DocUpload, jobid).docid
+
+
+def test_enqueue_removes_rendered_file(event, tmp_path):
+    path = rendered()
+    jobid = enqueue_upload('contract', path, event, 'contractDocId')
+    db.session.commit()
+
+    assert not os.path.exists(os.path.dirname(path))
+    assert process_uploads() == [jobid]
+    job = db.session.get(DocUpload, jobid)
+    with open(os.path.join(tmp_path, 'folder', f'{job.docid}.docx')) as doc:
+        assert doc.read() == 'document'
+
+
+def test_older_upload_does_not_replace_newer(event):
+    older = enqueue_upload('contract v1', rendered(), event, 'contractDocId')
+    newer = enqueue_upload('contract v2', rendered(), event, 'contractDocId')
+    db.session.commit()
+
+    # older job is abandoned mid-upload, and is picked up again after the newer job is done
+    now = int(time())
+    DocUpload.query.filter_by(id=older).update({'status': 'uploading', 'claimed_ts': now})
+    db.session.commit()
+    assert process_uploads(now) == [newer]
+    assert process_uploads(now + 601) == [older]
+
+    assert db.session.get(Event, event.id).contractDocId == db.session.get(DocUpload, newer).docid
+
+
+def test_upload_status(event, bare_dbapp, monkeypatch):
+    bare_dbapp.config.update(UPLOAD_MAXATTEMPTS=1)
+    def broken(self, folder, name, path, doctype=None):
+        raise ConnectionError('drive unavailable')
+    monkeypatch.setattr(LocalDriveService, 'create_file', broken)
+
+    enqueue_upload('contract v1', rendered(), event, 'contractDocId')
+    contract = enqueue_upload('contract v2', rendered(), event, 'contractDocId')
+    invoice = enqueue_upload('invoice', rendered(), event, 'invoiceDocId')
+    db.session.commit()
+    with bare_dbapp.test_request_context('/admin/events'):
+        uploads = latest_uploads(Event)
+        assert uploads[(event.id, 'contractDocId')].id == contract
+        assert upload_status(uploads[(event.id, 'contractDocId')]) == 'uploading, reload page to see document'
+        assert upload_status(uploads.get((0, 'contractDocId'))) == ''
+
+    process_uploads()
+    with bare_dbapp.test_request_context('/admin/events'):
+        job = latest_uploads(Event)[(event.id, 'invoiceDocId')]
+        assert job.id == invoice
+        assert upload_status(job) == 'upload failed, create document again: ConnectionError: drive unavailable'
+
+    monkeypatch.undo()
+    retry_failed_uploads()
+    db.session.commit()
+    process_uploads()
+    with bare_dbapp.test_request_context('/admin/events'):
+        assert upload_status(latest_uploads(Event)[(event.id, 'invoiceDocId')]) == ''
+
+
+def test_upload_worker(tmp_path):
+    # the worker thread needs its own database connection, so an in-memory database won't do
+    app = Flask('contracts')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(tmp_path, "contracts.db")}'
+    app.config['SQLALCHEMY_BINDS'] = {'users': 'sqlite:///:memory:'}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure(app, tmp_path)
+    app.config['CONTRACTS_UPLOAD_WORKER'] = True
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        event = Event(date='2026-06-01')
+        db.session.add(event)
+        db.session.commit()
+
+        jobid = enqueue_upload('contract', rendered(), event, 'contractDocId')
+        db.session.commit()
+
+        for i in range(100):
+            db.session.rollback()
+            job = db.session.get(DocUpload, jobid)
+            if job.status == UPLOAD_DONE:
+                break
+            sleep(0.05)
+        assert job.status == UPLOAD_DONE
+        assert db.session.get(Event, event.id).contractDocId == job.docid
@@ -51,3 +51,18 @@ def test_make_runsignup_client_missing_config_raises(app):
     with app.app_context():
         with pytest.raises(KeyError):
             make_runsignup_client()
+
+
+def test_make_runsignup_client_concurrency_default(app):
+    with app.app_context():
+        client = make_runsignup_client()
+
+    assert client.concurrency == 1
+
+
+def test_make_runsignup_client_concurrency_from_config(app):
+    app.config['RSU_CONCURRENCY'] = 4
+    with app.app_context():
+        client = make_runsignup_client()
+
+    assert client.concurrency == 4
@@ -0,0 +1,212 @@
+'''
+test_racessummary - test contracts.views.admin.racessummary
+=========================================================
+'''
+
+# standard
+import json
+from datetime import date
+from types import SimpleNamespace
+
+# pypi
+import pytest
+from flask import Flask
+
+# homegrown
+from contracts import caching
+from contracts.views.admin import racessummary, common
+from contracts.views.admin.racessummary import raceregistrations_view, RaceRegistrationCurvesApi
+from contracts.dbmodel import db, SponsorRace, SponsorRaceRegCount
+
+
+RACEDATA = {
+    'Test Race': {
+        '5K': {'event_id': 11, 'dates': {
+            '2026-06-01': {'regopendate': '2026-01-01', 'regcounts': {'2026-01-02': 2, '2026-01-03': 1}},
+            '2025-06-01': {'regcounts': {'2025-01-05': 4}},
+            '2024-06-01': {'regcounts': {}},
+        }},
+    },
+}
+
+
+def drain(view):
+    rows = []
+    try:
+        while True:
+            rows.append(view.nexttablerow())
+    except StopIteration:
+        pass
+    return rows
+
+
+def test_nexttablerow_emits_rows_in_order():
+    raceregistrations_view.rows = raceregistrations_view._regrows(RACEDATA)
+
+    rows = drain(raceregistrations_view)
+
+    assert [(r['race_date'], r['regopen_date'], r['registration_date'], r['count']) for r in rows] == [
+        ('2026-06-01', '2026-01-01', '2026-01-02', 2),
+        ('2026-06-01', '2026-01-01', '2026-01-03', 1),
+        # registration open is guessed from the earliest registration
+        ('2025-06-01', '2025-01-05', '2025-01-05', 4),
+    ]
+    # exhausted
+    assert drain(raceregistrations_view) == []
+
+
+def test_retrieverows_streams_json(monkeypatch):
+    app = Flask('contracts')
+    view = raceregistrations_view
+    monkeypatch.setattr(view, 'init', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'permission', lambda: True, raising=False)
+    monkeypatch.setattr(view, 'beforequery', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'open', lambda: setattr(view, 'rows', view._regrows(RACEDATA)), raising=False)
+
+    with app.test_request_context('/admin/raceregistrations/rest'):
+        response = view._retrieverows()
+        assert response.is_streamed
+        body = ''.join(response.response)
+
+    assert response.mimetype == 'application/json'
+    assert [r['count'] for r in json.loads(body)] == [2, 1, 4]
+
+
+def test_retrieverows_streams_empty_list(monkeypatch):
+    app = Flask('contracts')
+    view = raceregistrations_view
+    monkeypatch.setattr(view, 'init', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'permission', lambda: True, raising=False)
+    monkeypatch.setattr(view, 'beforequery', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'open', lambda: setattr(view, 'rows', iter([])), raising=False)
+
+    with app.test_request_context('/admin/raceregistrations/rest'):
+        body = ''.join(view._retrieverows().response)
+
+    assert json.loads(body) == []
+
+
+def test_retrieverows_rolls_back_error_while_streaming(monkeypatch):
+    app = Flask('contracts')
+    view = raceregistrations_view
+    def badrows():
+        yield {'count': 1}
+        raise ValueError('bad row')
+    rolledback = []
+    monkeypatch.setattr(view, 'init', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'permission', lambda: True, raising=False)
+    monkeypatch.setattr(view, 'beforequery', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'open', lambda: setattr(view, 'rows', badrows()), raising=False)
+    monkeypatch.setattr(view, 'rollback', lambda: rolledback.append(True), raising=False)
+
+    with app.test_request_context('/admin/raceregistrations/rest'):
+        chunks = iter(view._retrieverows().response)
+        assert next(chunks) == '['
+        assert next(chunks) == '{"count": 1}'
+        with pytest.raises(ValueError):
+            next(chunks)
+
+    assert rolledback == [True]
+
+
+def test_retrieverows_returns_output_result(monkeypatch):
+    # e.g., serverside tables, where open() produces the whole response
+    app = Flask('contracts')
+    view = raceregistrations_view
+    monkeypatch.setattr(view, 'init', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'permission', lambda: True, raising=False)
+    monkeypatch.setattr(view, 'beforequery', lambda: None, raising=False)
+    monkeypatch.setattr(view, 'open', lambda: setattr(view, 'output_result', {'data': []}), raising=False)
+    monkeypatch.setattr(view, 'responsekeys', {'draw': 1}, raising=False)
+
+    with app.test_request_context('/admin/raceregistrations/rest'):
+        response = view._retrieverows()
+        assert not response.is_streamed
+        assert response.get_json() == {'data': [], 'draw': 1}
+
+
+@pytest.fixture
+def race(bare_dbapp, monkeypatch, tmp_path):
+    monkeypatch.setattr(caching, 'REGCACHE_LOCKFILE', str(tmp_path / 'regcache_{}.lock'))
+    race = SponsorRace(race='Race A', couponprovider='RunSignUp', couponproviderid='100', display=True,
+                       cacheupdatets=1000)
+    db.session.add(race)
+    db.session.commit()
+    return race
+
+
+def versiontoken(app, race):
+    with app.test_request_context(f'/admin/raceregistrations/rest?race={race.id}'):
+        return raceregistrations_view.versiontoken()
+
+
+def test_notmodified_starts_refresh(bare_dbapp, race, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(racessummary, 'refresh_raceregcache_background', lambda *args, **kwargs: refreshes.append(args))
+    monkeypatch.setattr(common, 'current_user', SimpleNamespace(id=5, is_authenticated=True))
+    monkeypatch.setattr(raceregistrations_view, 'permission', lambda: True)
+
+    # client's copy is current, but the race's cache is stale
+    with bare_dbapp.test_request_context(f'/admin/raceregistrations/rest?race={race.id}',
+                                         headers={'If-Modified-Since': 'Sun, 18 Oct 2026 12:00:00 GMT'}):
+        response = raceregistrations_view.get()
+
+    assert response.status_code == 304
+    assert refreshes == [('100',)]
+
+
+def test_versiontoken_depends_only_on_data_state(bare_dbapp, race, monkeypatch):
+    monkeypatch.setattr(racessummary, 'refresh_raceregcache_background', lambda *args, **kwargs: False)
+    token, lastmodified = versiontoken(bare_dbapp, race)
+
+    # minutes passing don't change the token
+    monkeypatch.setattr(racessummary, 'time', lambda: 1000 + 3600)
+    assert versiontoken(bare_dbapp, race)[0] == token
+
+    refreshing = racessummary.raceregcache_refreshing
+    monkeypatch.setattr(racessummary, 'raceregcache_refreshing', lambda race_id: True)
+    assert versiontoken(bare_dbapp, race)[0] != token
+    monkeypatch.setattr(racessummary, 'raceregcache_refreshing', refreshing)
+
+    race.cacheupdatets = 2000
+    db.session.commit()
+    assert versiontoken(bare_dbapp, race)[0] != token
+
+
+class FakeRsu():
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        pass
+    def getraceevents(self, race_id):
+        return [{'event_id': 11, 'name': '5K', 'start_time': '6/1/2026 08:00', 'end_time': None}]
+
+
+def curves(app, race, args):
+    with app.test_request_context(f'/admin/raceregistrations/curves?race={race.id}&{args}'):
+        response = RaceRegistrationCurvesApi().get()
+    return response if isinstance(response, tuple) else (response, 200)
+
+
+def test_curves_selected_events(bare_dbapp, race, monkeypatch):
+    monkeypatch.setattr(racessummary, 'make_runsignup_client', FakeRsu)
+    db.session.add(SponsorRaceRegCount(race_id=race.id, event_id=11, registration_day=date(2026, 5, 31), regcount=2))
+    db.session.commit()
+
+    response, status = curves(bare_dbapp, race, 'events=11')
+    assert status == 200
+    assert response.get_json()['cumulative'] == [[2, 2]]
+
+    # none of the requested events are the race's
+    response, status = curves(bare_dbapp, race, 'events=99')
+    assert status == 200
+    assert response.get_json()['years'] == []
+
+
+def test_curves_invalid_events(bare_dbapp, race, monkeypatch):
+    monkeypatch.setattr(racessummary, 'make_runsignup_client', FakeRsu)
+
+    response, status = curves(bare_dbapp, race, 'events=11,x')
+
+    assert status == 400
+    assert response.get_json() == {'error': 'invalid events'}
@@ -0,0 +1,143 @@
+'''
+test_regcurves - test contracts.regcurves
+=========================================================
+'''
+
+# standard
+from datetime import date, datetime, timedelta
+from random import Random
+
+# pypi
+import numpy as np
+import pytest
+
+# homegrown
+from contracts.regcurves import registration_curves, race_registration_curves
+from contracts import snapshot
+from contracts.snapshot import dayindex, write_regsnapshot
+from contracts.dbmodel import db, SponsorRace, SponsorRaceRegCache, SponsorRaceRegCount
+
+
+def days(*dates):
+    return [dayindex(d) for d in dates]
+
+
+def reference_curves(regdates, racedates):
+    '''straightforward python version: {year: {daysbefore: cumulative}}'''
+    perday = {}
+    for regdate, racedate in zip(regdates, racedates):
+        before = max((racedate - regdate).days, 0)
+        year = perday.setdefault(racedate.year, {})
+        year[before] = year.get(before, 0) + 1
+    maxdays = max(max(year) for year in perday.values())
+    curves = {}
+    for year, counts in perday.items():
+        total = 0
+        curves[year] = []
+        for before in range(maxdays, -1, -1):
+            total += counts.get(before, 0)
+            curves[year].append(total)
+    return curves
+
+
+def test_registration_curves_aligned_by_days_before():
+    race25, race26 = date(2025, 6, 1), date(2026, 6, 7)
+    regdates = [race25 - timedelta(3), race25 - timedelta(1), race25 - timedelta(1), race25 + timedelta(1),
+                race26 - timedelta(2), race26 - timedelta(1)]
+    racedates = [race25] * 4 + [race26] * 2
+
+    curves = registration_curves(days(*regdates), days(*racedates), today=date(2026, 6, 6))
+
+    assert curves['years'] == [2026, 2025]
+    assert curves['daysbefore'].tolist() == [3, 2, 1, 0]
+    # registration after race day counts on race day
+    assert curves['cumulative'].tolist() == [[0, 1, 2, 2], [1, 1, 3, 4]]
+    assert curves['pace'][0] == 0
+    # today is 1 day before the 2026 race
+    assert curves['currentpace'] == pytest.approx(2/3)
+
+
+def test_registration_curves_matches_reference():
+    rand = Random(1)
+    racedates = [date(year, 6, 1) for year in range(2016, 2027) for i in range(300)]
+    regdates = [racedate - timedelta(rand.randint(0, 200)) for racedate in racedates]
+
+    curves = registration_curves(days(*regdates), days(*racedates))
+    reference = reference_curves(regdates, racedates)
+
+    assert curves['years'] == sorted(reference, reverse=True)
+    for row, year in zip(curves['cumulative'].tolist(), curves['years']):
+        assert row == reference[year]
+
+
+def test_registration_curves_counts_and_numyears():
+    racedates = days(date(2024, 6, 1), date(2025, 6, 1), date(2026, 6, 1))
+    regdays = [r - 10 for r in racedates]
+
+    curves = registration_curves(regdays, racedates, counts=[5, 7, 3], numyears=2, today=date(2026, 7, 1))
+
+    assert curves['years'] == [2026, 2025]
+    assert curves['cumulative'][:, -1].tolist() == [3, 7]
+    # race is over, so pace is at race day
+    assert curves['currentpace'] == pytest.approx(3/7)
+
+
+def test_registration_curves_single_year_and_empty():
+    curves = registration_curves(days(date(2026, 5, 1)), days(date(2026, 6, 1)))
+    assert curves['years'] == [2026]
+    assert curves['pace'] is None
+    assert curves['currentpace'] is None
+
+    curves = registration_curves([], [])
+    assert curves['years'] == []
+    assert curves['cumulative'].shape == (0, 0)
+
+
+@pytest.fixture
+def race(bare_dbapp, tmp_path):
+    bare_dbapp.config['REGCACHE_SNAPSHOT_DIR'] = str(tmp_path)
+    race = SponsorRace(race='Test Race', couponprovider='RunSignUp', couponproviderid='1234',
+                       display=True, timezone='America/New_York')
+    db.session.add(race)
+    db.session.commit()
+    return race
+
+
+RACEDATES = {11: ('5K', date(2025, 6, 1)), 21: ('5K', date(2026, 6, 1)), 22: ('10K', date(2026, 6, 1))}
+
+
+def test_race_registration_curves_from_daily_counts(race):
+    db.session.add_all([
+        SponsorRaceRegCount(race_id=race.id, event_id=11, registration_day=date(2025, 5, 30), regcount=4),
+        SponsorRaceRegCount(race_id=race.id, event_id=21, registration_day=date(2026, 5, 30), regcount=1),
+        SponsorRaceRegCount(race_id=race.id, event_id=22, registration_day=date(2026, 5, 31), regcount=2),
+    ])
+    db.session.commit()
+
+    curves = race_registration_curves(race, RACEDATES, today=date(2026, 5, 31))
+
+    assert curves['years'] == [2026, 2025]
+    assert curves['daysbefore'].tolist() == [2, 1, 0]
+    assert curves['cumulative'].tolist() == [[1, 3, 3], [4, 4, 4]]
+    assert curves['currentpace'] == pytest.approx(3/4)
+
+    curves = race_registration_curves(race, RACEDATES, event_ids=[11, 21])
+    assert curves['cumulative'].tolist() == [[1, 1, 1], [4, 4, 4]]
+
+
+def test_race_registration_curves_from_snapshot(race, monkeypatch):
+    db.session.add_all([SponsorRaceRegCache(registration_id=regid, event_id=event_id, registration_date=regdate,
+                                            is_active=is_active)
+                        for regid, event_id, regdate, is_active in [
+                            (1, 11, datetime(2025, 5, 30, 10), True),
+                            (2, 11, datetime(2025, 5, 31, 10), False),
+                            (3, 21, datetime(2026, 5, 31, 10), True),
+                        ]])
+    db.session.commit()
+    write_regsnapshot(race, RACEDATES)
+    monkeypatch.setitem(snapshot.current_app.config, 'REGCACHE_SNAPSHOT_MAXAGE', 60)
+
+    curves = race_registration_curves(race, RACEDATES)
+
+    # no daily counts rows, so these came from the snapshot
+    assert curves['cumulative'].tolist() == [[0, 1, 1], [1, 1, 1]]
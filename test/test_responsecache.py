@@ -0,0 +1,125 @@
+'''
+test_responsecache - test contracts.responsecache
+=========================================================
+'''
+
+# pypi
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+# homegrown
+from contracts import responsecache
+from contracts.responsecache import cachekey, LRUResponseCache, DbResponseCache, TieredResponseCache
+from contracts.dbmodel import db, RsuResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''control responsecache's time(); set clock.now'''
+    class Clock():
+        now = 1000000
+    clock = Clock()
+    monkeypatch.setattr(responsecache, 'time', lambda: clock.now)
+    return clock
+
+
+def test_cachekey_depends_on_url_and_params():
+    assert cachekey('http://x/race/1', {'a': 1, 'b': 2}) == cachekey('http://x/race/1', {'b': 2, 'a': 1})
+    assert cachekey('http://x/race/1', {'a': 1}) != cachekey('http://x/race/2', {'a': 1})
+    assert cachekey('http://x/race/1', {'a': 1}) != cachekey('http://x/race/1', {'a': 2})
+
+
+def test_lru_hit_miss_expire(clock):
+    cache = LRUResponseCache()
+    assert cache.get('k') is None
+    cache.set('k', 'value', 10)
+    assert cache.get('k') == 'value'
+
+    clock.now += 10
+    assert cache.get('k') is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = LRUResponseCache(maxsize=2)
+    cache.set('a', '1', 10)
+    cache.set('b', '2', 10)
+    cache.get('a')
+    cache.set('c', '3', 10)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+    assert cache.evictions == 1
+
+
+def test_db_hit_miss_expire(bare_dbapp, clock):
+    cache = DbResponseCache()
+    assert cache.get('k') is None
+    cache.set('k', 'value', 10)
+    cache.set('k', 'newvalue', 10)
+    assert cache.get('k') == 'newvalue'
+    assert RsuResponseCache.query.count() == 1
+
+    clock.now += 10
+    assert cache.get('k') is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_db_set_replaces_entry_cached_by_other_process(bare_dbapp, clock):
+    cache = DbResponseCache()
+    with db.engine.begin() as conn:
+        conn.execute(RsuResponseCache.__table__.insert().values(cachekey='k', response='other', expires=clock.now + 10))
+
+    cache.set('k', 'value', 10)
+
+    assert cache.get('k') == 'value'
+    assert RsuResponseCache.query.count() == 1
+
+
+def test_db_set_error_doesnt_raise(bare_dbapp, clock, monkeypatch):
+    cache = DbResponseCache()
+    def collide(conn, key, value, expires):
+        raise IntegrityError('INSERT', {}, Exception('duplicate cachekey'))
+    monkeypatch.setattr(cache, '_upsert', collide)
+
+    cache.set('k', 'value', 10)
+
+    assert cache.get('k') is None
+
+
+def test_db_evicts_expired_then_soonest(bare_dbapp, clock):
+    cache = DbResponseCache(maxsize=2)
+    cache.set('expired', '0', 1)
+    cache.set('soon', '1', 20)
+    clock.now += 5
+    cache.set('later', '2', 30)
+    cache.set('latest', '3', 40)
+
+    assert sorted(r.cachekey for r in RsuResponseCache.query.all()) == ['later', 'latest']
+    assert cache.evictions == 2
+
+
+def test_db_cache_doesnt_touch_session(bare_dbapp, clock):
+    cache = DbResponseCache()
+    cache.set('k', 'value', 10)
+    db.session.rollback()
+
+    assert cache.get('k') == 'value'
+
+
+def test_tiered_fills_local_from_shared(bare_dbapp, clock):
+    shared = DbResponseCache()
+    shared.set('k', 'value', 100)
+    cache = TieredResponseCache(LRUResponseCache(), shared, localttl=5)
+
+    assert cache.get('k') == 'value'
+    assert cache.get('k') == 'value'
+    assert shared.stats()['hits'] == 1
+    assert cache.local.stats()['hits'] == 1
+
+    # local copy expires before the shared one
+    clock.now += 5
+    assert cache.get('k') == 'value'
+    assert shared.stats()['hits'] == 2
+    assert cache.stats()['hits'] == 3
@@ -4,19 +4,35 @@
 #       Date            Author          Reason
 #       ----            ------          ------
 #       07/31/26        Lou King        Create, covering the RunSignupBase refactor
+#       10/18/26        Lou King        concurrent page fetching, against local stub server
+#       10/18/26        Lou King        iterator variants of paged methods
+#       10/18/26        Lou King        response cache for GET methods
+#       10/18/26        Lou King        request scheduler
 #
 #   Copyright 2026 Lou King.  All rights reserved
 ###########################################################################################
 
 # standard
 from unittest.mock import Mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+from json import dumps
+from time import sleep, time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 
 # pypi
 import pytest
-from flask import Flask
+from flask import Flask, has_app_context
 
 # homegrown
+from contracts import runsignup
 from contracts.runsignup import RunSignUp, coupons_url, race_url, raceparticipants_url, removedparticipants_url
+from contracts.responsecache import LRUResponseCache
+from contracts.runsignup import TokenBucket, RequestScheduler
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 from running.runsignup import RunSignupBase, accessError
 
 
@@ -123,6 +139,116 @@ def test_setcoupon_builds_request_payload(rsu, monkeypatch):
     assert coupon['coupon_notes'] == 'Acme Race'
 
 
+class FakeCouponPost():
+    '''records coupons POSTs, and returns coupons with coupon_ids assigned'''
+    def __init__(self):
+        self.requests = []
+        self.nextid = 1000
+
+    def __call__(self, methodurl, **params):
+        from json import loads
+        coupons = loads(params['request'])['coupons']
+        self.requests.append(coupons)
+        result = []
+        for coupon in coupons:
+            coupon_id = coupon['coupon_id']
+            if coupon_id is None:
+                coupon_id = self.nextid
+                self.nextid += 1
+            result.append({'coupon_id': coupon_id, 'coupon_code': coupon['coupon_code']})
+        return {'coupons': result}
+
+
+def test_setcoupons_chunks_posts(rsu, monkeypatch):
+    post = FakeCouponPost()
+    monkeypatch.setattr(rsu, '_rsupost', post)
+    coupons = [runsignup.couponspec(f'CODE{i}', '2026-01-01', '2026-12-31', 2, f'Client {i}') for i in range(7)]
+
+    result = rsu.setcoupons(12345, coupons, chunksize=3)
+
+    assert [len(r) for r in post.requests] == [3, 3, 1]
+    assert [c['coupon_code'] for c in result] == [f'CODE{i}' for i in range(7)]
+    assert [c['coupon_id'] for c in result] == list(range(1000, 1007))
+
+
+def test_setcoupons_empty(rsu, monkeypatch):
+    post = FakeCouponPost()
+    monkeypatch.setattr(rsu, '_rsupost', post)
+
+    assert rsu.setcoupons(12345, []) == []
+    assert post.requests == []
+
+
+def test_couponrequest_wraps_couponspec():
+    request = runsignup.couponrequest('MYCODE', '2026-01-01', '2026-12-31', 5, 'Acme Race', coupon_id=42)
+    assert request == {'coupons': [runsignup.couponspec('MYCODE', '2026-01-01', '2026-12-31', 5, 'Acme Race', coupon_id=42)]}
+
+
+def test_synccoupons_sends_only_changed(rsu, monkeypatch):
+    current = [
+        # unchanged
+        {'coupon_id': 1, 'coupon_code': 'SAME', 'start_date': '2025-11-01 00:00:00', 'end_date': '2026-12-31 23:59:59',
+         'max_num_race_registrants': 2, 'coupon_notes': 'Same Client'},
+        # numregistrations changed
+        {'coupon_id': 2, 'coupon_code': 'MORE', 'start_date': '2025-11-02 00:00:00', 'end_date': '2026-12-31 23:59:59',
+         'max_num_race_registrants': 2, 'coupon_notes': 'More Client'},
+        # superseded by the next entry with the same code
+        {'coupon_id': 3, 'coupon_code': 'DUP', 'start_date': '2025-11-03 00:00:00', 'end_date': '2025-12-31 23:59:59',
+         'max_num_race_registrants': 2, 'coupon_notes': 'Dup Client'},
+        {'coupon_id': 4, 'coupon_code': 'DUP', 'start_date': '2025-11-04 00:00:00', 'end_date': '2026-12-31 23:59:59',
+         'max_num_race_registrants': 2, 'coupon_notes': 'Dup Client'},
+        # not in the sync
+        {'coupon_id': 5, 'coupon_code': 'OTHER', 'start_date': '2025-11-05 00:00:00', 'end_date': '2026-12-31 23:59:59',
+         'max_num_race_registrants': 2, 'coupon_notes': 'Other Client'},
+    ]
+    gets = []
+    def fake_getcoupons(race_id, coupon_code=None):
+        gets.append(coupon_code)
+        return current
+    monkeypatch.setattr(rsu, 'getcoupons', fake_getcoupons)
+    post = FakeCouponPost()
+    monkeypatch.setattr(rsu, '_rsupost', post)
+
+    coupons = [
+        runsignup.couponspec('SAME', '2026-01-01', '2026-12-31', 2, 'Same Client'),
+        runsignup.couponspec('MORE', '2026-01-01', '2026-12-31', 4, 'More Client'),
+        runsignup.couponspec('DUP', '2026-01-01', '2026-12-31', 2, 'Dup Client'),
+        runsignup.couponspec('NEW', '2026-01-01', '2026-12-31', 2, 'New Client'),
+    ]
+    synced, sent = rsu.synccoupons(12345, coupons)
+
+    # all coupons fetched with one query
+    assert gets == [None]
+    assert sent == ['MORE', 'NEW']
+    assert len(post.requests) == 1
+    more, new = post.requests[0]
+    # existing coupon is edited, keeping its start date
+    assert more['coupon_id'] == 2
+    assert more['start_date'] == '2025-11-02 00:00:00'
+    assert more['max_num_race_registrants'] == 4
+    assert new['coupon_id'] is None
+    assert new['start_date'] == '2026-01-01 00:00:00'
+    assert {code: c['coupon_id'] for code, c in synced.items()} == {'SAME': 1, 'MORE': 2, 'DUP': 4, 'NEW': 1000}
+
+
+def test_synccoupons_single_coupon_filters(rsu, monkeypatch):
+    gets = []
+    def fake_getcoupons(race_id, coupon_code=None):
+        gets.append(coupon_code)
+        # rsu search matches coupon codes containing the code
+        return [{'coupon_id': 7, 'coupon_code': 'ABC1', 'start_date': '2025-11-01 00:00:00',
+                 'end_date': '2026-12-31 23:59:59', 'max_num_race_registrants': 2, 'coupon_notes': 'Client'}]
+    monkeypatch.setattr(rsu, 'getcoupons', fake_getcoupons)
+    post = FakeCouponPost()
+    monkeypatch.setattr(rsu, '_rsupost', post)
+
+    synced, sent = rsu.synccoupons(12345, [runsignup.couponspec('ABC', '2026-01-01', '2026-12-31', 2, 'Client')])
+
+    assert gets == ['ABC']
+    assert sent == ['ABC']
+    assert synced['ABC']['coupon_id'] == 1000
+
+
 def test_getraceevents(rsu, monkeypatch):
     def fake_rsuget(methodurl):
         assert methodurl == race_url.format(race_id=555)
@@ -201,3 +327,439 @@ def test_rsupost_raises_on_rsu_error_payload(rsu):
 
     with pytest.raises(accessError):
         rsu._rsupost('https://api.runsignup.com/rest/race/1/coupons')
+
+
+# ----------------------------------------------------------------------
+# concurrent page fetching, against local stub server
+# ----------------------------------------------------------------------
+
+class StubRunSignUp():
+    '''
+    local http server which serves paged participants / removed-participants like RunSignUp
+
+    records the pages requested and the max number of requests in flight at the same time
+    '''
+    def __init__(self, numparticipants, delay=0.02):
+        self.numparticipants = numparticipants
+        self.delay = delay
+        self.pages = []
+        self.inflight = 0
+        self.maxinflight = 0
+        self.lock = Lock()
+
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.handle(self)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, request):
+        with self.lock:
+            self.inflight += 1
+            self.maxinflight = max(self.maxinflight, self.inflight)
+        sleep(self.delay)
+
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+        page = int(query['page'][0])
+        perpage = int(query['results_per_page'][0])
+        participants = [{'registration_id': i}
+                        for i in range((page-1)*perpage, min(page*perpage, self.numparticipants))]
+        if url.path.endswith('/removed-participants'):
+            data = [{'event': {'participants': participants}}]
+        else:
+            data = [{'participants': participants}]
+
+        with self.lock:
+            self.pages.append(page)
+            self.inflight -= 1
+        body = dumps(data).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubrsu(monkeypatch):
+    '''create a stub server; call returned function with number of participants'''
+    stubs = []
+    def create(numparticipants):
+        stub = StubRunSignUp(numparticipants)
+        monkeypatch.setattr(runsignup, 'raceparticipants_url', stub.url + '/rest/race/{race_id}/participants')
+        monkeypatch.setattr(runsignup, 'removedparticipants_url', stub.url + '/rest/race/{race_id}/removed-participants')
+        stubs.append(stub)
+        return stub
+    yield create
+    for stub in stubs:
+        stub.shutdown()
+
+
+@pytest.fixture
+def concurrentrsu(app):
+    with app.app_context():
+        client = RunSignUp(concurrency=4, key='testkey', secret='testsecret')
+        client.open()
+        yield client
+        client.close()
+
+
+def test_getraceparticipants_concurrent_stable_order(concurrentrsu, stubrsu):
+    stub = stubrsu(1050)
+
+    participants = concurrentrsu.getraceparticipants(1, 2)
+
+    assert [p['registration_id'] for p in participants] == list(range(1050))
+    assert stub.maxinflight > 1
+    assert stub.maxinflight <= 4
+
+
+def test_getraceparticipants_concurrent_single_page_no_speculation(concurrentrsu, stubrsu):
+    stub = stubrsu(30)
+
+    participants = concurrentrsu.getraceparticipants(1, 2)
+
+    assert len(participants) == 30
+    assert stub.pages == [1]
+
+
+def test_getraceparticipants_concurrent_exact_multiple(concurrentrsu, stubrsu):
+    # last page is full, so an empty page is needed to find the end
+    stub = stubrsu(500)
+
+    participants = concurrentrsu.getraceparticipants(1, 2)
+
+    assert [p['registration_id'] for p in participants] == list(range(500))
+    assert 6 in stub.pages
+
+
+def test_getremovedparticipants_concurrent(concurrentrsu, stubrsu):
+    stubrsu(250)
+
+    removed = concurrentrsu.getremovedparticipants(1, 2)
+
+    assert [p['registration_id'] for p in removed] == list(range(250))
+
+
+def test_getraceparticipants_serial_against_stub(rsu, stubrsu):
+    stub = stubrsu(250)
+
+    participants = rsu.getraceparticipants(1, 2)
+
+    assert len(participants) == 250
+    assert stub.pages == [1, 2, 3]
+    assert stub.maxinflight == 1
+
+
+# ----------------------------------------------------------------------
+# iterator variants
+# ----------------------------------------------------------------------
+
+def test_iterraceparticipants_yields_pages(rsu, stubrsu):
+    stubrsu(250)
+
+    pages = list(rsu.iterraceparticipants(1, 2))
+
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert pages[2][-1] == {'registration_id': 249}
+
+
+def test_iterraceparticipants_prefetches_next_page(rsu, stubrsu):
+    stub = stubrsu(1000)
+
+    pages = rsu.iterraceparticipants(1, 2)
+    first = next(pages)
+    # while the caller handles the first page, the second is fetched in the background
+    sleep(0.2)
+
+    assert len(first) == 100
+    assert stub.pages == [1, 2]
+    pages.close()
+
+
+def test_iterremovedparticipants_yields_pages(concurrentrsu, stubrsu):
+    stubrsu(150)
+
+    pages = list(concurrentrsu.iterremovedparticipants(1, 2))
+
+    assert [len(page) for page in pages] == [100, 50]
+
+
+def test_itercoupons_empty(rsu, monkeypatch):
+    monkeypatch.setattr(rsu, '_rsuget', lambda methodurl, **payload: {'coupons': []})
+
+    assert list(rsu.itercoupons(12345)) == []
+
+
+# ----------------------------------------------------------------------
+# response cache
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def baseget(monkeypatch):
+    '''replace RunSignUp._rsugetjson, which is what actually contacts RunSignUp; returns list of calls'''
+    calls = []
+    def fake_rsuget(self, methodurl, **payload):
+        calls.append((methodurl, payload))
+        if 'participants' in methodurl:
+            return [{'participants': []}]
+        return {'race': {'events': [{'event_id': len(calls)}]}}
+    monkeypatch.setattr(RunSignUp, '_rsugetjson', fake_rsuget)
+    return calls
+
+
+@pytest.fixture
+def cachedrsu(app):
+    with app.app_context():
+        client = RunSignUp(key='testkey', secret='testsecret', api_reg_token='testtoken', api_reg_secret='testregsecret',
+                           cache=LRUResponseCache())
+        client.open()
+        yield client
+        client.close()
+
+
+def test_getraceevents_cached(cachedrsu, baseget):
+    events = cachedrsu.getraceevents(12345)
+    # caller changes to the result don't affect the cache
+    events[0]['event_id'] = 'changed'
+
+    assert cachedrsu.getraceevents(12345) == [{'event_id': 1}]
+    assert cachedrsu.getraceevents(999) == [{'event_id': 2}]
+    assert len(baseget) == 2
+    assert cachedrsu.cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_getraceevents_cache_expires(cachedrsu, baseget, monkeypatch):
+    cachedrsu.getraceevents(12345)
+    now = time()
+    monkeypatch.setattr('contracts.responsecache.time', lambda: now + 60*60 + 1)
+
+    assert cachedrsu.getraceevents(12345) == [{'event_id': 2}]
+
+
+def test_participants_bypass_cache(app, baseget):
+    # even if configured, participant queries aren't cached
+    with app.app_context():
+        client = RunSignUp(key='k', secret='s', cache=LRUResponseCache(),
+                           cachettls={race_url: 60, raceparticipants_url: 60})
+        client.open()
+        try:
+            client.getraceparticipants(12345, 1, modified_after_timestamp=100)
+            client.getraceparticipants(12345, 1, modified_after_timestamp=100)
+        finally:
+            client.close()
+
+        assert len(baseget) == 2
+        assert client.cache.stats()['misses'] == 0
+
+
+def test_paged_requests_have_app_context(app, monkeypatch):
+    # paged requests run in executor threads, and caches such as DbResponseCache need the app context
+    class AppContextCache(LRUResponseCache):
+        def _get(self, key):
+            assert has_app_context()
+            return super()._get(key)
+    monkeypatch.setattr(RunSignUp, '_rsugetjson', lambda self, methodurl, **payload: {'coupons': []})
+    with app.app_context():
+        client = RunSignUp(key='k', secret='s', cache=AppContextCache(), cachettls={coupons_url: 60})
+        client.open()
+        try:
+            assert client.getcoupons(12345) == []
+        finally:
+            client.close()
+
+    assert client.cache.stats()['misses'] == 1
+
+
+def test_no_cache_by_default(rsu, baseget):
+    rsu.getraceevents(12345)
+    rsu.getraceevents(12345)
+
+    assert len(baseget) == 2
+
+
+# ----------------------------------------------------------------------
+# request scheduler
+# ----------------------------------------------------------------------
+
+class FakeClock():
+    '''monotonic clock which only advances when sleep() is called'''
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeSession():
+    '''returns queued responses (status, headers) or raises queued exceptions, for get and post'''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def _respond(self, method, url, **kwargs):
+        self.calls.append(method)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        status, headers = response
+        return Mock(status_code=status, headers=headers, url=url)
+
+    def get(self, url, **kwargs):
+        return self._respond('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond('post', url, **kwargs)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def scheduler(clock, **kwargs):
+    return RequestScheduler(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_tokenbucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    for i in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(1.0, abs=0.01)
+
+
+def test_tokenbucket_pause(clock):
+    bucket = TokenBucket(rate=100, capacity=10, clock=clock, sleep=clock.sleep)
+    bucket.pause(5)
+    bucket.acquire()
+    assert clock.now >= 105
+
+
+def test_scheduler_retries_5xx_with_backoff(clock):
+    session = FakeSession((503, {}), (502, {}), (200, {}))
+    resp = scheduler(clock, backoffbase=1).request(session, 'GET', race_url.format(race_id=1))
+
+    assert resp.status_code == 200
+    assert len(session.calls) == 3
+    # full jitter, within doubling caps
+    assert 0 <= clock.sleeps[0] <= 1 and 0 <= clock.sleeps[1] <= 2
+
+
+def test_scheduler_honors_retry_after(clock):
+    session = FakeSession((429, {'Retry-After': '7'}), (200, {}))
+    thisscheduler = scheduler(clock)
+    resp = thisscheduler.request(session, 'GET', race_url.format(race_id=1))
+
+    assert resp.status_code == 200
+    assert clock.sleeps[0] == 7
+    # other threads are held too
+    assert thisscheduler.bucket.pauseduntil == pytest.approx(107)
+
+
+def test_scheduler_retry_after_http_date(clock):
+    inaminute = datetime.now(timezone.utc) + timedelta(seconds=60)
+    session = FakeSession((503, {'Retry-After': format_datetime(inaminute, usegmt=True)}), (200, {}))
+    scheduler(clock, backoffmax=300).request(session, 'GET', race_url.format(race_id=1))
+
+    assert 55 < clock.sleeps[0] <= 60
+
+
+def test_scheduler_gives_up_after_maxretries(clock):
+    session = FakeSession(*[(500, {})]*3)
+    resp = scheduler(clock, maxretries=2).request(session, 'GET', race_url.format(race_id=1))
+
+    assert resp.status_code == 500
+    assert len(session.calls) == 3
+
+
+def test_scheduler_post_not_retried_on_5xx(clock):
+    session = FakeSession((500, {}), (200, {}))
+    resp = scheduler(clock).request(session, 'POST', coupons_url.format(race_id=1))
+
+    assert resp.status_code == 500
+    assert session.calls == ['post']
+
+
+def test_scheduler_post_retried_on_429(clock):
+    session = FakeSession((429, {}), (200, {}))
+    resp = scheduler(clock).request(session, 'POST', coupons_url.format(race_id=1))
+
+    assert resp.status_code == 200
+
+
+def test_scheduler_retries_connection_error(clock):
+    session = FakeSession(ConnectionError('reset'), (200, {}))
+    resp = scheduler(clock).request(session, 'GET', race_url.format(race_id=1))
+
+    assert resp.status_code == 200
+
+
+def test_scheduler_post_not_retried_on_read_timeout(clock):
+    # RunSignUp may have created the coupon before the response timed out
+    session = FakeSession(ReadTimeout('read timed out'), (200, {}))
+    with pytest.raises(ReadTimeout):
+        scheduler(clock).request(session, 'POST', coupons_url.format(race_id=1))
+
+    assert session.calls == ['post']
+
+
+def test_scheduler_post_not_retried_on_dropped_connection(clock):
+    session = FakeSession(ConnectionError('connection aborted'), (200, {}))
+    with pytest.raises(ConnectionError):
+        scheduler(clock).request(session, 'POST', coupons_url.format(race_id=1))
+
+    assert session.calls == ['post']
+
+
+def test_scheduler_post_retried_on_connect_failure(clock):
+    refused = ConnectionError(MaxRetryError(None, coupons_url, NewConnectionError(None, 'connection refused')))
+    session = FakeSession(ConnectTimeout('connect timed out'), refused, (200, {}))
+    resp = scheduler(clock).request(session, 'POST', coupons_url.format(race_id=1))
+
+    assert resp.status_code == 200
+    assert session.calls == ['post', 'post', 'post']
+
+
+def test_scheduler_stats_by_endpoint(clock):
+    thisscheduler = scheduler(clock)
+    session = FakeSession((503, {'Retry-After': '1'}), (200, {}), (200, {}))
+    thisscheduler.request(session, 'GET', raceparticipants_url.format(race_id=1), params={'page': 1})
+    thisscheduler.request(session, 'GET', race_url.format(race_id=2))
+
+    stats = thisscheduler.stats()
+    assert stats['participants']['count'] == 2
+    assert stats['participants']['errors'] == 1
+    assert stats['participants']['retries'] == 1
+    assert stats['race']['count'] == 1
+
+
+def test_rsuget_retries_through_scheduler(app, clock):
+    ok = Mock(status_code=200, headers={})
+    ok.json.return_value = {'race': {'events': []}}
+    responses = [Mock(status_code=429, headers={'Retry-After': '1'}, url='x'), ok]
+    with app.app_context():
+        client = RunSignUp(key='k', secret='s', scheduler=scheduler(clock))
+        client.open()
+        client.session.get = lambda url, **kwargs: responses.pop(0)
+
+        assert client.getraceevents(1) == []
+        assert clock.sleeps == [1]
+        client.close()
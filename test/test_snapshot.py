@@ -0,0 +1,114 @@
+'''
+test_snapshot - test contracts.snapshot
+=========================================================
+'''
+
+# standard
+from datetime import date, datetime
+
+# pypi
+import numpy as np
+import pytest
+
+# homegrown
+from contracts import snapshot
+from contracts.snapshot import write_regsnapshot, load_regsnapshot, fresh_regsnapshot, event_racedates
+from contracts.caching import regcache_counts
+from contracts.dbmodel import db, SponsorRace, SponsorRaceRegCache, SponsorRaceRegPii
+
+
+RACEDATES = {11: ('5K', date(2026, 6, 1)), 12: ('10K', date(2026, 6, 2))}
+
+
+@pytest.fixture
+def race(bare_dbapp, tmp_path):
+    bare_dbapp.config['REGCACHE_SNAPSHOT_DIR'] = str(tmp_path)
+    race = SponsorRace(race='Test Race', couponprovider='RunSignUp', couponproviderid='1234',
+                       display=True, timezone='America/New_York')
+    db.session.add(race)
+    rows = [
+        # registration_id, event_id, registration_date, gender, dob, is_active
+        (1, 11, datetime(2026, 1, 2, 10), 'M', date(1990, 6, 1), True),
+        (2, 11, datetime(2026, 1, 2, 23, 59), 'F', date(1990, 6, 2), True),
+        (3, 11, datetime(2026, 1, 3, 0, 1), 'f', None, True),
+        (4, 11, datetime(2026, 1, 3, 9), 'M', date(2000, 1, 1), False),
+        (5, 12, datetime(2026, 1, 2, 8), None, date(2000, 1, 1), True),
+        # other race's event
+        (6, 13, datetime(2026, 1, 2, 8), 'M', date(2000, 1, 1), True),
+    ]
+    db.session.add_all([SponsorRaceRegCache(registration_id=regid, event_id=event_id, registration_date=regdate,
+                                            is_active=is_active)
+                        for regid, event_id, regdate, gender, dob, is_active in rows])
+    db.session.add_all([SponsorRaceRegPii(registration_id=regid, gender=gender, dob=dob)
+                        for regid, event_id, regdate, gender, dob, is_active in rows])
+    db.session.commit()
+    return race
+
+
+def test_event_racedates():
+    events = [{'event_id': 11, 'name': '5K', 'start_time': '6/1/2026 08:00', 'end_time': None},
+              {'event_id': 12, 'name': 'Ultra', 'start_time': '6/1/2026 06:00', 'end_time': '6/2/2026 06:00'}]
+
+    assert event_racedates(events) == {11: ('5K', date(2026, 6, 1)), 12: ('Ultra', date(2026, 6, 2))}
+
+
+def test_write_and_load_regsnapshot(race):
+    assert load_regsnapshot(race.id) is None
+
+    numrows = write_regsnapshot(race, RACEDATES)
+    snap = load_regsnapshot(race.id)
+
+    assert numrows == 5
+    assert isinstance(snap.data, np.memmap)
+    assert snap.data.shape == (5, 5)
+    # each column is contiguous
+    assert snap.column('event_id').flags['C_CONTIGUOUS']
+    assert sorted(snap.column('event_id').tolist()) == [11, 11, 11, 11, 12]
+    ages = sorted(snap.column('age').tolist())
+    # born 6/1/1990 is 36 on 6/1/2026, born 6/2/1990 is 35, unknown dob is -1
+    assert ages == [-1, 26, 26, 35, 36]
+    genders = sorted(snap.column('gender').tolist())
+    assert [snapshot.GENDERS[g] for g in genders] == ['', 'M', 'M', 'F', 'F']
+    assert snap.events() == RACEDATES
+    assert snap.meta['race'] == 'Test Race'
+
+
+def test_snapshot_regcounts_match_cache(race):
+    write_regsnapshot(race, RACEDATES)
+    snap = load_regsnapshot(race.id)
+
+    assert snap.regcounts([11, 12]) == regcache_counts([11, 12])
+    assert snap.regcounts([12]) == [(12, '2026-01-02', 1)]
+    assert snap.regcounts([99]) == []
+
+
+def test_empty_snapshot(race):
+    write_regsnapshot(race, {99: ('Empty', date(2026, 6, 1))})
+    snap = load_regsnapshot(race.id)
+
+    assert snap.data.shape == (5, 0)
+    assert snap.regcounts([99]) == []
+
+
+def test_load_regsnapshot_reloads_replaced_file(race):
+    write_regsnapshot(race, RACEDATES)
+    first = load_regsnapshot(race.id)
+    assert load_regsnapshot(race.id) is first
+
+    write_regsnapshot(race, {11: RACEDATES[11]})
+    second = load_regsnapshot(race.id)
+
+    assert second is not first
+    assert second.data.shape == (5, 4)
+
+
+def test_fresh_regsnapshot_requires_maxage(race, monkeypatch):
+    write_regsnapshot(race, RACEDATES)
+    assert fresh_regsnapshot(race.id) is None
+
+    race_app = snapshot.current_app
+    monkeypatch.setitem(race_app.config, 'REGCACHE_SNAPSHOT_MAXAGE', 60)
+    assert fresh_regsnapshot(race.id) is not None
+
+    monkeypatch.setattr(snapshot, 'time', lambda: load_regsnapshot(race.id).meta['created'] + 61)
+    assert fresh_regsnapshot(race.id) is None